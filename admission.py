@@ -0,0 +1,185 @@
+# admission.py
+# Admission control for the ingest endpoints. New work is refused with 429 and a
+# Retry-After while the backlog, the free disk under uploads/ or the estimated
+# time to drain the queue is over its limit, or while an ingest profile is over
+# its quota. A surge then waits at the clients instead of filling the disk and the broker.
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Optional
+from database import get_db_connection
+from processing import PIPELINE_STAGES
+from tasks import celery_app
+
+# Each limit is disabled with 0
+MAX_QUEUED_JOBS = int(os.environ.get("VIML_MAX_QUEUED_JOBS", "1000"))
+MIN_FREE_DISK_BYTES = int(os.environ.get("VIML_MIN_FREE_DISK_BYTES", str(10 * 1024 ** 3)))
+MAX_DRAIN_SECONDS = int(os.environ.get("VIML_MAX_DRAIN_SECONDS", str(6 * 3600)))
+# Queued + processing jobs allowed per ingest profile (config["profile"]), e.g.
+# {"archive-backfill": 200, "*": 500}; "*" applies to profiles not listed
+PROFILE_QUOTAS = json.loads(os.environ.get("VIML_PROFILE_QUOTAS", "{}"))
+
+# Run times of this many recently finished jobs give the per-job drain estimate
+RUN_TIME_SAMPLE = 100
+# Jobs the workers can run at once; 0 asks the running workers (cached for
+# CAPACITY_CACHE_SECONDS). Set it where the API cannot reach the workers' broker.
+WORKER_CAPACITY = int(os.environ.get("VIML_WORKER_CAPACITY", "0"))
+CAPACITY_CACHE_SECONDS = 60
+INSPECT_TIMEOUT_SECONDS = 1.0
+DISK_RETRY_SECONDS = 300
+DEFAULT_RETRY_SECONDS = 30
+MIN_RETRY_SECONDS = 5
+MAX_RETRY_SECONDS = 900
+# The middleware and the ingest handler both check each request, and a surge
+# checks many at once, so the load is read from the jobs table at most this often
+LOAD_CACHE_SECONDS = float(os.environ.get("VIML_LOAD_CACHE_SECONDS", "2"))
+
+class AdmissionDenied(Exception):
+    """Raised when new work would overload the system; reason is queue, drain, disk or quota."""
+
+    def __init__(self, reason: str, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = int(min(max(retry_after, MIN_RETRY_SECONDS), MAX_RETRY_SECONDS))
+
+    def content(self) -> dict:
+        return {"detail": self.detail, "reason": self.reason, "retry_after": self.retry_after}
+
+_capacity_lock = threading.Lock()
+_capacity_cache = {"checked_at": None, "capacity": None, "refreshing": False}
+
+def _inspect_capacity() -> Optional[int]:
+    """
+    Pool slots of the running workers for the pipeline stage with the fewest of
+    them, since every job needs each stage once. None if no worker answers.
+    """
+    inspect = celery_app.control.inspect(timeout=INSPECT_TIMEOUT_SECONDS)
+    stats = inspect.stats() or {}
+    active_queues = inspect.active_queues() or {}
+    if not stats:
+        return None
+    slots = {stage: 0 for stage in PIPELINE_STAGES}
+    for worker, info in stats.items():
+        concurrency = info.get('pool', {}).get('max-concurrency', 1)
+        # Lane queues are "<stage>" or "<stage>.<priority>"
+        stages = {queue['name'].split('.')[0] for queue in active_queues.get(worker, [])}
+        for stage in stages & set(slots):
+            slots[stage] += concurrency
+    return min(slots.values())
+
+def _refresh_capacity():
+    try:
+        capacity = _inspect_capacity()
+    except Exception as e:
+        print(f"Could not inspect worker capacity: {e}")
+        capacity = None
+    with _capacity_lock:
+        _capacity_cache.update(checked_at=time.monotonic(), capacity=capacity, refreshing=False)
+
+def worker_capacity() -> Optional[int]:
+    """
+    Jobs the workers can run at once: VIML_WORKER_CAPACITY, else the last answer
+    from the workers. Asking them can take seconds, so it is refreshed in the
+    background and admission never waits for it.
+    """
+    if WORKER_CAPACITY:
+        return WORKER_CAPACITY
+    with _capacity_lock:
+        checked_at = _capacity_cache["checked_at"]
+        stale = checked_at is None or time.monotonic() - checked_at > CAPACITY_CACHE_SECONDS
+        if stale and not _capacity_cache["refreshing"]:
+            _capacity_cache["refreshing"] = True
+            threading.Thread(target=_refresh_capacity, daemon=True).start()
+        return _capacity_cache["capacity"]
+
+def load_state(conn) -> dict:
+    """
+    Queued / processing counts, the recent average run time (None without history)
+    and the worker capacity. Jobs count as queued until their first stage starts.
+    """
+    counts = {row['status']: row['n'] for row in conn.execute(
+        "SELECT status, COUNT(*) AS n FROM jobs WHERE status IN ('queued', 'processing') GROUP BY status"
+    )}
+    avg_run = conn.execute("""
+        SELECT AVG(run) FROM (
+            SELECT (julianday(finished_at) - julianday(started_at)) * 86400 AS run
+            FROM jobs WHERE status = 'completed' AND started_at IS NOT NULL
+            ORDER BY finished_at DESC LIMIT ?
+        )
+    """, (RUN_TIME_SAMPLE,)).fetchone()[0]
+    queued = counts.get('queued', 0)
+    processing = counts.get('processing', 0)
+    # Without an answer from the workers, the jobs running right now are the best estimate
+    capacity = worker_capacity()
+    workers = max(capacity if capacity is not None else processing, 1)
+    return {
+        "queued": queued,
+        "processing": processing,
+        "avg_run_seconds": avg_run,
+        "drain_seconds": queued * avg_run / workers if avg_run else None,
+        "workers": workers
+    }
+
+_load_lock = threading.Lock()
+_load_cache = {"checked_at": None, "state": None}
+
+def current_load() -> dict:
+    """load_state, reused for LOAD_CACHE_SECONDS. Jobs queued meanwhile are counted on the next read."""
+    with _load_lock:
+        checked_at = _load_cache["checked_at"]
+        if checked_at is not None and time.monotonic() - checked_at <= LOAD_CACHE_SECONDS:
+            return _load_cache["state"]
+    conn = get_db_connection()
+    try:
+        state = load_state(conn)
+    finally:
+        conn.close()
+    with _load_lock:
+        _load_cache.update(checked_at=time.monotonic(), state=state)
+    return state
+
+def profile_quota(profile: Optional[str]) -> int:
+    if not profile:
+        return 0
+    return int(PROFILE_QUOTAS.get(profile, PROFILE_QUOTAS.get("*", 0)))
+
+def check_admission(upload_folder: str, new_jobs: int = 1, incoming_bytes: int = 0,
+                    profile: Optional[str] = None):
+    """Raises AdmissionDenied if new_jobs jobs (incoming_bytes in total) should not be accepted now."""
+    if MIN_FREE_DISK_BYTES:
+        free = shutil.disk_usage(upload_folder).free
+        if free - incoming_bytes < MIN_FREE_DISK_BYTES:
+            raise AdmissionDenied("disk", f"Not enough free disk for uploads ({free} bytes free)", DISK_RETRY_SECONDS)
+
+    state = current_load()
+    quota = profile_quota(profile)
+    active = None
+    if quota:
+        conn = get_db_connection()
+        try:
+            active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE profile = ? AND status IN ('queued', 'processing')", (profile,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    # Seconds for the workers to get through n more jobs
+    per_job = (state['avg_run_seconds'] or DEFAULT_RETRY_SECONDS) / state['workers']
+
+    excess = state['queued'] + new_jobs - MAX_QUEUED_JOBS
+    if MAX_QUEUED_JOBS and excess > 0:
+        raise AdmissionDenied("queue", f"Too many queued jobs ({state['queued']}, limit {MAX_QUEUED_JOBS})",
+                              excess * per_job)
+
+    if MAX_DRAIN_SECONDS and state['drain_seconds'] is not None:
+        drain = state['drain_seconds'] + new_jobs * per_job
+        if drain > MAX_DRAIN_SECONDS:
+            raise AdmissionDenied("drain", f"Backlog would take {int(drain)}s to drain (limit {MAX_DRAIN_SECONDS}s)",
+                                  drain - MAX_DRAIN_SECONDS)
+
+    if quota and active + new_jobs > quota:
+        raise AdmissionDenied("quota", f"Profile '{profile}' has {active} active jobs (quota {quota})",
+                              (active + new_jobs - quota) * per_job)
@@ -0,0 +1,305 @@
+# benchmark.py
+# End-to-end benchmarks on synthetic data, compared against a stored baseline.
+#
+#   python benchmark.py                    # full size: 1,000,000 occurrences
+#   python benchmark.py --quick            # 100,000 occurrences, 60 s video
+#   python benchmark.py --save-baseline    # record this box's numbers
+#
+# Everything runs against a throwaway database and workspace, never video_metadata.db.
+# The synthetic video is a news-style clip made with ffmpeg test sources: a chyron
+# with a new name every segment and a tone that changes pitch with the speaker.
+# Without ffmpeg (or in LITE_MODE) the detection stages run on a placeholder file
+# and their mocks, so the DB, API and correlation numbers can be tracked on any box.
+# Baselines are per machine and per mode (lite/full); a result slower than the
+# baseline by more than --tolerance is a regression and the exit status is 1.
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import numpy as np
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_TOLERANCE = 0.25
+# Slowdowns smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR_SECONDS = 0.01
+
+SEGMENT_SECONDS = 10
+NAMES = ["Jane Doe", "John Smith", "Maria Garcia", "Wei Chen", "Amara Okafor", "Lars Nilsson"]
+# Share of all occurrences on one long recording (a 24 h channel capture)
+LONG_VIDEO_SHARE = 0.1
+ENDPOINT_REPEATS = 5
+
+# --- Synthetic media ---
+
+def make_video(path: str, duration: int) -> bool:
+    """Writes a synthetic 1080p news clip; False if ffmpeg is not available."""
+    if not shutil.which('ffmpeg'):
+        with open(path, 'wb') as f:
+            f.write(b"mock_video_content")
+        return False
+    # Lower third as in OCR_CROP_AREA, one name per segment
+    chyrons = ",".join(
+        f"drawtext=text='{NAMES[i % len(NAMES)]}':x=80:y=930:fontsize=72:fontcolor=white:"
+        f"enable='between(t,{start},{start + SEGMENT_SECONDS})'"
+        for i, start in enumerate(range(0, duration, SEGMENT_SECONDS))
+    )
+    video_filter = f"drawbox=x=0:y=880:w=iw:h=200:color=navy@0.85:t=fill,{chyrons}"
+    # Two "speakers" alternating by segment
+    tone = f"sin(2*PI*if(lt(mod(t,{2 * SEGMENT_SECONDS}),{SEGMENT_SECONDS}),180,260)*t)"
+    command = [
+        'ffmpeg', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=25:duration={duration}',
+        '-f', 'lavfi', '-i', f"aevalsrc='{tone}':s=16000:d={duration}",
+        '-vf', video_filter, '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path
+    ]
+    proc = subprocess.run(command, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(f"ffmpeg could not make the synthetic video: {proc.stderr[-500:]}")
+        with open(path, 'wb') as f:
+            f.write(b"mock_video_content")
+        return False
+    return True
+
+def make_detections(duration: int):
+    """Synthetic stage outputs shaped like run_stage's: (ocr, face, audio)."""
+    rng = np.random.default_rng(7)
+    encodings = {name: rng.normal(size=128) for name in NAMES}
+    ocr, faces, speakers = [], {}, []
+    for i, start in enumerate(range(0, duration, SEGMENT_SECONDS)):
+        name = NAMES[i % len(NAMES)]
+        for t in range(start, min(start + SEGMENT_SECONDS, duration), 2):
+            ocr.append((float(t), name.upper()))
+        for t in range(start, min(start + SEGMENT_SECONDS, duration)):
+            faces[float(t)] = [{"location": (100, 900, 400, 600), "encoding": encodings[name] + rng.normal(scale=0.01, size=128)}]
+        speakers.append((float(start), float(min(start + SEGMENT_SECONDS, duration)), f"SPEAKER_{i % 2:02d}"))
+    return ocr, faces, speakers
+
+def make_database(occurrences: int, videos: int, persons_per_video: int = 8):
+    """Fills the (empty) benchmark database with occurrences spread over videos."""
+    from database import get_db_connection
+    random.seed(7)
+    long_count = int(occurrences * LONG_VIDEO_SHARE)
+    per_video = (occurrences - long_count) // videos
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for v in range(videos + 1):
+            video_path = "channel_24h.mp4" if v == videos else f"news_{v:05d}.mp4"
+            count = long_count if v == videos else per_video
+            person_ids = []
+            for p in range(persons_per_video):
+                cursor.execute("INSERT INTO persons (video_path, name, role) VALUES (?, ?, ?)",
+                               (video_path, f"Person {v}-{p}", random.choice(("host", "guest", "Unknown"))))
+                person_ids.append(cursor.lastrowid)
+            rows = []
+            for k in range(count):
+                start = k * 2.0 + random.random()
+                rows.append((video_path, random.choice(person_ids), start, start + 1.0,
+                             random.choice(("ocr", "face", "voice")), round(random.uniform(50, 99), 1), "",
+                             random.choice(("pending", "pending", "approved", "rejected")), f"job-{v}"))
+            cursor.executemany(
+                "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, end_seconds, method_used, confidence, details, review_status, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+# --- Measurements ---
+
+def timed(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+def bench_stages(video_path: str, duration: int) -> dict:
+    from processing import run_stage, DETECTION_STAGES
+    results = {}
+    for stage in DETECTION_STAGES:
+        seconds = timed(run_stage, stage, video_path)
+        results[f"stage_{stage}"] = {"seconds": seconds, "rate": duration / seconds, "unit": "video s/s"}
+    return results
+
+def bench_correlate(duration: int) -> dict:
+    from processing import _correlate_and_store
+    ocr, faces, speakers = make_detections(duration)
+    items = len(ocr) + len(faces) + len(speakers)
+    # The second run replaces the first one's rows, as a retry would
+    _correlate_and_store("bench_correlate.mp4", ocr, faces, speakers, job_id="bench-correlate")
+    seconds = timed(_correlate_and_store, "bench_correlate.mp4", ocr, faces, speakers, job_id="bench-correlate")
+    return {"correlate_and_store": {"seconds": seconds, "rate": items / seconds, "unit": "detections/s"}}
+
+def bench_vtt(long_occurrences: int) -> dict:
+    from viml_generator import generate_vtt_from_db
+    results = {}
+    for compact in (False, True):
+        seconds = timed(generate_vtt_from_db, "channel_24h.mp4", compact=compact)
+        results["vtt_compact" if compact else "vtt"] = {
+            "seconds": seconds, "rate": long_occurrences / seconds, "unit": "occurrences/s"}
+    return results
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_api():
+    """Runs the API in a background thread; returns (base url, server)."""
+    import uvicorn
+    os.makedirs(os.path.join("viml_ui", "static"), exist_ok=True)
+    from main import app
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+def _get(url: str) -> float:
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=600) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+def bench_endpoints(base_url: str, include_network: bool) -> dict:
+    from database import get_db_connection, bump_data_version
+
+    def stale_stats():
+        # Forces the stats cache to recompute, as after any write
+        conn = get_db_connection()
+        bump_data_version(conn)
+        conn.commit()
+        conn.close()
+
+    with urllib.request.urlopen(f"{base_url}/v1/review/queue?status=pending&limit=500", timeout=600) as resp:
+        next_cursor = resp.headers.get("X-Next-Cursor")
+    requests = {
+        "search": ("/v1/search?" + urllib.parse.urlencode({"name": "Person 42-"}), None),
+        "search_video": ("/v1/search?" + urllib.parse.urlencode({"name": "Person", "video_filename": "channel_24h.mp4"}), None),
+        "presence": ("/v1/videos/channel_24h.mp4/presence?t0=3600&t1=3900", None),
+        "review_queue": ("/v1/review/queue?status=pending&limit=500", None),
+        "review_queue_next_page": ("/v1/review/queue?" + urllib.parse.urlencode(
+            {"status": "pending", "limit": 500, "cursor": next_cursor or ""}), None),
+        "review_queue_grouped": ("/v1/review/queue?status=pending&grouped=true&limit=100", None),
+        "analytics_stats": ("/v1/analytics/stats", stale_stats),
+        "analytics_stats_cached": ("/v1/analytics/stats", None),
+    }
+    # The co-occurrence graph joins every pair of occurrences within a video
+    if include_network:
+        requests["analytics_network"] = ("/v1/analytics/network", None)
+
+    results = {}
+    for name, (path, before) in requests.items():
+        samples = []
+        for _ in range(ENDPOINT_REPEATS):
+            if before:
+                before()
+            samples.append(_get(base_url + path))
+        seconds = statistics.median(samples)
+        results[f"api_{name}"] = {"seconds": seconds, "rate": 1 / seconds, "unit": "requests/s"}
+    return results
+
+# --- Baselines ---
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Prints each result against the baseline; returns the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<28}{'seconds':>12}{'baseline':>12}{'change':>9}  throughput")
+    for name, result in results.items():
+        base = baseline.get(name)
+        change = ""
+        if base:
+            ratio = result["seconds"] / base["seconds"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            if ratio > 1 + tolerance and result["seconds"] - base["seconds"] > NOISE_FLOOR_SECONDS:
+                regressions.append(name)
+                change += " ❌"
+        base_text = f"{base['seconds']:.4f}" if base else "-"
+        print(f"{name:<28}{result['seconds']:>12.4f}{base_text:>12}{change:>9}  {result['rate']:,.1f} {result['unit']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="VIML end-to-end benchmarks on synthetic data")
+    parser.add_argument("--quick", action="store_true", help="smaller data set for a fast check")
+    parser.add_argument("--occurrences", type=int, help="occurrences in the synthetic database")
+    parser.add_argument("--videos", type=int, help="videos the occurrences are spread over")
+    parser.add_argument("--duration", type=int, help="seconds of synthetic video")
+    parser.add_argument("--network", action="store_true", help="also time /v1/analytics/network (slow at scale)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as this mode's baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    occurrences = args.occurrences or (100_000 if args.quick else 1_000_000)
+    videos = args.videos or max(occurrences // 2000, 1)
+    duration = args.duration or (60 if args.quick else 600)
+    baseline_path = os.path.abspath(args.baseline)
+
+    # The app uses relative paths (uploads/, generated/, templates), so run from the
+    # repo with the database swapped for a throwaway one
+    workspace = tempfile.mkdtemp(prefix="viml_bench_")
+    import database
+    database.DATABASE_NAME = os.path.join(workspace, "bench.db")
+    database.init_db()
+    from processing import LITE_MODE
+    mode = "lite" if LITE_MODE else "full"
+
+    try:
+        print(f"--- VIML benchmark ({mode} mode, {occurrences:,} occurrences over {videos:,} videos) ---")
+        video_path = os.path.join(workspace, "synthetic_news.mp4")
+        real_video = make_video(video_path, duration)
+        print(f"[1] Synthetic video: {duration}s, {'ffmpeg' if real_video else 'placeholder (no ffmpeg)'}")
+        start = time.perf_counter()
+        make_database(occurrences, videos)
+        print(f"[2] Synthetic database in {time.perf_counter() - start:.1f}s")
+
+        results = {}
+        print("[3] Detection stages...")
+        results.update(bench_stages(video_path, duration))
+        print("[4] Correlation...")
+        results.update(bench_correlate(duration))
+        print("[5] VIML generation...")
+        results.update(bench_vtt(int(occurrences * LONG_VIDEO_SHARE)))
+        print("[6] API endpoints...")
+        base_url, server = start_api()
+        try:
+            results.update(bench_endpoints(base_url, args.network))
+        finally:
+            server.should_exit = True
+
+        baselines = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baselines = json.load(f)
+        # Numbers only compare at the same size
+        key = f"{mode}:{occurrences}:{videos}:{duration}"
+        regressions = compare(results, baselines.get(key, {}), args.tolerance)
+
+        if args.save_baseline:
+            baselines[key] = results
+            with open(baseline_path, 'w') as f:
+                json.dump(baselines, f, indent=2, sort_keys=True)
+            print(f"\n✅ Baseline saved to {baseline_path} ({key})")
+        elif key not in baselines:
+            print(f"\nNo baseline for {key}; record one with --save-baseline")
+        elif regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        else:
+            print("\n✅ No regressions")
+        return 0
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
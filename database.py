@@ -1,19 +1,193 @@
 # database.py
 import sqlite3
+import time
+from metrics import METRICS_ENABLED, observe_query
 
 DATABASE_NAME = "video_metadata.db"
 
-def get_db_connection():
-    """Establishes a connection to the database."""
-    conn = sqlite3.connect(DATABASE_NAME)
+# Duration given to point detections (an OCR reading, a single face sample)
+POINT_EVENT_SECONDS = 1.0
+
+class _TimedCursor(sqlite3.Cursor):
+    """Records each statement's execution time (see metrics.SQL_SECONDS)."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query(sql, time.perf_counter() - start)
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    # The C implementations of these do not go through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def get_db_connection(check_same_thread: bool = True):
+    """
+    Establishes a connection to the database.
+    Pass check_same_thread=False for connections handed between threads
+    (e.g. generators consumed by a streaming response); use them serially only.
+    """
+    # Wait for concurrent writers (API review vs. workers) instead of failing fast
+    conn = sqlite3.connect(DATABASE_NAME, timeout=30, check_same_thread=check_same_thread,
+                           factory=_TimedConnection if METRICS_ENABLED else sqlite3.Connection)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_data_version(conn) -> int:
+    """Returns the current data version (see the data_version table)."""
+    row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    return row['version'] if row else 0
+
+def bump_data_version(conn):
+    """
+    Marks cached aggregates as stale.
+    Call inside the writer's transaction so the bump commits with the data.
+    """
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+
+def get_video_version(conn, video_path: str) -> int:
+    """The VIML version of one video: bumped by every write to its occurrences or their persons' names."""
+    row = conn.execute("SELECT viml_version FROM videos WHERE video_path = ?", (video_path,)).fetchone()
+    return row['viml_version'] if row else 0
+
+def has_span_index(conn) -> bool:
+    """True if the occurrence_spans R*Tree exists (SQLite may be built without it)."""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'occurrence_spans'").fetchone()
+    return row is not None
+
+def _init_viml_versions(cursor):
+    """
+    Per-video VIML versions (videos.viml_version), kept by triggers so every writer
+    is covered. A write to one video's occurrences, or a rename of a person seen in
+    it, changes only that video's version, so caches of other videos stay valid.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS videos (
+            video_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_path TEXT NOT NULL UNIQUE
+        )
+    ''')
+    try:
+        cursor.execute("ALTER TABLE videos ADD COLUMN viml_version INTEGER NOT NULL DEFAULT 0")
+    except sqlite3.OperationalError: pass
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS occurrences_viml_insert AFTER INSERT ON occurrences
+        BEGIN
+            INSERT INTO videos (video_path, viml_version) VALUES (NEW.video_path, 1)
+            ON CONFLICT(video_path) DO UPDATE SET viml_version = viml_version + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS occurrences_viml_update
+        AFTER UPDATE OF video_path, person_id, timestamp_seconds, end_seconds, method_used, confidence, review_status
+        ON occurrences
+        BEGIN
+            INSERT OR IGNORE INTO videos (video_path) VALUES (NEW.video_path);
+            UPDATE videos SET viml_version = viml_version + 1 WHERE video_path IN (OLD.video_path, NEW.video_path);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS occurrences_viml_delete AFTER DELETE ON occurrences
+        BEGIN
+            UPDATE videos SET viml_version = viml_version + 1 WHERE video_path = OLD.video_path;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS persons_viml_rename AFTER UPDATE OF name ON persons
+        WHEN NEW.name IS NOT OLD.name
+        BEGIN
+            UPDATE videos SET viml_version = viml_version + 1
+            WHERE video_path IN (SELECT video_path FROM occurrences WHERE person_id = NEW.person_id);
+        END
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO videos (video_path) SELECT DISTINCT video_path FROM occurrences")
+
+def _init_span_index(cursor):
+    """
+    R*Tree over occurrence intervals, 2-D: (video_id, [start, end]).
+    Kept in sync with occurrences by triggers, so every writer is covered.
+    R*Tree coordinates are float32; queries must re-check against occurrences.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS videos (
+            video_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_path TEXT NOT NULL UNIQUE
+        )
+    ''')
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS occurrence_spans USING rtree(
+                id, video_min, video_max, start_seconds, end_seconds
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"R*Tree unavailable, span queries will use B-tree indexes: {e}")
+        return
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS occurrences_spans_insert AFTER INSERT ON occurrences
+        WHEN NEW.end_seconds IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO videos (video_path) VALUES (NEW.video_path);
+            INSERT INTO occurrence_spans (id, video_min, video_max, start_seconds, end_seconds)
+            SELECT NEW.occurrence_id, video_id, video_id, NEW.timestamp_seconds, NEW.end_seconds
+            FROM videos WHERE video_path = NEW.video_path;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS occurrences_spans_update
+        AFTER UPDATE OF video_path, timestamp_seconds, end_seconds ON occurrences
+        BEGIN
+            DELETE FROM occurrence_spans WHERE id = OLD.occurrence_id;
+            INSERT OR IGNORE INTO videos (video_path) VALUES (NEW.video_path);
+            INSERT INTO occurrence_spans (id, video_min, video_max, start_seconds, end_seconds)
+            SELECT NEW.occurrence_id, video_id, video_id, NEW.timestamp_seconds, NEW.end_seconds
+            FROM videos WHERE video_path = NEW.video_path AND NEW.end_seconds IS NOT NULL;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS occurrences_spans_delete AFTER DELETE ON occurrences
+        BEGIN
+            DELETE FROM occurrence_spans WHERE id = OLD.occurrence_id;
+        END
+    ''')
+
+    # Backfill rows written before the index existed
+    cursor.execute("INSERT OR IGNORE INTO videos (video_path) SELECT DISTINCT video_path FROM occurrences")
+    cursor.execute('''
+        INSERT INTO occurrence_spans (id, video_min, video_max, start_seconds, end_seconds)
+        SELECT o.occurrence_id, v.video_id, v.video_id, o.timestamp_seconds, o.end_seconds
+        FROM occurrences o
+        JOIN videos v ON v.video_path = o.video_path
+        WHERE o.end_seconds IS NOT NULL
+          AND o.occurrence_id NOT IN (SELECT id FROM occurrence_spans)
+    ''')
+
 def init_db():
     """Initializes all database tables."""
     conn = get_db_connection()
     cursor = conn.cursor()
 
+    # WAL lets readers proceed while a writer (e.g. a large merge) holds the lock.
+    # The setting is persistent, so it only needs to be applied once per database.
+    cursor.execute("PRAGMA journal_mode=WAL")
+
     # Central directory for every unique individual
     # Create tables
     cursor.execute('''
@@ -43,6 +217,7 @@ def init_db():
             video_path TEXT NOT NULL,
             person_id INTEGER NOT NULL,
             timestamp_seconds REAL NOT NULL,
+            end_seconds REAL,
             method_used TEXT NOT NULL CHECK(method_used IN ('ocr', 'face', 'voice')),
             confidence REAL,
             details TEXT,
@@ -60,10 +235,102 @@ def init_db():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             result TEXT,
             config TEXT,
-            auto_approve BOOLEAN DEFAULT 0
+            auto_approve BOOLEAN DEFAULT 0,
+            source_sha256 TEXT,
+            source_size INTEGER,
+            filename TEXT,
+            batch_id TEXT,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            stage TEXT,
+            stage_done INTEGER,
+            stage_total INTEGER,
+            progress REAL,
+            eta_seconds REAL,
+            progress_at TIMESTAMP,
+            video_path TEXT,
+            priority TEXT NOT NULL DEFAULT 'normal',
+            profile TEXT
         )
     ''')
-    
+
+    # Single-row counter bumped by every write that changes the analytics
+    # aggregates. Readers compare it against the version they cached to decide
+    # whether a cached result is still valid. Generated VIML is versioned per
+    # video instead (see _init_viml_versions).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK(id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+    # Per-stage state of a job (see progress.ProgressReporter); stages can run in parallel
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_stages (
+            job_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('running', 'done', 'failed')),
+            done INTEGER,
+            total INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            started_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            PRIMARY KEY (job_id, stage)
+        )
+    ''')
+
+    # Live streams (see live.py); their occurrences are stored under video_path 'live_<stream_id>'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS live_streams (
+            stream_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            config TEXT,
+            status TEXT NOT NULL CHECK(status IN ('starting', 'live', 'stopping', 'stopped', 'failed')),
+            position_seconds REAL,
+            latency_seconds REAL,
+            dropped_frames INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+    # Batches group jobs submitted together; per-job state stays on the jobs rows
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batches (
+            batch_id TEXT PRIMARY KEY,
+            config TEXT,
+            job_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Resumable uploads: one row per session, one row per received chunk
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            upload_id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT,
+            config TEXT,
+            status TEXT NOT NULL DEFAULT 'open' CHECK(status IN ('open', 'finalizing', 'finalized')),
+            job_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_chunks (
+            upload_id TEXT NOT NULL,
+            chunk_offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (upload_id, chunk_offset)
+        )
+    ''')
+
     # --- MIGRATIONS (for existing databases) ---
     # Check for missing columns and add them if they don't exist
     
@@ -85,6 +352,20 @@ def init_db():
     try:
         cursor.execute("ALTER TABLE occurrences ADD COLUMN job_id TEXT")
     except sqlite3.OperationalError: pass
+    try:
+        cursor.execute("ALTER TABLE occurrences ADD COLUMN end_seconds REAL")
+    except sqlite3.OperationalError: pass
+    
+    # occurrences: backfill end_seconds. Voice rows kept their end in 'details'
+    # ("Speaks until 12.34s"); CAST reads the leading number and drops the 's'.
+    cursor.execute("""
+        UPDATE occurrences SET end_seconds = CASE
+            WHEN method_used = 'voice' AND details LIKE 'Speaks until %'
+                THEN MAX(timestamp_seconds, CAST(substr(details, 14) AS REAL))
+            ELSE timestamp_seconds + ?
+        END
+        WHERE end_seconds IS NULL
+    """, (POINT_EVENT_SECONDS,))
     
     # jobs: config, auto_approve
     try:
@@ -93,6 +374,66 @@ def init_db():
     try:
         cursor.execute("ALTER TABLE jobs ADD COLUMN auto_approve BOOLEAN DEFAULT 0")
     except sqlite3.OperationalError: pass
+    # jobs: source_sha256, source_size (computed while the upload streams to disk)
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN source_sha256 TEXT")
+    except sqlite3.OperationalError: pass
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN source_size INTEGER")
+    except sqlite3.OperationalError: pass
+    # jobs: filename, batch_id, started_at, finished_at (batch progress and timing)
+    for column in ("filename TEXT", "batch_id TEXT", "started_at TIMESTAMP", "finished_at TIMESTAMP"):
+        try:
+            cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        except sqlite3.OperationalError: pass
+    # jobs: per-stage progress (see progress.ProgressReporter) and the input path, for retries
+    for column in ("stage TEXT", "stage_done INTEGER", "stage_total INTEGER", "progress REAL",
+                   "eta_seconds REAL", "progress_at TIMESTAMP", "video_path TEXT"):
+        try:
+            cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        except sqlite3.OperationalError: pass
+    # jobs: priority lane (see tasks.PRIORITIES)
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'normal'")
+    except sqlite3.OperationalError: pass
+    # jobs: ingest profile, for per-profile quotas (see admission.py)
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN profile TEXT")
+    except sqlite3.OperationalError: pass
+    # jobs: W3C traceparent of the ingest request, so every stage joins its trace (see tracing.py)
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN traceparent TEXT")
+    except sqlite3.OperationalError: pass
+    # identifiers: the job that stored them, so re-running correlate replaces them
+    try:
+        cursor.execute("ALTER TABLE identifiers ADD COLUMN job_id TEXT")
+    except sqlite3.OperationalError: pass
+
+    # --- INDEXES ---
+    # Review queue: keyset pages by (video, timestamp) and per-person grouping
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_review_video ON occurrences(review_status, video_path, timestamp_seconds, occurrence_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_review_person ON occurrences(review_status, person_id, timestamp_seconds)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_job ON occurrences(job_id)")
+    # Person merges re-point rows by person_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_person ON occurrences(person_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_identifiers_person ON identifiers(person_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_identifiers_job ON identifiers(job_id)")
+    # Per-video timeline scans (VIML generation, span lookups without R*Tree)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_video_time ON occurrences(video_path, timestamp_seconds)")
+    # Latest cues of a live stream (live.live_snapshot)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_occurrences_video_end ON occurrences(video_path, end_seconds)")
+    # Backlog counts (queued / processing jobs)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+    # Recent run times for admission control (admission.load_state)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(status, finished_at)")
+    # Changed jobs for the job list's event feed (job_events.py)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_priority ON jobs(priority, status, started_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_profile ON jobs(profile, status)")
+
+    _init_viml_versions(cursor)
+    _init_span_index(cursor)
 
     conn.commit()
     conn.close()
@@ -0,0 +1,271 @@
+# ephemeral.py
+# Analysis for /v1/analyze/* and /v1/extract/*: nothing is stored in the DB.
+#
+# The work runs in a process pool, never on the API's event loop or threadpool, and
+# results are cached by content hash, so re-submitting a clip is free. "Quick" mode
+# answers in seconds: it only looks at the first QUICK_SECONDS, samples one frame
+# every QUICK_SAMPLE_SECONDS at reduced size, detects faces without encoding them
+# when only counts are wanted, and stops at QUICK_BUDGET_SECONDS with what it has
+# ("complete": false). Full runs get FULL_BUDGET_SECONDS and fail past it.
+#
+# Budgets are enforced in the worker: an alarm interrupts a task that has not
+# returned in time, so the pool is free again and the upload can be removed.
+# A worker that does not even answer the alarm (stuck in native code) is killed
+# together with its pool.
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from processing import (_run_ocr, _run_facial_recognition, _run_speaker_diarization, OCR_CROP_AREA,
+                        OCR_LINE_PATTERN, LITE_MODE, cv2, face_recognition)
+import metrics
+
+QUICK_SECONDS = float(os.environ.get("VIML_QUICK_SECONDS", "60"))
+QUICK_SAMPLE_SECONDS = float(os.environ.get("VIML_QUICK_SAMPLE_SECONDS", "2"))
+QUICK_BUDGET_SECONDS = float(os.environ.get("VIML_QUICK_BUDGET_SECONDS", "10"))
+FULL_BUDGET_SECONDS = float(os.environ.get("VIML_FULL_BUDGET_SECONDS", "300"))
+QUICK_FRAME_WIDTH = 640
+# Past the budget, a quick task has this long to hand back partial results before it is interrupted
+STOP_GRACE_SECONDS = 2.0
+# Past the budget, the request waits this long for the worker before killing the pool
+BUDGET_GRACE_SECONDS = 5.0
+ANALYSIS_WORKERS = int(os.environ.get("VIML_ANALYSIS_WORKERS", "2"))
+
+CACHE_FOLDER = os.path.join("generated", "analysis_cache")
+CACHE_ENTRIES = int(os.environ.get("VIML_ANALYSIS_CACHE_ENTRIES", "1000"))
+
+class AnalysisTimeout(Exception):
+    pass
+
+# --- Worker side (runs in the pool's processes) ---
+
+def _quick_ocr(video_path: str, deadline: float):
+    if LITE_MODE or not shutil.which('ffmpeg'):
+        return [(ts, text) for ts, text in _run_ocr(video_path) if ts <= QUICK_SECONDS], True
+    # Sample frames before cropping and OCR; -t stops decoding after the window
+    command = ['ffmpeg', '-t', str(QUICK_SECONDS), '-i', video_path,
+               '-vf', f'fps=1/{QUICK_SAMPLE_SECONDS},crop={OCR_CROP_AREA},ocr', '-f', 'null', '-']
+    try:
+        proc = subprocess.run(command, capture_output=True, text=True, timeout=max(deadline - time.monotonic(), 0.1))
+    except subprocess.TimeoutExpired:
+        return [], False
+    readings = [(float(ts), text) for ts, text in OCR_LINE_PATTERN.findall(proc.stderr) if text.strip()]
+    metrics.OCR_READINGS.labels("quick").inc(len(readings))
+    return readings, True
+
+def _quick_faces(video_path: str, deadline: float, encode: bool):
+    """{timestamp: faces} for sampled frames; faces are locations only unless encode is set."""
+    if LITE_MODE or not cv2:
+        mock = _run_facial_recognition(video_path)
+        return {ts: [{"location": face["location"]} for face in faces]
+                for ts, faces in mock.items() if ts <= QUICK_SECONDS}, True
+
+    results = {}
+    complete = True
+    frames = 0
+    encodings_computed = 0
+    cap = cv2.VideoCapture(video_path)
+    duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / (cap.get(cv2.CAP_PROP_FPS) or 25)
+    timestamp = 0.0
+    while timestamp <= min(QUICK_SECONDS, duration or QUICK_SECONDS):
+        if time.monotonic() > deadline:
+            complete = False
+            break
+        # Seek instead of decoding every frame in between
+        cap.set(cv2.CAP_PROP_POS_MSEC, timestamp * 1000)
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames += 1
+        scale = min(QUICK_FRAME_WIDTH / frame.shape[1], 1.0)
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale)
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb_frame)
+        if locations:
+            # Locations are reported in source-frame pixels
+            faces = [{"location": tuple(int(v / scale) for v in loc)} for loc in locations]
+            if encode:
+                for face, encoding in zip(faces, face_recognition.face_encodings(rgb_frame, locations)):
+                    face["encoding"] = encoding
+                    encodings_computed += 1
+            results[timestamp] = faces
+        timestamp += QUICK_SAMPLE_SECONDS
+    cap.release()
+    # Frames are sought, so every decoded frame is analysed
+    metrics.FRAMES_DECODED.labels("quick").inc(frames)
+    metrics.FRAMES_ANALYSED.labels("quick").inc(frames)
+    metrics.FACE_ENCODINGS.labels("quick").inc(encodings_computed)
+    return results, complete
+
+def _audio(video_path: str, quick: bool, deadline: float):
+    # _run_speaker_diarization expects a 16 kHz mono wav
+    audio_path = video_path + ".wav"
+    command = ['ffmpeg', '-i', video_path, '-vn', '-ar', '16000', '-ac', '1', '-y', audio_path]
+    if quick:
+        command[1:1] = ['-t', str(QUICK_SECONDS)]
+    try:
+        subprocess.run(command, capture_output=True, timeout=max(deadline - time.monotonic(), 0.1))
+        return _run_speaker_diarization(audio_path), True
+    except subprocess.TimeoutExpired:
+        return [], False
+    except FileNotFoundError:
+        return [], True
+    finally:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+
+def _serialize_faces(faces: dict) -> dict:
+    # Encodings are numpy arrays; the API only shows a preview of each
+    return {ts: [
+        dict({"location": face["location"]},
+             **({"encoding_preview": face["encoding"][:5].tolist()} if "encoding" in face else {}))
+        for face in items
+    ] for ts, items in faces.items()}
+
+def analyze(task: str, video_path: str, quick: bool, deadline: float) -> dict:
+    """
+    Runs one analysis task and returns a JSON-serializable
+    {"results": ..., "complete": bool}. Runs in a pool process.
+    deadline is a time.monotonic() value, which is system-wide, so the API process
+    sets it when it submits the task. Raises AnalysisTimeout past it.
+    """
+    budget = QUICK_BUDGET_SECONDS if quick else FULL_BUDGET_SECONDS
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        # Waited out its budget behind other tasks; the upload may already be gone
+        raise AnalysisTimeout(f"{task} analysis exceeded its {budget}s budget")
+
+    def on_overrun(signum, frame):
+        raise AnalysisTimeout(f"{task} analysis exceeded its {budget}s budget")
+
+    # Pool workers run tasks on their main thread, so the alarm can interrupt them
+    signal.signal(signal.SIGALRM, on_overrun)
+    signal.setitimer(signal.ITIMER_REAL, remaining + (STOP_GRACE_SECONDS if quick else 0))
+    try:
+        return _analyze(task, video_path, quick, deadline)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _analyze(task: str, video_path: str, quick: bool, deadline: float) -> dict:
+    complete = True
+    if task == "ocr":
+        results, complete = _quick_ocr(video_path, deadline) if quick else (_run_ocr(video_path), True)
+    elif task in ("face", "face_count"):
+        encode = task == "face"
+        if quick:
+            faces, complete = _quick_faces(video_path, deadline, encode=encode)
+        else:
+            faces = _run_facial_recognition(video_path)
+        if task == "face":
+            results = _serialize_faces(faces)
+        else:
+            results = {
+                "faces_detected_count": sum(len(items) for items in faces.values()),
+                "frames_with_faces": len(faces)
+            }
+    elif task == "audio":
+        results, complete = _audio(video_path, quick, deadline)
+    else:
+        raise ValueError(f"Unknown analysis task: {task}")
+    return {"results": results, "complete": complete}
+
+# --- API side ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _init_worker():
+    # Workers are forked from the API process and inherit the server's SIGTERM
+    # handler, which would only set a flag in the worker's copy of the server: a
+    # stopped API left its workers running and holding the listening socket
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Ctrl-C reaches the whole process group; the API shuts the pool down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, initializer=_init_worker)
+    return _pool
+
+def _kill_pool(pool: ProcessPoolExecutor):
+    """Kills the pool's workers and waits until they are gone, so nothing still reads their files."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    # ProcessPoolExecutor has no public way to stop a running task
+    processes = list((pool._processes or {}).values())
+    for process in processes:
+        process.kill()
+    for process in processes:
+        process.join(BUDGET_GRACE_SECONDS)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _cache_path(sha256: str, task: str, quick: bool) -> str:
+    params = f"{QUICK_SECONDS}:{QUICK_SAMPLE_SECONDS}:{QUICK_FRAME_WIDTH}" if quick else "full"
+    key = hashlib.sha256(f"{sha256}:{task}:{params}".encode()).hexdigest()
+    return os.path.join(CACHE_FOLDER, f"{key}.json")
+
+def _cache_get(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _cache_put(path: str, result: dict):
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(result, f)
+    os.replace(f"{path}.tmp", path)
+    entries = [os.path.join(CACHE_FOLDER, name) for name in os.listdir(CACHE_FOLDER) if name.endswith(".json")]
+    if len(entries) > CACHE_ENTRIES:
+        entries.sort(key=os.path.getmtime)
+        for stale in entries[:len(entries) - CACHE_ENTRIES]:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+async def run_analysis(task: str, video_path: str, sha256: str, quick: bool) -> dict:
+    """
+    The analysis result for a file with the given content hash: from the cache,
+    or computed in the process pool. Raises AnalysisTimeout if the task overruns
+    its budget, which includes time spent waiting for a free worker. When this
+    returns or raises, no worker is using video_path any more.
+    """
+    global _pool
+    cache_path = _cache_path(sha256, task, quick)
+    cached = await run_in_threadpool(_cache_get, cache_path)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    budget = QUICK_BUDGET_SECONDS if quick else FULL_BUDGET_SECONDS
+    deadline = time.monotonic() + budget
+    pool = _get_pool()
+    try:
+        future = pool.submit(analyze, task, video_path, quick, deadline)
+        result = await asyncio.wait_for(asyncio.wrap_future(future), budget + BUDGET_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        # Tasks ahead of this one stop by their own earlier deadlines, so if it has
+        # still not finished, a worker ignored its alarm
+        if not future.cancelled():
+            print("Analysis worker did not stop after its budget; restarting the pool")
+            await run_in_threadpool(_kill_pool, pool)
+        raise AnalysisTimeout(f"{task} analysis exceeded its {budget}s budget")
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool for the next request
+        _pool = None
+        raise
+    # Partial results depend on timing; only complete ones are reusable
+    if result["complete"]:
+        await run_in_threadpool(_cache_put, cache_path, result)
+    return dict(result, cached=False)
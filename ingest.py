@@ -0,0 +1,373 @@
+# ingest.py
+# Server-side helpers for getting media onto disk without blocking the event loop.
+import hashlib
+import os
+import shutil
+import tempfile
+try:
+    import fcntl
+except ImportError: # Windows: no reflinks
+    fcntl = None
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Sequence, Tuple
+from fastapi import HTTPException, Request, UploadFile
+from starlette.concurrency import run_in_threadpool
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ImportError: # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+from processing import LITE_MODE
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 0 = unlimited
+MAX_UPLOAD_BYTES = int(os.getenv("VIML_MAX_UPLOAD_BYTES", "0"))
+# Lite mode runs on mock files, so content sniffing is off there unless asked for
+VALIDATE_MEDIA = os.getenv("VIML_VALIDATE_MEDIA", "0" if LITE_MODE else "1") == "1"
+
+def sniff_media_kind(head: bytes) -> Optional[str]:
+    """Best-effort container sniffing from a file's first bytes: 'video', 'audio' or None."""
+    if head[4:8] == b"ftyp":
+        return "audio" if head[8:12] in (b"M4A ", b"M4B ") else "video"
+    if head[4:8] in (b"moov", b"mdat", b"wide", b"free", b"skip"): # QuickTime without ftyp
+        return "video"
+    if head.startswith(b"\x1a\x45\xdf\xa3"): # Matroska / WebM
+        return "video"
+    if head.startswith(b"RIFF"):
+        return {b"AVI ": "video", b"WAVE": "audio"}.get(head[8:12])
+    if head.startswith((b"\x00\x00\x01\xba", b"\x00\x00\x01\xb3", b"FLV")): # MPEG-PS / ES, FLV
+        return "video"
+    if head[:1] == b"\x47" and head[188:189] == b"\x47": # MPEG-TS sync bytes
+        return "video"
+    if head.startswith((b"ID3", b"fLaC", b"OggS")):
+        return "audio"
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0: # MPEG audio frame
+        return "audio"
+    return None
+
+async def save_upload(upload: UploadFile, dest_path: str, accept: Sequence[str] = ("video",),
+                      max_bytes: int = MAX_UPLOAD_BYTES) -> dict:
+    """
+    Copies an UploadFile to dest_path in chunks, hashing as it goes.
+    Disk writes run in the threadpool so large files don't stall the event loop.
+    Rejects non-media content (415) and oversized files (413); a rejected or
+    failed upload leaves no partial file behind. Starlette has already spooled
+    the whole body by the time this runs, so these checks save no bandwidth; the
+    ingest endpoints use receive_multipart instead.
+    Returns {"size": int, "sha256": str}.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    out = await run_in_threadpool(open, dest_path, "wb")
+    try:
+        first = True
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if first:
+                first = False
+                if VALIDATE_MEDIA and sniff_media_kind(chunk) not in accept:
+                    raise HTTPException(415, f"Unsupported media type; expected {' or '.join(accept)}")
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise HTTPException(413, f"Upload exceeds {max_bytes} bytes")
+            digest.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+        await run_in_threadpool(out.close)
+    except BaseException:
+        out.close()
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+
+    return {"size": size, "sha256": digest.hexdigest()}
+
+# --- Streaming multipart ---
+# FastAPI's File(...) parameters spool the whole request body to a temp file
+# before the endpoint runs. The ingest endpoints parse the body themselves as it
+# arrives instead: each file goes straight to its final path (one copy), and a
+# non-media file (415) or an oversized one (413) is refused after its first bytes.
+
+# Enough for every check in sniff_media_kind
+SNIFF_BYTES = 4096
+MAX_FIELD_BYTES = 1024 * 1024
+
+class _FilePart:
+    """A file part being written to disk."""
+
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path = path
+        self.out = None
+        self.head = b""
+        self.size = 0
+        self.digest = hashlib.sha256()
+
+    async def write(self, data: bytes, accept: Sequence[str], max_bytes: int):
+        self.size += len(data)
+        if max_bytes and self.size > max_bytes:
+            raise HTTPException(413, f"Upload exceeds {max_bytes} bytes")
+        self.digest.update(data)
+        if self.out is None:
+            # Nothing touches the disk until the content type is known
+            self.head += data
+            if len(self.head) >= SNIFF_BYTES:
+                await self._open(accept)
+            return
+        await run_in_threadpool(self.out.write, data)
+
+    async def _open(self, accept: Sequence[str]):
+        if VALIDATE_MEDIA and sniff_media_kind(self.head) not in accept:
+            raise HTTPException(415, f"Unsupported media type; expected {' or '.join(accept)}")
+        self.out = await run_in_threadpool(open, self.path, "wb")
+        await run_in_threadpool(self.out.write, self.head)
+        self.head = b""
+
+    async def finish(self, accept: Sequence[str]) -> dict:
+        if self.out is None:
+            await self._open(accept)
+        await run_in_threadpool(self.out.close)
+        return {"filename": self.filename, "path": self.path, "size": self.size, "sha256": self.digest.hexdigest()}
+
+    def discard(self):
+        if self.out is not None:
+            self.out.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+async def receive_multipart(request: Request, file_field: str, dest_for: Callable[[str], str],
+                            accept: Sequence[str] = ("video",), max_bytes: int = MAX_UPLOAD_BYTES,
+                            max_files: int = 0) -> Tuple[dict, List[dict]]:
+    """
+    Parses a multipart/form-data body from request.stream() as it arrives. Each
+    part named file_field is written to dest_for(filename), hashing as it goes;
+    other file parts are skipped. Raises 400 for a malformed body or more than
+    max_files files (0 = unlimited). Nothing is left on disk if anything fails.
+    Returns (fields, files): the text fields by name, and
+    [{"filename", "path", "size", "sha256"}] per file in body order.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(400, "Expected a multipart/form-data body")
+
+    # The parser's callbacks are synchronous; they queue events that are then
+    # handled (with awaited disk writes) after each piece of the body
+    events = []
+    headers = {}
+    header = [b"", b""]
+    def on_header_field(data, start, end):
+        header[0] += data[start:end]
+    def on_header_value(data, start, end):
+        header[1] += data[start:end]
+    def on_header_end():
+        headers[header[0].lower()] = header[1]
+        header[:] = [b"", b""]
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+    parser = MultipartParser(options[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    fields = {}
+    files = []
+    parts = []
+    part = None # _FilePart, bytearray for a text field, or None for a skipped part
+    name = None
+    try:
+        async for piece in request.stream():
+            try:
+                parser.write(piece)
+            except MultipartParseError as e:
+                raise HTTPException(400, f"Malformed multipart body: {e}")
+            for kind, value in events:
+                if kind == "headers":
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    name = disposition.get(b"name", b"").decode(errors="replace")
+                    filename = os.path.basename(disposition.get(b"filename", b"").decode(errors="replace"))
+                    if b"filename" not in disposition:
+                        part = bytearray()
+                    elif name != file_field or not filename:
+                        part = None # another file field, or an empty file input
+                    else:
+                        if max_files and len(parts) >= max_files:
+                            raise HTTPException(400, f"At most {max_files} file(s) allowed in '{file_field}'")
+                        part = _FilePart(filename, dest_for(filename))
+                        parts.append(part)
+                elif kind == "data" and isinstance(part, _FilePart):
+                    await part.write(value, accept, max_bytes)
+                elif kind == "data" and part is not None:
+                    part += value
+                    if len(part) > MAX_FIELD_BYTES:
+                        raise HTTPException(413, f"Form field '{name}' exceeds {MAX_FIELD_BYTES} bytes")
+                elif kind == "end":
+                    if isinstance(part, _FilePart):
+                        files.append(await part.finish(accept))
+                    elif part is not None:
+                        fields[name] = part.decode(errors="replace")
+                    part = None
+            events.clear()
+        parser.finalize()
+        if part is not None or len(files) != len(parts):
+            raise HTTPException(400, "Incomplete multipart body")
+    except BaseException:
+        for started in parts:
+            started.discard()
+        raise
+    return fields, files
+
+# --- Resumable (chunked) uploads ---
+# Clients create a session with the final size, PUT chunks at byte offsets in
+# any order (in parallel if they like), then finalize. Chunks land directly in
+# a preallocated file, so assembly is just "all ranges received"; finalize
+# re-hashes the file and checks it against the digest declared up front.
+
+# Chunk size suggested to clients; any size works on the server side
+SESSION_CHUNK_SIZE = int(os.getenv("VIML_UPLOAD_SESSION_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# Open sessions idle for longer than this are discarded with their partial files
+SESSION_TTL_SECONDS = int(os.getenv("VIML_UPLOAD_SESSION_TTL", str(24 * 3600)))
+# A session left 'finalizing' for longer than this (the API died while hashing or
+# queuing it) is taken over by the next finalize call
+SESSION_FINALIZE_TIMEOUT_SECONDS = int(os.getenv("VIML_UPLOAD_FINALIZE_TIMEOUT", "3600"))
+
+def preallocate(path: str, size: int):
+    """Creates a (sparse) file of the final size for chunks to be written into."""
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+def _copy_at(source, path: str, offset: int):
+    """Copies a file object into path at offset (blocking; run it in the threadpool)."""
+    source.seek(0)
+    with open(path, "r+b") as out:
+        out.seek(offset)
+        shutil.copyfileobj(source, out, UPLOAD_CHUNK_SIZE)
+
+async def write_chunk(body: AsyncIterator[bytes], path: str, offset: int, max_length: int,
+                      expected_sha256: Optional[str] = None) -> dict:
+    """
+    Streams a request body into path at offset, writing in UPLOAD_CHUNK_SIZE blocks
+    off the event loop. Bodies longer than max_length are rejected (413).
+    With expected_sha256, the body goes to a scratch file first and is only
+    copied into path if it matches (422 otherwise), so a corrupt re-send never
+    overwrites bytes that were already received intact.
+    Returns {"length": int, "sha256": str} for the bytes written.
+    """
+    digest = hashlib.sha256()
+    length = 0
+    buffer = bytearray()
+    if expected_sha256:
+        # Chunks of the suggested size stay in memory; larger ones spill to disk
+        out = tempfile.SpooledTemporaryFile(max_size=SESSION_CHUNK_SIZE, dir=os.path.dirname(path))
+    else:
+        out = await run_in_threadpool(open, path, "r+b")
+    try:
+        if not expected_sha256:
+            await run_in_threadpool(out.seek, offset)
+        async for piece in body:
+            length += len(piece)
+            if length > max_length:
+                raise HTTPException(413, f"Chunk at offset {offset} runs past the declared upload size")
+            digest.update(piece)
+            buffer += piece
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(out.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(out.write, bytes(buffer))
+        if expected_sha256:
+            if expected_sha256.lower() != digest.hexdigest():
+                raise HTTPException(422, "Chunk checksum mismatch")
+            await run_in_threadpool(_copy_at, out, path, offset)
+    finally:
+        await run_in_threadpool(out.close)
+    return {"length": length, "sha256": digest.hexdigest()}
+
+def merge_ranges(chunks: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    """(offset, length) pairs, sorted by offset -> disjoint [start, end) byte ranges."""
+    ranges = []
+    for offset, length in chunks:
+        if length <= 0:
+            continue
+        end = offset + length
+        if ranges and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return ranges
+
+def missing_ranges(received: List[List[int]], size: int) -> List[List[int]]:
+    """The [start, end) gaps in received within [0, size)."""
+    missing = []
+    position = 0
+    for start, end in received:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file on disk (blocking; run it in the threadpool)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_head(path: str, size: int = 1024) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+# --- Register by path (shared storage) ---
+# When the agent and the API see the same storage, the agent sends a path instead
+# of the bytes. Only files under these roots (os.pathsep-separated) are accepted;
+# with none configured the feature is off.
+INGEST_ROOTS = [os.path.realpath(root) for root in os.getenv("VIML_INGEST_ROOTS", "").split(os.pathsep) if root]
+
+FICLONE = 0x40049409 # Linux ioctl: share extents with another file (btrfs, XFS, bcachefs)
+
+def resolve_ingest_path(path: str) -> str:
+    """The real path of a registered file; 403 outside INGEST_ROOTS, 404 if it isn't a file."""
+    real = os.path.realpath(path)
+    if not any(os.path.commonpath([real, root]) == root for root in INGEST_ROOTS):
+        raise HTTPException(403, "Path is not under an allowed ingest root")
+    if not os.path.isfile(real):
+        raise HTTPException(404, "File not found")
+    return real
+
+def _reflink(source: str, dest: str):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(dest)
+            raise
+
+def link_into(source: str, dest: str) -> str:
+    """
+    Makes source available at dest without copying its data. Tries a hardlink
+    (same filesystem), then a reflink (copy-on-write filesystems), then falls back
+    to a symlink that references the file in place. Returns the method used.
+    """
+    try:
+        os.link(source, dest)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        _reflink(source, dest)
+        return "reflink"
+    except OSError:
+        pass
+    os.symlink(source, dest)
+    return "symlink"
@@ -4,114 +4,548 @@ import os
 import requests
 import feedparser
 import threading
-import subprocess
+import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-API_URL = "http://127.0.0.1:5000/v1/process"
+API_BASE = os.getenv("VIML_API_BASE", "http://127.0.0.1:5000")
+API_URL = f"{API_BASE}/v1/process"
+UPLOADS_URL = f"{API_BASE}/v1/uploads"
+REGISTER_URL = f"{API_BASE}/v1/process/register"
+BACKLOG_URL = f"{API_BASE}/v1/jobs/backlog"
 PROFILES_FILE = "profiles.json"
 CHECK_INTERVAL = 30 # For polling loops if needed, though Feedparser has its own sleep
 
+# Files at least this large go through the resumable chunked upload API
+RESUMABLE_THRESHOLD = int(os.getenv("VIML_RESUMABLE_THRESHOLD", str(64 * 1024 * 1024)))
+UPLOAD_WORKERS = int(os.getenv("VIML_UPLOAD_WORKERS", "4"))
+CHUNK_RETRIES = 5
+# Maps a local file (path, size, mtime) to its open upload session, so an agent
+# restart resumes an interrupted upload instead of starting it over
+UPLOAD_STATE_FILE = ".viml_uploads.json"
+# Per-profile MRSS feed validators (ETag / Last-Modified) and ingested entry ids
+MRSS_STATE_FILE = ".viml_mrss.json"
+MRSS_SEEN_LIMIT = 5000 # feeds only carry recent items; older ids can be forgotten
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+# Per-profile record of watch-folder files already ingested (path -> [size, mtime_ns]),
+# so the startup scan only picks up files that arrived while the agent was down
+WATCH_STATE_FILE = ".viml_watch.json"
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.webm', '.avi')
+SETTLE_POLL_SECONDS = 1.0
+MAX_UPLOAD_ATTEMPTS = 3
+BACKLOG_CHECK_SECONDS = 2.0
+DEFAULT_RETRY_AFTER = 30 # when a 429 has no usable Retry-After
+_state_lock = threading.Lock()
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_state(path, key, value):
+    """Sets (or, for None, removes) one key of a JSON state file."""
+    with _state_lock:
+        state = _load_state(path)
+        if value is None:
+            state.pop(key, None)
+        else:
+            state[key] = value
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+def _profile_config(profile):
+    """
+    The job config sent with each video: the profile's workflow_config, plus its
+    "priority" lane ("high" for live news, "low" for backfills) unless the
+    workflow_config sets one itself.
+    """
+    config = dict(profile.get("workflow_config", {}))
+    if "priority" in profile:
+        config.setdefault("priority", profile["priority"])
+    # Names the profile to the API, which may hold each profile to a quota
+    config.setdefault("profile", profile["name"])
+    return json.dumps(config)
+
+class Overloaded(Exception):
+    """The API refused new work (429); retry after retry_after seconds."""
+
+    def __init__(self, retry_after, detail=""):
+        super().__init__(f"API overloaded, retry in {retry_after}s: {detail}")
+        self.retry_after = retry_after
+
+def _check_admission(resp):
+    """Raises Overloaded for a 429, after pausing all ingest for its Retry-After."""
+    if resp.status_code != 429:
+        return
+    try:
+        retry_after = max(int(resp.headers.get("Retry-After", "")), 1)
+    except ValueError:
+        retry_after = DEFAULT_RETRY_AFTER
+    backlog.pause(retry_after)
+    raise Overloaded(retry_after, resp.text)
+
+class ResumableUploader:
+    """
+    Client for the /v1/uploads API: sends missing chunks in parallel, retries
+    failed chunks with backoff, and resumes a session left over from an earlier run.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS):
+        self.workers = workers
+        self._local = threading.local()
+
+    def _session(self):
+        # requests.Session keeps the connection alive; one per worker thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+
+    def upload(self, file_path, config, filename=None):
+        """Uploads file_path and returns the API's job response (job_id, status_url, ...)."""
+        stat = os.stat(file_path)
+        key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        status = None
+
+        upload_id = _load_state(UPLOAD_STATE_FILE).get(key)
+        if upload_id:
+            resp = self._session().get(f"{UPLOADS_URL}/{upload_id}")
+            if resp.ok:
+                status = resp.json()
+                print(f"Resuming upload {upload_id} ({status['received_bytes']}/{status['size']} bytes)")
+
+        if status is None:
+            resp = self._session().post(UPLOADS_URL, json={
+                "filename": filename or os.path.basename(file_path),
+                "size": stat.st_size,
+                "sha256": _file_sha256(file_path),
+                "config": config
+            })
+            _check_admission(resp)
+            resp.raise_for_status()
+            status = resp.json()
+            _save_state(UPLOAD_STATE_FILE, key, status['upload_id'])
+
+        upload_url = f"{API_BASE}{status['upload_url']}"
+        for _ in range(3):
+            if status['status'] == 'open':
+                chunk_size = status['chunk_size']
+                chunks = [(offset, min(chunk_size, end - offset))
+                          for start, end in status['missing']
+                          for offset in range(start, end, chunk_size)]
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    # list() re-raises the first chunk that failed all its retries
+                    list(pool.map(lambda c: self._put_chunk(upload_url, file_path, *c), chunks))
+
+            resp = self._session().post(f"{upload_url}/finalize")
+            if resp.status_code == 202:
+                _save_state(UPLOAD_STATE_FILE, key, None)
+                return resp.json()
+            if resp.status_code not in (409, 422):
+                resp.raise_for_status()
+            # Incomplete or checksum mismatch: the session now lists what to (re-)send
+            print(f"Finalize rejected ({resp.status_code}): {resp.text}")
+            status = self._session().get(upload_url).json()
+        raise RuntimeError(f"Upload {status['upload_id']} could not be finalized")
+
+    def _put_chunk(self, upload_url, file_path, offset, length):
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        headers = {"X-Chunk-SHA256": hashlib.sha256(data).hexdigest()}
+        for attempt in range(CHUNK_RETRIES):
+            try:
+                resp = self._session().put(upload_url, params={"offset": offset}, data=data, headers=headers)
+                if resp.ok:
+                    return
+                if resp.status_code < 500 and resp.status_code != 422:
+                    resp.raise_for_status() # client errors won't fix themselves
+            except requests.ConnectionError:
+                self._local.__dict__.pop("session", None)
+            if attempt < CHUNK_RETRIES - 1:
+                time.sleep(2 ** attempt)
+        raise RuntimeError(f"Chunk at offset {offset} failed after {CHUNK_RETRIES} attempts")
+
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+_http = threading.local()
+
+def _api_session():
+    """Keep-alive session for the calling thread (upload workers reuse their connection)."""
+    if not hasattr(_http, "session"):
+        _http.session = requests.Session()
+    return _http.session
+
+def upload_video(file_path, config, filename=None):
+    """Sends a video to the Core API, chunked and resumable when it is large; returns the job response."""
+    if os.path.getsize(file_path) >= RESUMABLE_THRESHOLD:
+        return ResumableUploader().upload(file_path, config, filename)
+    with open(file_path, 'rb') as f:
+        files = {'video': (filename or os.path.basename(file_path), f)}
+        data = {'config': config}
+        resp = _api_session().post(API_URL, files=files, data=data)
+    _check_admission(resp)
+    resp.raise_for_status()
+    return resp.json()
+
+def register_video(server_path, config):
+    """Asks the API to ingest a file in place on shared storage; returns the job response."""
+    resp = _api_session().post(REGISTER_URL, json={"path": server_path, "config": config})
+    _check_admission(resp)
+    resp.raise_for_status()
+    return resp.json()
+
+class Backlog:
+    """
+    Cached view of the API's job backlog, shared by all upload workers. A 429 from
+    the API pauses every worker until its Retry-After has passed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._queued = 0
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def queued(self):
+        with self._lock:
+            if time.monotonic() - self._checked_at >= BACKLOG_CHECK_SECONDS:
+                try:
+                    self._queued = _api_session().get(BACKLOG_URL, timeout=5).json()['queued']
+                except Exception:
+                    pass # unknown backlog: don't stall ingest on it
+                self._checked_at = time.monotonic()
+            return self._queued
+
+    def wait(self, limit, name):
+        """
+        Blocks while the API has asked us to back off, then, backing off
+        exponentially, while more than limit jobs are queued.
+        """
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                break
+            print(f"[{name}] API is overloaded, pausing ingest for {int(remaining) + 1}s")
+            time.sleep(remaining)
+        delay = 1
+        while limit and self.queued() >= limit:
+            print(f"[{name}] API backlog is deep ({self._queued} queued), waiting {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+backlog = Backlog()
+
 class IngestionHandler(FileSystemEventHandler):
+    """
+    Watch-folder ingest. Events only note the path; a settle thread waits until the
+    file's size and mtime stop changing (i.e. the copy into the folder has finished)
+    and hands it to a pool of upload workers.
+    """
+
     def __init__(self, profile):
         self.profile = profile
-        self.config = json.dumps(profile.get("workflow_config", {}))
+        self.config = _profile_config(profile)
+        # "ingest_mode": "register" sends paths instead of bytes when the API shares our storage;
+        # "server_path" is where the API sees this watch folder, if it is mounted elsewhere there
+        self.register = profile.get("ingest_mode") == "register"
+        self.server_path = profile.get("server_path", profile.get("path"))
+        self.settle_seconds = profile.get("settle_seconds", 5)
+        self.max_backlog = profile.get("max_backlog", 50) # 0 = never wait
+
+        self.state_key = profile['name']
+        self._done = _load_state(WATCH_STATE_FILE).get(self.state_key, {}) # path -> [size, mtime_ns]
+        self._pending = {} # path -> (size, mtime_ns, stable_since, attempts)
+        self._active = set() # queued for or being uploaded
+        self._lock = threading.Lock()
+        self._work = queue.Queue()
+
+        threading.Thread(target=self._settle_loop, daemon=True).start()
+        for _ in range(profile.get("upload_workers", UPLOAD_WORKERS)):
+            threading.Thread(target=self._upload_loop, daemon=True).start()
 
     def on_created(self, event):
-        if event.is_directory:
-            return
+        if not event.is_directory:
+            self.add(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.add(event.src_path)
+
+    def on_moved(self, event):
+        # Copy-then-rename tools ("clip.mp4.part" -> "clip.mp4") only show the final name here
+        if not event.is_directory:
+            self.add(event.dest_path)
+
+    def scan(self):
+        """Queues video files that arrived while the agent was not running."""
+        path = self.profile['path']
+        names = set(os.listdir(path))
+        with self._lock:
+            # Forget ingested files that have since been removed from the folder
+            self._done = {p: v for p, v in self._done.items() if os.path.basename(p) in names}
+        for name in sorted(names):
+            self.add(os.path.join(path, name))
+
+    def add(self, file_path, attempts=0):
         # Basic filtering for video files
-        if not event.src_path.lower().endswith(('.mp4', '.mkv', '.mov', '.webm', '.avi')):
+        if not file_path.lower().endswith(VIDEO_EXTENSIONS):
             return
-            
-        print(f"[{self.profile['name']}] New file detected: {event.src_path}")
-        self.upload_file(event.src_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return
+        with self._lock:
+            if file_path in self._active or file_path in self._pending:
+                return
+            if self._done.get(file_path) == [stat.st_size, stat.st_mtime_ns]:
+                return
+            self._pending[file_path] = (stat.st_size, stat.st_mtime_ns, time.monotonic(), attempts)
+        if not attempts:
+            print(f"[{self.profile['name']}] New file detected: {file_path}")
+
+    def _settle_loop(self):
+        while True:
+            time.sleep(SETTLE_POLL_SECONDS)
+            now = time.monotonic()
+            with self._lock:
+                pending = list(self._pending.items())
+            for file_path, (size, mtime_ns, since, attempts) in pending:
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    with self._lock:
+                        self._pending.pop(file_path, None)
+                    continue
+                with self._lock:
+                    if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns) or not stat.st_size:
+                        # Still being written (or not started yet): restart the clock
+                        self._pending[file_path] = (stat.st_size, stat.st_mtime_ns, now, attempts)
+                    elif now - since >= self.settle_seconds:
+                        del self._pending[file_path]
+                        self._active.add(file_path)
+                        self._work.put((file_path, stat.st_size, stat.st_mtime_ns, attempts))
+
+    def _upload_loop(self):
+        while True:
+            file_path, size, mtime_ns, attempts = self._work.get()
+            try:
+                backlog.wait(self.max_backlog, self.profile['name'])
+                ok = self.upload_file(file_path)
+            except Overloaded as e:
+                print(f"[{self.profile['name']}] {e}")
+                ok = None
+            finally:
+                with self._lock:
+                    self._active.discard(file_path)
+            if ok is None:
+                # Refused for load, not for the file: retry without using up an attempt
+                self.add(file_path, attempts)
+            elif ok:
+                with self._lock:
+                    self._done[file_path] = [size, mtime_ns]
+                    done = dict(self._done)
+                _save_state(WATCH_STATE_FILE, self.state_key, done)
+            elif attempts + 1 < MAX_UPLOAD_ATTEMPTS:
+                # Goes back through the settle delay, which doubles as the retry pause
+                self.add(file_path, attempts + 1)
 
     def upload_file(self, file_path):
-        # Retry logic could be added here
-        print(f"[{self.profile['name']}] Uploading to Core API...")
+        """Ingests one file; returns True once the API has accepted it. Raises Overloaded on a 429."""
+        if self.register:
+            server_path = os.path.join(self.server_path, os.path.relpath(file_path, self.profile['path']))
+            try:
+                job = register_video(server_path, self.config)
+                print(f"[{self.profile['name']}] Registered in place ({job.get('link')}): {job['job_id']}")
+                return True
+            except Overloaded:
+                raise
+            except requests.HTTPError as e:
+                if e.response.status_code not in (403, 404):
+                    print(f"[{self.profile['name']}] Register failed: {e.response.text}")
+                    return False
+                # Not visible to (or not allowed on) the server: fall back to uploading the bytes
+                print(f"[{self.profile['name']}] Register refused ({e.response.status_code}), uploading instead")
+            except Exception as e:
+                print(f"[{self.profile['name']}] Error: {e}")
+                return False
+
+        print(f"[{self.profile['name']}] Uploading {os.path.basename(file_path)} to Core API...")
         try:
-            with open(file_path, 'rb') as f:
-                files = {'video': f}
-                data = {'config': self.config}
-                resp = requests.post(API_URL, files=files, data=data)
-                
-            if resp.status_code == 202:
-                job_id = resp.json()['job_id']
-                print(f"[{self.profile['name']}] Job initiated: {job_id}")
-            else:
-                print(f"[{self.profile['name']}] Upload failed: {resp.text}")
+            job = upload_video(file_path, self.config)
+            print(f"[{self.profile['name']}] Job initiated: {job['job_id']}")
+            return True
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"[{self.profile['name']}] Error: {e}")
+            return False
+
+def _multipart_body(fields, file_field, filename, content_type, chunks, boundary):
+    """
+    multipart/form-data as a generator, so requests sends it with chunked
+    transfer encoding instead of building the whole body in memory.
+    """
+    for name, value in fields.items():
+        yield f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+           f'Content-Type: {content_type}\r\n\r\n').encode()
+    for chunk in chunks:
+        yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode()
 
 class MRSSPoller(threading.Thread):
+    """
+    Polls an MRSS feed with conditional requests and ingests new entries from a
+    bounded pool of workers. Each download is piped straight into /v1/process;
+    an entry only counts as seen once the API has accepted it.
+    """
+
     def __init__(self, profile):
         super().__init__()
         self.profile = profile
         self.url = profile['url']
         self.interval = profile.get('interval_seconds', 300)
-        self.seen_entries = set()
-        self.config = json.dumps(profile.get("workflow_config", {}))
+        self.config = _profile_config(profile)
         self.daemon = True
 
+        self.state_key = profile['name']
+        state = _load_state(MRSS_STATE_FILE).get(self.state_key, {})
+        self.etag = state.get("etag")
+        self.modified = state.get("modified")
+        self.seen_order = state.get("seen", [])
+        self.seen_entries = set(self.seen_order)
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=profile.get('max_concurrent_downloads', 3))
+
+    def _session(self):
+        # One keep-alive session per worker thread, reused for the feed, the media host and the API
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _save(self):
+        with self._lock:
+            self.seen_order = self.seen_order[-MRSS_SEEN_LIMIT:]
+            # The validators are only safe to keep once every entry of that fetch is done;
+            # otherwise a restart would get a 304 and never retry the unfinished ones
+            settled = not self._inflight
+            state = {
+                "etag": self.etag if settled else None,
+                "modified": self.modified if settled else None,
+                "seen": list(self.seen_order)
+            }
+        _save_state(MRSS_STATE_FILE, self.state_key, state)
+
+    def _finish(self, entry_id, ingested):
+        with self._lock:
+            self._inflight.discard(entry_id)
+            if ingested and entry_id not in self.seen_entries:
+                self.seen_entries.add(entry_id)
+                self.seen_order.append(entry_id)
+            elif not ingested:
+                # Force a full fetch next time so the entry is offered again
+                self.etag = self.modified = None
+        self._save()
+
     def run(self):
         print(f"[{self.profile['name']}] Starting MRSS Poller on {self.url}")
         while True:
             try:
-                feed = feedparser.parse(self.url)
-                for entry in feed.entries:
-                    if entry.id in self.seen_entries:
-                        continue
-                    
-                    self.seen_entries.add(entry.id)
-                    # Find video link
-                    video_url = None
-                    # Try enclosure
-                    for enclosure in entry.get('enclosures', []):
-                         if enclosure.type.startswith('video/'):
-                             video_url = enclosure.href
-                             break
-                    
-                    if not video_url:
-                        # Fallback logic could go here
-                        print(f"[{self.profile['name']}] No video found for {entry.title}")
-                        continue
-                        
-                    print(f"[{self.profile['name']}] Found new video: {entry.title}")
-                    self.download_and_process(video_url, entry.title)
-                    
+                self.poll()
             except Exception as e:
                  print(f"[{self.profile['name']}] Poll error: {e}")
                  
             time.sleep(self.interval)
 
-    def download_and_process(self, url, title):
-        # Clean title for filename
-        clean_title = "".join(x for x in title if x.isalnum() or x in "._- ")
-        filename = f"{clean_title}.mp4"
-        temp_path = os.path.join("downloads_temp", filename)
-        os.makedirs("downloads_temp", exist_ok=True)
-        
-        print(f"[{self.profile['name']}] Downloading {url}...")
+    def poll(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.modified:
+            headers['If-Modified-Since'] = self.modified
+        resp = self._session().get(self.url, headers=headers, timeout=30)
+        if resp.status_code == 304:
+            return
+        resp.raise_for_status()
+        self.etag = resp.headers.get('ETag')
+        self.modified = resp.headers.get('Last-Modified')
+
+        feed = feedparser.parse(resp.content)
+        for entry in feed.entries:
+            entry_id = entry.get('id') or entry.get('link') or entry.get('title')
+            with self._lock:
+                if entry_id in self.seen_entries or entry_id in self._inflight:
+                    continue
+
+            # Find video link
+            video = None
+            # Try enclosure
+            for enclosure in entry.get('enclosures', []):
+                if enclosure.get('type', '').startswith('video/'):
+                    video = enclosure
+                    break
+
+            if not video:
+                # Fallback logic could go here
+                print(f"[{self.profile['name']}] No video found for {entry.get('title')}")
+                self._finish(entry_id, True)
+                continue
+
+            print(f"[{self.profile['name']}] Found new video: {entry.get('title')}")
+            with self._lock:
+                self._inflight.add(entry_id)
+            self._pool.submit(self._ingest_entry, entry_id, video.href, entry.get('title', entry_id), video.type)
+        self._save()
+
+    def _ingest_entry(self, entry_id, url, title, content_type):
+        ingested = False
         try:
-            # simple curl or requests download
-            subprocess.run(['curl', '-L', '-o', temp_path, url], check=True)
-            
-            # Now upload
-            print(f"[{self.profile['name']}] Uploading downloaded file...")
-            with open(temp_path, 'rb') as f:
-                files = {'video': f}
-                data = {'config': self.config}
-                resp = requests.post(API_URL, files=files, data=data)
-                
-            if resp.status_code == 202:
-                print(f"[{self.profile['name']}] Job initiated: {resp.json()['job_id']}")
-            
-            # Cleanup
-            os.remove(temp_path)
-            
+            backlog.wait(self.profile.get("max_backlog", 0), self.profile['name'])
+            job = self.download_and_process(url, title, content_type)
+            print(f"[{self.profile['name']}] Job initiated: {job['job_id']}")
+            ingested = True
         except Exception as e:
+            # Left unseen, so the next poll retries it
             print(f"[{self.profile['name']}] Download/Process failed: {e}")
+        finally:
+            self._finish(entry_id, ingested)
+
+    def download_and_process(self, url, title, content_type="video/mp4"):
+        # Clean title for filename
+        clean_title = "".join(x for x in title if x.isalnum() or x in "._- ")
+        filename = f"{clean_title}.mp4"
+        boundary = os.urandom(16).hex()
+
+        print(f"[{self.profile['name']}] Streaming {url} to Core API...")
+        session = self._session()
+        with session.get(url, stream=True, timeout=(10, 300)) as download:
+            download.raise_for_status()
+            body = _multipart_body({'config': self.config}, 'video', filename, content_type,
+                                   download.iter_content(DOWNLOAD_BLOCK_SIZE), boundary)
+            resp = session.post(API_URL, data=body,
+                                headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        _check_admission(resp)
+        resp.raise_for_status()
+        return resp.json()
 
 def main():
     if not os.path.exists(PROFILES_FILE):
@@ -135,6 +569,8 @@ def main():
             observer.start()
             observers.append(observer)
             print(f"[{profile['name']}] Watching {path}")
+            # After the observer starts, so nothing lands in between; add() ignores repeats
+            event_handler.scan()
             
         elif profile['type'] == 'mrss':
             poller = MRSSPoller(profile)
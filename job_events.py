@@ -0,0 +1,205 @@
+# job_events.py
+# Pushes job and batch state to Server-Sent Events subscribers.
+#
+# One background task per API process watches the database for commits by other
+# connections (PRAGMA data_version, a cheap in-memory check) and re-reads only the
+# jobs and batches someone is subscribed to, only when something changed. The DB
+# load is therefore independent of the number of connected clients.
+#
+# The feed of all jobs sends the queued/processing jobs first and after that only
+# the jobs updated since its last event (including those that just finished), so
+# a busy queue does not resend every active job on each commit.
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Iterator, Optional, Set, Tuple
+from starlette.concurrency import run_in_threadpool
+from database import get_db_connection
+from progress import JOB_FIELDS, job_snapshot, batch_summary
+from live import live_snapshot
+from viml_generator import _format_cue
+
+POLL_INTERVAL_SECONDS = 0.5
+KEEPALIVE_SECONDS = 15.0
+TERMINAL_STATUSES = ("completed", "failed", "completed_with_errors", "stopped")
+ACTIVE_JOBS = "*" # key for the feed of all queued/processing jobs
+
+Key = Tuple[str, str] # ("job" | "batch" | "jobs" | "live", id)
+
+class JobEventHub:
+    def __init__(self, interval: float = POLL_INTERVAL_SECONDS):
+        self.interval = interval
+        self._subscribers: Dict[Key, Set[asyncio.Queue]] = {}
+        self._last: Dict[Key, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._conn = None
+        self._data_version = None
+        self._jobs_since: Optional[str] = None # updated_at of the newest job sent to the "jobs" feed
+        self._jobs_full = True # the next "jobs" event is the whole active list
+
+    def subscribe(self, kind: str, key: str) -> asyncio.Queue:
+        # Latest state wins: a slow client skips intermediate snapshots
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.setdefault((kind, key), set()).add(queue)
+        self._last.pop((kind, key), None) # the new subscriber gets the current state
+        self._data_version = None
+        if kind == "jobs":
+            self._jobs_full = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, kind: str, key: str, queue: asyncio.Queue):
+        queues = self._subscribers.get((kind, key))
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[(kind, key)]
+                self._last.pop((kind, key), None)
+                if kind == "jobs":
+                    self._jobs_since = None
+
+    async def _run(self):
+        try:
+            while self._subscribers:
+                try:
+                    snapshots = await run_in_threadpool(self._poll, list(self._subscribers))
+                except Exception as e:
+                    print(f"Job event poll failed: {e}")
+                    snapshots = {}
+                for key, snapshot in snapshots.items():
+                    encoded = json.dumps(snapshot)
+                    if self._last.get(key) == encoded:
+                        continue
+                    self._last[key] = encoded
+                    for queue in self._subscribers.get(key, ()):
+                        update = snapshot
+                        if queue.full():
+                            pending = queue.get_nowait()
+                            # Job lists are changes since the previous event, so an unsent one is merged, not skipped
+                            if key[0] == "jobs":
+                                update = merge_jobs(pending, snapshot)
+                        queue.put_nowait(update)
+                await asyncio.sleep(self.interval)
+        finally:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+            self._data_version = None
+            self._jobs_since = None
+            self._jobs_full = True
+
+    def _poll(self, keys) -> Dict[Key, object]:
+        """Runs in the threadpool; reads nothing unless another connection has committed."""
+        if self._conn is None:
+            self._conn = get_db_connection(check_same_thread=False)
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return {}
+        self._data_version = version
+
+        snapshots = {}
+        job_ids = [key for kind, key in keys if kind == "job"]
+        if job_ids:
+            placeholders = ",".join("?" * len(job_ids))
+            for row in self._conn.execute(f"SELECT {JOB_FIELDS} FROM jobs WHERE job_id IN ({placeholders})", job_ids):
+                snapshots[("job", row['job_id'])] = dict(row)
+        for kind, key in keys:
+            if kind == "batch":
+                summary = batch_summary(self._conn, key)
+                if summary:
+                    snapshots[(kind, key)] = summary
+            elif kind == "live":
+                snapshot = live_snapshot(self._conn, key)
+                if snapshot:
+                    snapshots[(kind, key)] = snapshot
+            elif kind == "jobs":
+                jobs = self._changed_jobs()
+                if jobs is not None:
+                    snapshots[(kind, key)] = jobs
+        # End the read transaction so the next data_version check sees new commits
+        self._conn.commit()
+        return snapshots
+
+    def _changed_jobs(self) -> Optional[list]:
+        """
+        The active jobs (and any changed since the last event) when a subscriber
+        joined, else the jobs updated since the last event; None if there are none.
+        """
+        if self._jobs_since is None:
+            self._jobs_since = self._conn.execute("SELECT MAX(updated_at) FROM jobs").fetchone()[0] or ""
+        if self._jobs_full:
+            where = "status IN ('queued', 'processing') OR updated_at > ?"
+        else:
+            where = "updated_at > ?"
+        rows = [dict(row) for row in self._conn.execute(
+            f"SELECT {JOB_FIELDS}, updated_at FROM jobs WHERE {where} ORDER BY created_at DESC", (self._jobs_since,)
+        )]
+        full, self._jobs_full = self._jobs_full, False
+        if not rows and not full:
+            return None
+        for row in rows:
+            self._jobs_since = max(self._jobs_since, row.pop('updated_at') or "")
+        return rows
+
+hub = JobEventHub()
+
+def merge_jobs(earlier: list, later: list) -> list:
+    """Two job list events as one: every job in either, in its latest state."""
+    later_ids = {job['job_id'] for job in later}
+    return later + [job for job in earlier if job['job_id'] not in later_ids]
+
+def _is_terminal(kind: str, snapshot) -> bool:
+    return kind != "jobs" and snapshot.get("status") in TERMINAL_STATUSES
+
+def _live_events(snapshot: dict, sent: Dict[int, float]) -> Iterator[str]:
+    """
+    A "live" status event, then a "cue" event (JSON with a WebVTT rendering) for
+    every cue that is new or whose end moved since it was last sent.
+    """
+    cues = snapshot.pop("cues")
+    yield f"event: live\ndata: {json.dumps(snapshot)}\n\n"
+    for cue in cues:
+        if sent.get(cue['occurrence_id']) == cue['end_seconds']:
+            continue
+        sent[cue['occurrence_id']] = cue['end_seconds']
+        vtt = _format_cue(cue['occurrence_id'], (cue['timestamp_seconds'], cue['end_seconds'], [cue]))
+        yield f"event: cue\ndata: {json.dumps(dict(cue, vtt=vtt))}\n\n"
+    # Only cues still in the snapshot can change again
+    current = {cue['occurrence_id'] for cue in cues}
+    for occurrence_id in [i for i in sent if i not in current]:
+        del sent[occurrence_id]
+
+async def event_stream(kind: str, key: str) -> AsyncIterator[str]:
+    """
+    SSE body for one subscription. Sends the current state first, then every change;
+    a job, batch or live stream ends after its terminal state.
+    """
+    queue = hub.subscribe(kind, key)
+    sent = {} # live: occurrence_id -> end_seconds already sent
+    try:
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            terminal = _is_terminal(kind, snapshot)
+            if kind == "live":
+                for event in _live_events(dict(snapshot), sent):
+                    yield event
+            else:
+                yield f"event: {kind}\ndata: {json.dumps(snapshot)}\n\n"
+            if terminal:
+                return
+    finally:
+        hub.unsubscribe(kind, key, queue)
+
+def current_state(kind: str, key: str) -> Optional[dict]:
+    """The current job, batch or live stream state, or None if it doesn't exist."""
+    conn = get_db_connection()
+    try:
+        if kind == "live":
+            return live_snapshot(conn, key)
+        return job_snapshot(conn, key) if kind == "job" else batch_summary(conn, key)
+    finally:
+        conn.close()
@@ -0,0 +1,390 @@
+# live.py
+# Live stream ingestion: reads a continuous stream (HLS, UDP/RTP, SRT, RTMP, ...)
+# through ffmpeg, detects chyron names and faces on sampled frames as they arrive,
+# and writes occurrences to the DB in micro-batches. Subscribers receive the VIML
+# cues over Server-Sent Events (GET /v1/live/{stream_id}/events, see job_events.py).
+#
+# Processing keeps up with the stream rather than falling behind it: frames that
+# waited longer than LIVE_TARGET_LATENCY_SECONDS are skipped. Speaker diarization
+# needs the whole recording and is not run live.
+#
+# Usage without Celery (e.g. against a local test stream):
+#   ffmpeg -re -f lavfi -i testsrc=size=1280x720:rate=25 -f mpegts udp://127.0.0.1:1234
+#   python live.py udp://127.0.0.1:1234
+import collections
+import json
+import pickle
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import urlparse
+import numpy as np
+from database import get_db_connection, bump_data_version, POINT_EVENT_SECONDS
+from processing import (LITE_MODE, OCR_CROP_AREA, FACE_SPAN_MAX_GAP, _run_ocr, _run_facial_recognition,
+                        cv2, face_recognition, easyocr)
+import metrics
+
+LIVE_SAMPLE_SECONDS = 1.0 # one analysed frame per second of stream
+LIVE_FRAME_WIDTH = 960
+LIVE_FRAME_HEIGHT = 540
+LIVE_TARGET_LATENCY_SECONDS = 5.0
+# Micro-batches: DB writes happen at most this often, or sooner once this many rows are waiting
+LIVE_FLUSH_SECONDS = 1.0
+LIVE_FLUSH_ROWS = 200
+# The same name read again within this many seconds is the same chyron
+LIVE_OCR_REPEAT_SECONDS = 10.0
+# A name is linked to a face seen within this many seconds of it (as in processing._correlate_and_store)
+NAME_FACE_MAX_GAP = 1.0
+# Event snapshots carry this many of the latest cues
+LIVE_RECENT_CUES = 50
+LIVE_URL_SCHEMES = ("http", "https", "udp", "rtp", "srt", "rtmp", "rtsp")
+# LITE mode: the mock detections repeat with this period
+MOCK_PERIOD_SECONDS = 60.0
+
+def live_video_path(stream_id: str) -> str:
+    """The video_path live occurrences are stored under, so the /v1/videos endpoints work for streams."""
+    return f"live_{stream_id}"
+
+def create_stream(url: str, config: Optional[str] = None) -> str:
+    """Records a new stream in 'starting' state and returns its id; raises ValueError for unsupported URLs."""
+    if urlparse(url).scheme not in LIVE_URL_SCHEMES:
+        raise ValueError(f"Unsupported stream URL; expected one of: {', '.join(LIVE_URL_SCHEMES)}")
+    stream_id = str(uuid.uuid4())
+    conn = get_db_connection()
+    conn.execute("INSERT INTO live_streams (stream_id, url, config, status) VALUES (?, ?, ?, 'starting')",
+                 (stream_id, url, config))
+    conn.commit()
+    conn.close()
+    return stream_id
+
+def live_snapshot(conn, stream_id: str) -> Optional[dict]:
+    """
+    Stream state plus its latest cues, for the event stream. Cues are the ones that
+    ended last, so a face span that is still being extended is always included.
+    """
+    row = conn.execute(
+        "SELECT stream_id, url, status, position_seconds, latency_seconds, dropped_frames, error, created_at "
+        "FROM live_streams WHERE stream_id = ?", (stream_id,)
+    ).fetchone()
+    if not row:
+        return None
+    cues = conn.execute("""
+        SELECT o.occurrence_id, o.timestamp_seconds, o.end_seconds, o.method_used, o.confidence, p.name, p.person_id
+        FROM occurrences o JOIN persons p ON o.person_id = p.person_id
+        WHERE o.video_path = ? ORDER BY o.end_seconds DESC LIMIT ?
+    """, (live_video_path(stream_id), LIVE_RECENT_CUES)).fetchall()
+    return dict(row, cues=sorted((dict(cue) for cue in cues), key=lambda cue: cue['timestamp_seconds']))
+
+class FrameReader(threading.Thread):
+    """
+    Decodes sampled, resized frames from the stream with ffmpeg. Only the newest
+    frames are kept, so a slow consumer skips frames instead of building a backlog.
+    """
+
+    def __init__(self, url: str, max_frames: int):
+        super().__init__(daemon=True)
+        self.url = url
+        self.frames = collections.deque(maxlen=max_frames)
+        self.dropped = 0
+        self.ended = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._proc = None
+
+    def run(self):
+        try:
+            if LITE_MODE or not cv2 or not shutil.which('ffmpeg'):
+                self._run_mock()
+            else:
+                self._run_ffmpeg()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            with self._cond:
+                self.ended = True
+                self._cond.notify()
+
+    def _push(self, timestamp: float, frame):
+        with self._cond:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append((timestamp, time.monotonic(), frame))
+            self._cond.notify()
+
+    def _run_ffmpeg(self):
+        command = ['ffmpeg', '-loglevel', 'error', '-i', self.url,
+                   '-vf', f'fps=1/{LIVE_SAMPLE_SECONDS},scale={LIVE_FRAME_WIDTH}:{LIVE_FRAME_HEIGHT}',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        frame_size = LIVE_FRAME_WIDTH * LIVE_FRAME_HEIGHT * 3
+        self._proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        index = 0
+        while not self._stop.is_set():
+            data = self._proc.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+            frame = np.frombuffer(data, np.uint8).reshape(LIVE_FRAME_HEIGHT, LIVE_FRAME_WIDTH, 3)
+            self._push(index * LIVE_SAMPLE_SECONDS, frame)
+            index += 1
+        code = self._proc.wait()
+        if code and not self._stop.is_set():
+            raise RuntimeError(f"ffmpeg exited with {code}: {self._proc.stderr.read().decode(errors='replace')[-500:]}")
+
+    def _run_mock(self):
+        # LITE mode: no decoder, just the stream clock
+        index = 0
+        while not self._stop.is_set():
+            self._push(index * LIVE_SAMPLE_SECONDS, None)
+            index += 1
+            self._stop.wait(LIVE_SAMPLE_SECONDS)
+
+    def next(self, timeout: float):
+        """(timestamp, read_at, frame) for the oldest kept frame, or None if none arrived in time."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.frames or self.ended, timeout)
+            return self.frames.popleft() if self.frames else None
+
+    def stop(self):
+        self._stop.set()
+        if self._proc and self._proc.poll() is None:
+            self._proc.terminate()
+
+class LiveSession:
+    """
+    Runs one live stream until it ends, fails, or is asked to stop (status
+    'stopping'). Identities are correlated incrementally the same way
+    processing._correlate_and_store does it for files: a chyron name next to a
+    face establishes the person, and later matches of that face extend a face
+    span whose end is updated in place as the person stays on screen.
+    """
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        self.video_path = live_video_path(stream_id)
+        self.conn = get_db_connection()
+        row = self.conn.execute("SELECT url, config FROM live_streams WHERE stream_id = ?", (stream_id,)).fetchone()
+        if not row:
+            raise ValueError(f"Unknown live stream: {stream_id}")
+        self.url = row['url']
+        config = {}
+        try:
+            config = json.loads(row['config'] or "{}")
+        except ValueError:
+            pass
+        self.review_status = 'approved' if config.get('auto_approve') else 'pending'
+
+        self.person_ids = {} # name -> person_id
+        self.known_faces = {} # person_id -> [encodings]
+        self.recent_faces = collections.deque() # (timestamp, faces) within NAME_FACE_MAX_GAP
+        self.last_read = {} # name -> last timestamp the name was on screen
+        self.open_spans = {} # person_id -> span dict
+        self.closed_spans = []
+        self.pending = [] # occurrence rows waiting for the next flush
+        self.pending_identifiers = []
+        self.position = 0.0
+        self.latency = None
+        self.skipped = 0
+        self._ocr_reader = None
+        self._mocks = None
+
+    def run(self):
+        reader = FrameReader(self.url, max_frames=max(int(LIVE_TARGET_LATENCY_SECONDS / LIVE_SAMPLE_SECONDS), 1))
+        reader.start()
+        self.flush(status='live')
+        print(f"[live {self.stream_id}] Reading {self.url}")
+        status, error = 'stopped', None
+        last_flush = time.monotonic()
+        try:
+            while True:
+                item = reader.next(timeout=LIVE_FLUSH_SECONDS)
+                if item:
+                    timestamp, read_at, frame = item
+                    metrics.FRAMES_DECODED.labels("live").inc()
+                    if time.monotonic() - read_at > LIVE_TARGET_LATENCY_SECONDS:
+                        self.skipped += 1
+                    else:
+                        metrics.FRAMES_ANALYSED.labels("live").inc()
+                        self.process_frame(timestamp, frame)
+                        self.position = timestamp
+                        # Time from the frame leaving the decoder to its detections being ready
+                        self.latency = time.monotonic() - read_at
+                elif reader.ended:
+                    if reader.error:
+                        status, error = 'failed', reader.error
+                    break
+                if time.monotonic() - last_flush >= LIVE_FLUSH_SECONDS or len(self.pending) >= LIVE_FLUSH_ROWS:
+                    last_flush = time.monotonic()
+                    if self.flush(dropped=reader.dropped) == 'stopping':
+                        break
+        except Exception as e:
+            status, error = 'failed', str(e)
+            raise
+        finally:
+            reader.stop()
+            self.closed_spans.extend(self.open_spans.values())
+            self.open_spans = {}
+            self.flush(status=status, error=error, dropped=reader.dropped)
+            self.conn.close()
+            print(f"[live {self.stream_id}] {status}" + (f": {error}" if error else ""))
+
+    # --- Detection ---
+
+    def _mock_hits(self, timestamp: float, kind: str) -> list:
+        # LITE mode: the file pipeline's mock detections, recurring every MOCK_PERIOD_SECONDS
+        if self._mocks is None:
+            self._mocks = {"text": dict(_run_ocr(self.video_path)), "faces": _run_facial_recognition(self.video_path)}
+        mock = self._mocks[kind]
+        offset = timestamp % MOCK_PERIOD_SECONDS
+        return [mock[t] for t in mock if offset <= t < offset + LIVE_SAMPLE_SECONDS]
+
+    def detect_text(self, timestamp: float, frame) -> list:
+        if frame is None:
+            return self._mock_hits(timestamp, "text")
+        if self._ocr_reader is None:
+            load_started = time.monotonic()
+            self._ocr_reader = easyocr.Reader(['en'])
+            metrics.MODEL_LOAD_SECONDS.labels("easyocr").observe(time.monotonic() - load_started)
+        # OCR_CROP_AREA (w:h:x:y) is given for 1080p frames
+        w, h, x, y = (int(v) for v in OCR_CROP_AREA.split(":"))
+        sx, sy = LIVE_FRAME_WIDTH / 1920, LIVE_FRAME_HEIGHT / 1080
+        crop = frame[int(y * sy):int((y + h) * sy), int(x * sx):int((x + w) * sx)]
+        readings = [text for text in self._ocr_reader.readtext(crop, detail=0) if len(text.strip()) > 2]
+        metrics.OCR_READINGS.labels("live").inc(len(readings))
+        return readings
+
+    def detect_faces(self, timestamp: float, frame) -> list:
+        if frame is None:
+            return [face for faces in self._mock_hits(timestamp, "faces") for face in faces]
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb_frame)
+        encodings = face_recognition.face_encodings(rgb_frame, locations)
+        metrics.FACE_ENCODINGS.labels("live").inc(len(encodings))
+        return [{"location": loc, "encoding": enc} for loc, enc in zip(locations, encodings)]
+
+    # --- Incremental correlation ---
+
+    def _person(self, name: str) -> int:
+        if name not in self.person_ids:
+            row = self.conn.execute("SELECT person_id FROM persons WHERE video_path = ? AND name = ?",
+                                    (self.video_path, name)).fetchone()
+            if row:
+                self.person_ids[name] = row['person_id']
+            else:
+                # Committed straight away: a new person is rare, and an open write
+                # transaction would block other writers until the next flush
+                cursor = self.conn.execute("INSERT INTO persons (video_path, name) VALUES (?, ?)", (self.video_path, name))
+                self.conn.commit()
+                self.person_ids[name] = cursor.lastrowid
+        return self.person_ids[name]
+
+    def process_frame(self, timestamp: float, frame):
+        faces = self.detect_faces(timestamp, frame)
+        self.recent_faces.append((timestamp, faces))
+        while self.recent_faces and timestamp - self.recent_faces[0][0] > NAME_FACE_MAX_GAP:
+            self.recent_faces.popleft()
+
+        for text in self.detect_text(timestamp, frame):
+            name = text.strip().title()
+            last = self.last_read.get(name)
+            self.last_read[name] = timestamp
+            if last is not None and timestamp - last < LIVE_OCR_REPEAT_SECONDS:
+                continue # same chyron, still on screen
+            nearby = [face for _, items in self.recent_faces for face in items]
+            if not nearby:
+                continue
+            person_id = self._person(name)
+            encoding = nearby[0]['encoding']
+            self.pending.append((person_id, timestamp, timestamp + POINT_EVENT_SECONDS, 'ocr', 95.0, text))
+            self.pending_identifiers.append((person_id, 'face', pickle.dumps(encoding)))
+            self.known_faces.setdefault(person_id, []).append(encoding)
+
+        if face_recognition:
+            for face in faces:
+                for person_id, encodings in self.known_faces.items():
+                    if True in face_recognition.compare_faces(encodings, face['encoding']):
+                        span = self.open_spans.get(person_id)
+                        if span:
+                            span['last'] = timestamp
+                            span['dirty'] = True
+                        else:
+                            self.open_spans[person_id] = {"person_id": person_id, "start": timestamp, "last": timestamp,
+                                                          "location": face['location'], "occurrence_id": None, "dirty": True}
+                        break
+        for person_id, span in list(self.open_spans.items()):
+            if timestamp - span['last'] > FACE_SPAN_MAX_GAP:
+                self.closed_spans.append(self.open_spans.pop(person_id))
+
+    def flush(self, status: Optional[str] = None, error: Optional[str] = None, dropped: int = 0) -> str:
+        """Writes everything detected since the last flush in one transaction; returns the stream's status."""
+        rows, self.pending = self.pending, []
+        identifiers, self.pending_identifiers = self.pending_identifiers, []
+        spans = [span for span in list(self.open_spans.values()) + self.closed_spans if span['dirty']]
+        self.closed_spans = []
+
+        cursor = self.conn.cursor()
+        cursor.executemany(
+            "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, end_seconds, method_used, confidence, details, review_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self.video_path, *row, self.review_status) for row in rows]
+        )
+        cursor.executemany("INSERT INTO identifiers (person_id, method, biometric_data) VALUES (?, ?, ?)", identifiers)
+        updates = []
+        opened = 0
+        for span in spans:
+            end = span['last'] + POINT_EVENT_SECONDS
+            if span['occurrence_id'] is None:
+                # Stored when it opens, so subscribers see a person as soon as they appear
+                cursor.execute(
+                    "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, end_seconds, method_used, confidence, details, review_status) VALUES (?, ?, ?, ?, 'face', 90.0, ?, ?)",
+                    (self.video_path, span['person_id'], span['start'], end, str(span['location']), self.review_status)
+                )
+                span['occurrence_id'] = cursor.lastrowid
+                opened += 1
+            else:
+                updates.append((end, span['occurrence_id']))
+            span['dirty'] = False
+        cursor.executemany("UPDATE occurrences SET end_seconds = ? WHERE occurrence_id = ?", updates)
+        # Extending open spans, what most batches do, leaves the aggregates (counts per
+        # video and person) unchanged; the stream's VIML version is bumped by triggers
+        if rows or opened:
+            bump_data_version(self.conn)
+
+        cursor.execute(
+            """
+            UPDATE live_streams SET status = CASE
+                    -- a stop requested before the stream came up wins over 'live'
+                    WHEN ? = 'live' AND status = 'stopping' THEN status ELSE COALESCE(?, status) END,
+                error = COALESCE(?, error),
+                position_seconds = ?, latency_seconds = ?, dropped_frames = ?,
+                updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE stream_id = ?
+            """,
+            (status, status, error, self.position, self.latency, dropped + self.skipped, self.stream_id)
+        )
+        current = cursor.execute("SELECT status FROM live_streams WHERE stream_id = ?", (self.stream_id,)).fetchone()
+        self.conn.commit()
+        return current['status'] if current else 'stopping'
+
+def stop_stream(stream_id: str) -> bool:
+    """Asks a running stream to stop; it finishes its open spans and ends as 'stopped'."""
+    conn = get_db_connection()
+    cursor = conn.execute(
+        "UPDATE live_streams SET status = 'stopping' WHERE stream_id = ? AND status IN ('starting', 'live')", (stream_id,)
+    )
+    conn.commit()
+    conn.close()
+    return cursor.rowcount > 0
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python live.py <stream url> [config json]")
+        sys.exit(1)
+    stream_id = create_stream(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Live stream {stream_id}: cues at /v1/live/{stream_id}/events")
+    try:
+        LiveSession(stream_id).run()
+    except KeyboardInterrupt:
+        pass # run() has recorded the stream as stopped
@@ -1,40 +1,59 @@
 from fastapi import FastAPI, File, UploadFile, BackgroundTasks, Form, HTTPException, Request, Query
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 import shutil
 import os
+import asyncio
 import uuid
 import json
 import sqlite3
 import subprocess
+import hashlib
+import base64
+import time
 
 # Local imports
-from database import get_db_connection, init_db
+from database import get_db_connection, init_db, get_data_version, bump_data_version, has_span_index
 import tasks
+from celery import group
+from tasks import process_video_task, live_stream_task, lane_queue, normalize_priority, PRIORITIES, LIVE_QUEUE
 from tasks import process_video_task
-from processing import _run_ocr, _run_facial_recognition, _run_speaker_diarization
-from tasks import process_video_task
-from viml_generator import generate_vtt_from_db
-# Import processing logic for ephemeral extraction
-# Note: In a real microservice, extraction logic might be in a shared lib or separate service
-from processing import _run_ocr, _run_facial_recognition, _run_speaker_diarization
+from viml_generator import iter_vtt_from_db, iter_chunks, write_viml_sidecars
+import muxing
+from progress import JOB_FIELDS, job_snapshot, job_stages, batch_summary, lane_summary
+from job_events import event_stream, current_state, ACTIVE_JOBS
+from admission import AdmissionDenied, check_admission
+from live import create_stream, stop_stream, live_video_path
+from ingest import (save_upload, receive_multipart, MAX_UPLOAD_BYTES, VALIDATE_MEDIA, SESSION_CHUNK_SIZE,
+                    SESSION_TTL_SECONDS, SESSION_FINALIZE_TIMEOUT_SECONDS, sniff_media_kind, preallocate, write_chunk, merge_ranges, missing_ranges, hash_file, read_head,
+                    resolve_ingest_path, link_into)
+# Ephemeral extraction runs in a process pool, with results cached by content hash
+from ephemeral import run_analysis, AnalysisTimeout
+import metrics
+import tracing
 
 app = FastAPI(title="VIML API", version="0.2.0")
 
 # helper to ensure directories exist
 UPLOAD_FOLDER = 'uploads'
 GENERATED_FOLDER = 'generated'
+# Resumable uploads are assembled here, outside the /files mount, until finalized
+PARTIAL_UPLOAD_FOLDER = os.path.join(GENERATED_FOLDER, 'partial_uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
+os.makedirs(PARTIAL_UPLOAD_FOLDER, exist_ok=True)
 
 # --- FRONTEND SETUP ---
 app.mount("/static", StaticFiles(directory="viml_ui/static"), name="static")
 # Serve uploads for the video player. In production, use Nginx/S3 signed URLs.
-app.mount("/files", StaticFiles(directory=UPLOAD_FOLDER), name="files") 
+# Registered files may be symlinks into shared storage (see /v1/process/register).
+app.mount("/files", StaticFiles(directory=UPLOAD_FOLDER, follow_symlink=True), name="files") 
 templates = Jinja2Templates(directory="viml_ui/templates")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
@@ -50,13 +69,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browsers only let scripts read response headers listed here
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Reject oversized ingest requests from Content-Length, before the body is read
+INGEST_PATH_PREFIXES = ("/v1/process", "/v1/analyze/", "/v1/extract/")
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if MAX_UPLOAD_BYTES and request.method == "POST" and request.url.path.startswith(INGEST_PATH_PREFIXES):
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"Upload exceeds {MAX_UPLOAD_BYTES} bytes"})
+    return await call_next(request)
+
+# Refuse new jobs while overloaded, also before the body is read; the endpoints
+# check again once they know the job count, size and profile (see admission.py)
+ADMISSION_PATH_PREFIX = "/v1/process"
+ADMISSION_PATHS = ("/v1/uploads",)
+
+def _overloaded_response(denied: AdmissionDenied) -> JSONResponse:
+    return JSONResponse(status_code=429, content=denied.content(), headers={"Retry-After": str(denied.retry_after)})
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    path = request.url.path
+    if request.method == "POST" and (path.startswith(ADMISSION_PATH_PREFIX) or path in ADMISSION_PATHS):
+        length = request.headers.get("content-length")
+        try:
+            await run_in_threadpool(check_admission, UPLOAD_FOLDER, 1, int(length) if length and length.isdigit() else 0)
+        except AdmissionDenied as denied:
+            return _overloaded_response(denied)
+    return await call_next(request)
+
+# Ingest requests start a job's trace; the job keeps its traceparent (see tracing.py)
+@app.middleware("http")
+async def trace_ingest(request: Request, call_next):
+    path = request.url.path
+    if not (tracing.TRACING_ENABLED and request.method == "POST"
+            and (path.startswith(ADMISSION_PATH_PREFIX) or path.endswith("/finalize"))):
+        return await call_next(request)
+    with tracing.span(f"POST {path}", attributes={"http.method": "POST", "http.target": path}) as attributes:
+        response = await call_next(request)
+        attributes["http.status_code"] = response.status_code
+    return response
+
+# Registered last, so it is the outermost middleware and also times refused requests
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # The route template, not the raw path, keeps IDs out of the labels
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.labels(request.method, route.path if route else "unmatched",
+                                str(response.status_code)).observe(time.perf_counter() - start)
+    return response
+
+@app.exception_handler(AdmissionDenied)
+async def admission_denied_handler(request: Request, denied: AdmissionDenied):
+    return _overloaded_response(denied)
+
+async def _admit(config: Optional[str], new_jobs: int = 1, incoming_bytes: int = 0):
+    """Raises AdmissionDenied (429) unless new_jobs jobs from config's ingest profile can be accepted."""
+    await run_in_threadpool(check_admission, UPLOAD_FOLDER, new_jobs, incoming_bytes, _config_value(config, "profile"))
+
 # --- Pydantic Models ---
 class JobStatus(BaseModel):
     job_id: str
     status: str
     result: Optional[str] = None
+    priority: Optional[str] = None
+    created_at: Optional[str] = None
+    stage: Optional[str] = None
+    stage_done: Optional[int] = None
+    stage_total: Optional[int] = None
+    progress: Optional[float] = None
+    eta_seconds: Optional[float] = None
+    stages: Optional[List[dict]] = None
+    trace_id: Optional[str] = None
+    profiles: Optional[List[dict]] = None
 
 # --- HTML ROUTES ---
 @app.get("/", response_class=HTMLResponse)
@@ -98,66 +190,180 @@ class SearchResponse(BaseModel):
 def startup_event():
     init_db()
 
-@app.post("/v1/process")
-async def process_video(
-    video: UploadFile = File(...),
-    config: Optional[str] = Form(None) # JSON string for configuration (crops, etc.)
-):
+def _multipart_body(file_field: str, multiple: bool = False) -> dict:
+    """OpenAPI request body for endpoints that parse their multipart body with receive_multipart."""
+    file_schema = {"type": "string", "format": "binary"}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": [file_field],
+        "properties": {
+            file_field: {"type": "array", "items": file_schema} if multiple else file_schema,
+            "config": {"type": "string", "description": "JSON-encoded settings"}
+        }
+    }}}}}
+
+async def _admit_received(config: Optional[str], files: List[dict]):
+    """_admit for files that are already on disk; they are removed if the jobs are refused."""
+    try:
+        await _admit(config, len(files))
+    except BaseException:
+        for received in files:
+            os.remove(received['path'])
+        raise
+
+@app.post("/v1/process", openapi_extra=_multipart_body("video"))
+async def process_video(request: Request):
     """
-    Ingest a single video.
+    Ingest a single video (multipart form: 'video' file, optional 'config').
     Optional 'config' form field can contain JSON-encoded settings.
-    Example config: {"auto_approve": true, "steps": ["ocr", "face"]}
+    Example config: {"auto_approve": true, "steps": ["ocr", "face"], "priority": "high"}
+    "steps" picks the detection stages (ocr, face, audio; default all) and
+    "step_options" their parameters, e.g. {"face": {"sample_rate": 2, "model": "cnn"}}.
+    "priority" picks the lane: high (live news), normal (default) or low (backfills).
+    "profile" names the ingest profile, for per-profile quotas (see admission.py).
+    "profiling": true samples the job's stages with a stack profiler (see tracing.py).
+    Returns 429 with Retry-After while the system is overloaded.
+    The body is written straight to uploads/ as it arrives, so a non-video file
+    is refused (415) after its first bytes, not after the whole upload.
     """
     job_id = str(uuid.uuid4())
-    video_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{video.filename}")
-    
-    with open(video_path, "wb") as buffer:
-        shutil.copyfileobj(video.file, buffer)
+    with tracing.span("receive upload", attributes={"viml.job_id": job_id}) as attributes:
+        fields, files = await receive_multipart(
+            request, "video", lambda filename: os.path.join(UPLOAD_FOLDER, f"{job_id}_{filename}"), max_files=1)
+        attributes["viml.bytes"] = sum(f['size'] for f in files)
+    if not files:
+        raise HTTPException(status_code=422, detail="Missing 'video' file")
+    config = fields.get("config")
+    await _admit_received(config, files)
     
-    # Check config for auto_approve
-    auto_approve = False
+    upload = files[0]
+    return JSONResponse(status_code=202, content=_create_job(job_id, upload['path'], config, upload))
+
+def _job_row(job_id: str, video_path: str, config: Optional[str], upload: dict, batch_id: Optional[str] = None) -> tuple:
+    """Values for INSERT_JOB_SQL. video_path is UPLOAD_FOLDER/{job_id}_{filename}."""
+    filename = os.path.basename(video_path)[len(job_id) + 1:]
+    return (job_id, "queued", config, _config_value(config, "auto_approve", False), upload['sha256'], upload['size'],
+            filename, batch_id, video_path, _job_priority(config), _config_value(config, "profile"),
+            tracing.traceparent())
+
+def _config_value(config: Optional[str], key: str, default=None):
     if config:
         try:
-            config_json = json.loads(config)
-            auto_approve = config_json.get("auto_approve", False)
+            return json.loads(config).get(key, default)
         except:
             pass
+    return default
 
-    # Store initial job status
-    conn = get_db_connection()
-    conn.execute(
-        "INSERT INTO jobs (job_id, status, config, auto_approve) VALUES (?, ?, ?, ?)",
-        (job_id, "queued", config, auto_approve)
-    )
-    conn.commit()
-    conn.close()
+def _job_priority(config: Optional[str]) -> str:
+    """The job's priority lane from config["priority"]; unknown values fall back to normal."""
+    return normalize_priority(_config_value(config, "priority"))
 
-    # Trigger Celery Task
-    process_video_task.apply_async(args=[video_path, job_id])
+INSERT_JOB_SQL = """
+    INSERT INTO jobs (job_id, status, config, auto_approve, source_sha256, source_size, filename, batch_id, video_path,
+                      priority, profile, traceparent, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'), strftime('%Y-%m-%d %H:%M:%f', 'now'))
+"""
+
+def _job_response(job_id: str, upload: dict) -> dict:
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/v1/jobs/{job_id}",
+        "sha256": upload['sha256'],
+        "size": upload['size']
+    }
+
+def _create_job(job_id: str, video_path: str, config: Optional[str], upload: dict) -> dict:
+    """Records a queued job for a video already in UPLOAD_FOLDER and hands it to Celery."""
+    with tracing.span("create job", attributes={"viml.job_id": job_id}):
+        # Store initial job status
+        conn = get_db_connection()
+        conn.execute(INSERT_JOB_SQL, _job_row(job_id, video_path, config, upload))
+        conn.commit()
+        conn.close()
+
+        # Trigger Celery Task in the job's priority lane
+        priority = _job_priority(config)
+        process_video_task.apply_async(args=[video_path, job_id, priority], queue=lane_queue("celery", priority))
     
-    return JSONResponse(
-        status_code=202,
-        content={
-            "job_id": job_id,
-            "status": "queued",
-            "status_url": f"/v1/jobs/{job_id}"
-        }
-    )
+    return _job_response(job_id, upload)
+
+def _create_batch(entries: list, config: Optional[str]) -> dict:
+    """
+    Records a batch and all of its jobs in one transaction, then dispatches them as
+    one Celery group. entries: (job_id, video_path, filename, upload) per video.
+    """
+    batch_id = str(uuid.uuid4())
+    with tracing.span("create batch", attributes={"viml.batch_id": batch_id, "viml.jobs": len(entries)}):
+        conn = get_db_connection()
+        try:
+            conn.execute(
+                "INSERT INTO batches (batch_id, config, job_count) VALUES (?, ?, ?)",
+                (batch_id, config, len(entries))
+            )
+            conn.executemany(INSERT_JOB_SQL, [
+                _job_row(job_id, video_path, config, upload, batch_id)
+                for job_id, video_path, _, upload in entries
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+
+        priority = _job_priority(config)
+        group(
+            process_video_task.s(video_path, job_id, priority).set(queue=lane_queue("celery", priority))
+            for job_id, video_path, _, _ in entries
+        ).apply_async()
+
+    return {
+        "batch_id": batch_id,
+        "status": "queued",
+        "status_url": f"/v1/batches/{batch_id}",
+        "job_count": len(entries),
+        "batch_results": [
+            {"filename": filename, **_job_response(job_id, upload)}
+            for job_id, _, filename, upload in entries
+        ]
+    }
+
+class RegisterRequest(BaseModel):
+    path: str # as seen by the server, under one of VIML_INGEST_ROOTS
+    config: Optional[str] = None
+
+@app.post("/v1/process/register")
+async def register_video(request: RegisterRequest):
+    """
+    Ingest a video that is already on storage the server can see, without uploading it.
+    The file is hardlinked, reflinked or symlinked into uploads/ instead of copied,
+    and is not re-read here, so the job records its size but no SHA-256.
+    """
+    await _admit(request.config)
+    source = resolve_ingest_path(request.path)
+    if VALIDATE_MEDIA and sniff_media_kind(await run_in_threadpool(read_head, source)) != "video":
+        raise HTTPException(status_code=415, detail="Unsupported media type; expected video")
+
+    job_id = str(uuid.uuid4())
+    video_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{os.path.basename(source)}")
+    link = await run_in_threadpool(link_into, source, video_path)
+
+    content = _create_job(job_id, video_path, request.config, {"size": os.path.getsize(source), "sha256": None})
+    content["link"] = link
+    return JSONResponse(status_code=202, content=content)
 
 @app.post("/v1/analyze/ocr")
-async def analyze_ocr(file: UploadFile = File(...)):
+async def analyze_ocr(file: UploadFile = File(...), quick: bool = False):
     """Modular endpoint: Run ONLY OCR on the uploaded video."""
-    return await _run_modular_analysis(file, "ocr")
+    return await _run_modular_analysis(file, "ocr", quick)
 
 @app.post("/v1/analyze/face")
-async def analyze_face(file: UploadFile = File(...)):
+async def analyze_face(file: UploadFile = File(...), quick: bool = False):
     """Modular endpoint: Run ONLY Facial Recognition."""
-    return await _run_modular_analysis(file, "face")
+    return await _run_modular_analysis(file, "face", quick)
 
 @app.post("/v1/analyze/audio")
-async def analyze_audio(file: UploadFile = File(...)):
+async def analyze_audio(file: UploadFile = File(...), quick: bool = False):
     """Modular endpoint: Run ONLY Speaker Diarization."""
-    return await _run_modular_analysis(file, "audio")
+    return await _run_modular_analysis(file, "audio", quick)
 
 class MetadataUpdate(BaseModel):
     review_status: str
@@ -166,49 +372,40 @@ class MetadataUpdate(BaseModel):
     organization: Optional[str] = None
     role: Optional[str] = None # host or guest
 
-@app.patch("/v1/metadata/{occurrence_id}")
-async def update_metadata(occurrence_id: int, update: MetadataUpdate):
-    """
-    Human Review Endpoint.
-    **Refactored**: Updates Person role, title, org, name.
-    """
-    if update.review_status not in ['pending', 'approved', 'rejected']:
-        raise HTTPException(400, "Invalid status")
-        
+def _apply_metadata_update(occurrence_id: int, update: MetadataUpdate) -> dict:
+    """The review edit in one transaction: a merge, the person update and the status change commit together."""
     conn = get_db_connection()
-    
-    # 1. Fetch current occurrence + linked person
-    row = conn.execute("""
-        SELECT o.person_id, o.method_used, p.name 
-        FROM occurrences o
-        JOIN persons p ON o.person_id = p.person_id
-        WHERE o.occurrence_id = ?
-    """, (occurrence_id,)).fetchone()
-    
-    if not row:
-        conn.close()
-        raise HTTPException(404, "Occurrence not found")
-    
-    person_id = row['person_id']
-    method = row['method_used']
-    current_name = row['name']
-    
-    # 2. Handle Person Updates (Name, Title, Org, Role)
-    # Allow updates from ANY method (OCR, Face, Voice)
-    if True:
+    try:
+        # Take the write lock up front; WAL keeps readers unblocked meanwhile
+        conn.execute("BEGIN IMMEDIATE")
+        
+        # 1. Fetch current occurrence + linked person
+        row = conn.execute("""
+            SELECT o.person_id, o.method_used, p.name 
+            FROM occurrences o
+            JOIN persons p ON o.person_id = p.person_id
+            WHERE o.occurrence_id = ?
+        """, (occurrence_id,)).fetchone()
+        
+        if not row:
+            raise HTTPException(404, "Occurrence not found")
+        
+        person_id = row['person_id']
+        method = row['method_used']
+        current_name = row['name']
+        
+        # 2. Handle Person Updates (Name, Title, Org, Role)
+        # Allow updates from ANY method (OCR, Face, Voice)
         updates = []
         values = []
         
-        # Name Change / Merge Logic... (Simplified for brevity, same as before)
         if update.details and update.details != current_name:
             new_name = update.details.strip()
             existing_person = conn.execute("SELECT person_id FROM persons WHERE name = ?", (new_name,)).fetchone()
             if existing_person:
                 # Merge
                 target_id = existing_person['person_id']
-                conn.execute("UPDATE occurrences SET person_id = ? WHERE person_id = ?", (target_id, person_id))
-                conn.execute("UPDATE identifiers SET person_id = ? WHERE person_id = ?", (target_id, person_id))
-                conn.execute("DELETE FROM persons WHERE person_id = ?", (person_id,))
+                _merge_persons(conn, [person_id], target_id)
                 person_id = target_id
             else:
                 updates.append("name = ?")
@@ -228,36 +425,217 @@ async def update_metadata(occurrence_id: int, update: MetadataUpdate):
             values.append(person_id)
             conn.execute(f"UPDATE persons SET {', '.join(updates)} WHERE person_id = ?", tuple(values))
 
-    # 3. Update Occurrence Status & Details
-    # If we merged persons, the occurrence row is still valid (linked to new person_id)
-    # But we still need to update status.
+        # 3. Update Occurrence Status & Details
+        # If we merged persons, the occurrence row is still valid (linked to new person_id)
+        # But we still need to update status.
+        
+        query = "UPDATE occurrences SET review_status = ?"
+        params = [update.review_status]
+        
+        if update.details and method == 'ocr':
+            query += ", details = ?"
+            params.append(update.details)
+            
+        query += " WHERE occurrence_id = ?"
+        params.append(occurrence_id)
+        
+        conn.execute(query, tuple(params))
+        bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
-    query = "UPDATE occurrences SET review_status = ?"
-    params = [update.review_status]
+    return {"status": "updated", "occurrence_id": occurrence_id, "person_updated": person_id}
+
+@app.patch("/v1/metadata/{occurrence_id}")
+async def update_metadata(occurrence_id: int, update: MetadataUpdate):
+    """
+    Human Review Endpoint.
+    **Refactored**: Updates Person role, title, org, name.
+    A rename to an existing name merges into that person, atomically with the status change.
+    """
+    if update.review_status not in ['pending', 'approved', 'rejected']:
+        raise HTTPException(400, "Invalid status")
     
-    if update.details and method == 'ocr':
-        query += ", details = ?"
-        params.append(update.details)
-        
-    query += " WHERE occurrence_id = ?"
-    params.append(occurrence_id)
+    return await run_in_threadpool(_apply_metadata_update, occurrence_id, update)
+
+# --- Bulk Review ---
+# A bulk action runs in one transaction, so a failure leaves nothing half-applied.
+# Its statements are set-based (one UPDATE per SQL_CHUNK_SIZE ids, as SQLite caps
+# bound parameters), which keeps the write lock short even for large merges.
+SQL_CHUNK_SIZE = 500
+BULK_ACTION_STATUS = {"approve": "approved", "reject": "rejected", "reset": "pending"}
+
+class BulkReviewRequest(BaseModel):
+    action: str # approve | reject | reset | relabel | merge
+    occurrence_ids: List[int] = []
+    person_ids: List[int] = []
+    # relabel
+    name: Optional[str] = None
+    title: Optional[str] = None
+    organization: Optional[str] = None
+    role: Optional[str] = None
+    # merge
+    target_person_id: Optional[int] = None
+    # approve/reject by person_ids only changes pending occurrences unless this is set
+    include_reviewed: bool = False
+
+def _chunks(ids: list, size: int = SQL_CHUNK_SIZE):
+    ids = list(dict.fromkeys(ids)) # de-duplicate, keep order
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _merge_persons(conn, source_ids: list, target_id: int) -> dict:
+    """
+    Re-points occurrences and identifiers of the source persons to target_id and
+    deletes the sources. Runs in the caller's transaction.
+    """
+    moved = {"occurrences": 0, "identifiers": 0, "persons": 0}
+    sources = [pid for pid in source_ids if pid != target_id]
+    for chunk in _chunks(sources):
+        marks = ",".join("?" * len(chunk))
+        moved["occurrences"] += conn.execute(
+            f"UPDATE occurrences SET person_id = ? WHERE person_id IN ({marks})", (target_id, *chunk)).rowcount
+        moved["identifiers"] += conn.execute(
+            f"UPDATE identifiers SET person_id = ? WHERE person_id IN ({marks})", (target_id, *chunk)).rowcount
+        moved["persons"] += conn.execute(
+            f"DELETE FROM persons WHERE person_id IN ({marks})", tuple(chunk)).rowcount
+    return moved
+
+def _persons_of_occurrences(conn, occurrence_ids: list) -> list:
+    person_ids = []
+    for chunk in _chunks(occurrence_ids):
+        marks = ",".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT DISTINCT person_id FROM occurrences WHERE occurrence_id IN ({marks})", tuple(chunk)).fetchall()
+        person_ids.extend(row['person_id'] for row in rows)
+    return person_ids
+
+def _bulk_set_status(conn, request: BulkReviewRequest, status: str) -> dict:
+    updated = 0
+    for chunk in _chunks(request.occurrence_ids):
+        marks = ",".join("?" * len(chunk))
+        updated += conn.execute(
+            f"UPDATE occurrences SET review_status = ? WHERE occurrence_id IN ({marks}) AND review_status != ?",
+            (status, *chunk, status)).rowcount
+    # A person spans many videos; approving or rejecting them must not overturn
+    # decisions already taken on some of their occurrences
+    from_status = 'pending' if status != 'pending' and not request.include_reviewed else None
+    for chunk in _chunks(request.person_ids):
+        marks = ",".join("?" * len(chunk))
+        if from_status:
+            where, params = f"person_id IN ({marks}) AND review_status = ?", (status, *chunk, from_status)
+        else:
+            where, params = f"person_id IN ({marks}) AND review_status != ?", (status, *chunk, status)
+        updated += conn.execute(f"UPDATE occurrences SET review_status = ? WHERE {where}", params).rowcount
+    return {"occurrences_updated": updated}
+
+def _bulk_relabel(conn, request: BulkReviewRequest) -> dict:
+    summary = {"persons_updated": 0, "persons_merged": 0, "occurrences_moved": 0}
+    person_ids = list(dict.fromkeys(request.person_ids + _persons_of_occurrences(conn, request.occurrence_ids)))
     
-    conn.execute(query, tuple(params))
-    conn.commit()
-    conn.close()
+    # Same rule as the single-item review: renaming to an existing name merges into that person
+    if request.name:
+        new_name = request.name.strip()
+        existing_person = conn.execute("SELECT person_id FROM persons WHERE name = ?", (new_name,)).fetchone()
+        if existing_person:
+            target_id = existing_person['person_id']
+            moved = _merge_persons(conn, person_ids, target_id)
+            summary["persons_merged"] += moved["persons"]
+            summary["occurrences_moved"] += moved["occurrences"]
+            person_ids = [target_id]
     
-    return {"status": "updated", "occurrence_id": occurrence_id, "person_updated": person_id}
-@app.get("/v1/review/queue")
-async def get_review_queue(job_id: Optional[str] = None, status: Optional[str] = 'pending', limit: int = 50, grouped: bool = False):
-    conn = get_db_connection()
+    fields = [("name", request.name.strip())] if request.name else []
+    fields += [(col, getattr(request, col)) for col in ("title", "organization", "role") if getattr(request, col)]
+    if fields:
+        assignments = ", ".join(f"{col} = ?" for col, _ in fields)
+        # Only touch rows that actually differ, so repeated calls report zero updates
+        changed = " OR ".join(f"{col} IS NOT ?" for col, _ in fields)
+        values = [value for _, value in fields]
+        for chunk in _chunks(person_ids):
+            marks = ",".join("?" * len(chunk))
+            summary["persons_updated"] += conn.execute(
+                f"UPDATE persons SET {assignments} WHERE person_id IN ({marks}) AND ({changed})",
+                (*values, *chunk, *values)).rowcount
+    return summary
+
+def _bulk_merge(conn, request: BulkReviewRequest) -> dict:
+    target_id = request.target_person_id
+    if not conn.execute("SELECT 1 FROM persons WHERE person_id = ?", (target_id,)).fetchone():
+        raise HTTPException(404, "Target person not found")
     
-    # Base query for raw details
-    query = """
-        SELECT o.occurrence_id, o.video_path, o.timestamp_seconds, o.method_used, o.confidence, o.details, o.review_status,
-               p.person_id, p.name, p.title, p.organization, p.role
-        FROM occurrences o
-        LEFT JOIN persons p ON o.person_id = p.person_id
+    # Individual occurrences are re-assigned; listed persons are merged wholesale
+    relabelled = 0
+    for chunk in _chunks(request.occurrence_ids):
+        marks = ",".join("?" * len(chunk))
+        relabelled += conn.execute(
+            f"UPDATE occurrences SET person_id = ? WHERE occurrence_id IN ({marks}) AND person_id != ?",
+            (target_id, *chunk, target_id)).rowcount
+    moved = _merge_persons(conn, request.person_ids, target_id)
+    return {
+        "persons_merged": moved["persons"],
+        "occurrences_moved": moved["occurrences"] + relabelled,
+        "identifiers_moved": moved["identifiers"]
+    }
+
+def _apply_bulk_review(request: BulkReviewRequest) -> dict:
+    conn = get_db_connection()
+    try:
+        # Take the write lock up front; WAL keeps readers unblocked meanwhile
+        conn.execute("BEGIN IMMEDIATE")
+        if request.action in BULK_ACTION_STATUS:
+            summary = _bulk_set_status(conn, request, BULK_ACTION_STATUS[request.action])
+        elif request.action == "relabel":
+            summary = _bulk_relabel(conn, request)
+        else:
+            summary = _bulk_merge(conn, request)
+        
+        if any(summary.values()):
+            bump_data_version(conn)
+        conn.commit()
+        return summary
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@app.post("/v1/review/bulk")
+async def bulk_review(request: BulkReviewRequest):
+    """
+    Applies one review action to many occurrences and/or persons in a single transaction.
+    Actions: approve, reject, reset (back to pending), relabel (name/title/organization/role),
+    merge (into target_person_id). Approving or rejecting by person_ids leaves already
+    reviewed occurrences alone unless include_reviewed is set.
+    Every action is idempotent: repeating a call changes nothing and reports zero counts.
     """
+    if request.action not in (*BULK_ACTION_STATUS, "relabel", "merge"):
+        raise HTTPException(400, "Invalid action")
+    if not request.occurrence_ids and not request.person_ids:
+        raise HTTPException(400, "No occurrence_ids or person_ids given")
+    if request.action == "merge" and request.target_person_id is None:
+        raise HTTPException(400, "merge requires target_person_id")
+    
+    summary = await run_in_threadpool(_apply_bulk_review, request)
+    return {"status": "updated", "action": request.action, **summary}
+
+def _encode_cursor(key: list) -> str:
+    """Encodes a keyset position as an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def _decode_cursor(cursor: str, size: int) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise HTTPException(400, "Invalid cursor")
+    return key
+
+def _review_filters(status: Optional[str], job_id: Optional[str]):
     conditions = []
     params = []
     
@@ -268,199 +646,674 @@ async def get_review_queue(job_id: Optional[str] = None, status: Optional[str] =
     if job_id:
         conditions.append("o.job_id = ?") 
         params.append(job_id)
+    
+    return conditions, params
 
+@app.get("/v1/review/queue")
+async def get_review_queue(
+    job_id: Optional[str] = None,
+    status: Optional[str] = 'pending',
+    limit: int = Query(50, ge=1, le=500),
+    grouped: bool = False,
+    cursor: Optional[str] = None
+):
+    """
+    Review queue, paged with keyset cursors.
+    Flat: list of occurrences ordered by (video, timestamp); the next page's cursor
+    is returned in the X-Next-Cursor header.
+    Grouped: one entry per person with SQL-side occurrence counts, plus 'next_cursor'.
+    A person's occurrences are loaded from /v1/review/queue/persons/{person_id}/occurrences.
+    """
+    if grouped:
+        return _get_review_queue_grouped(job_id, status, limit, cursor)
+    
+    conditions, params = _review_filters(status, job_id)
+    if cursor:
+        conditions.append("(o.video_path, o.timestamp_seconds, o.occurrence_id) > (?, ?, ?)")
+        params.extend(_decode_cursor(cursor, 3))
+    
+    query = """
+        SELECT o.occurrence_id, o.video_path, o.timestamp_seconds, o.method_used, o.confidence, o.details, o.review_status,
+               p.person_id, p.name, p.title, p.organization, p.role
+        FROM occurrences o
+        LEFT JOIN persons p ON o.person_id = p.person_id
+    """
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
-        
-    query += " ORDER BY o.timestamp_seconds ASC LIMIT ?"
-    params.append(limit)
     
+    # Fetch one extra row to know whether another page exists
+    query += " ORDER BY o.video_path, o.timestamp_seconds, o.occurrence_id LIMIT ?"
+    params.append(limit + 1)
+    
+    conn = get_db_connection()
     rows = conn.execute(query, tuple(params)).fetchall()
     conn.close()
     
-    results = [dict(row) for row in rows]
+    results = [dict(row) for row in rows[:limit]]
+    headers = {}
+    if len(rows) > limit:
+        last = results[-1]
+        headers["X-Next-Cursor"] = _encode_cursor([last['video_path'], last['timestamp_seconds'], last['occurrence_id']])
     
-    if not grouped:
-        return results
+    return JSONResponse(content=results, headers=headers)
 
-    # Grouping Logic for Person-Centric View
-    # Structure: { "hosts": [person...], "guests": [person...] }
-    grouped_data = {"hosts": [], "guests": []}
-    seen_persons = {}
-
-    for row in results:
-        pid = row['person_id']
-        
-        # Handle unlinked occurrences (create synthetic person)
-        if not pid:
-            pid = f"unlinked_{row['occurrence_id']}"
-            is_unlinked = True
+def _get_review_queue_grouped(job_id, status, limit, cursor):
+    """Person-centric view: one row per person, grouped and counted in SQL."""
+    conditions, params = _review_filters(status, job_id)
+    if cursor:
+        conditions.append("o.person_id > ?")
+        params.extend(_decode_cursor(cursor, 1))
+    
+    query = """
+        SELECT o.person_id, p.person_id AS linked_person_id, p.name, p.title, p.organization, p.role,
+               MIN(o.video_path) AS video_path,
+               MIN(o.timestamp_seconds) AS first_appearance,
+               COUNT(*) AS occurrence_count,
+               MAX(CASE WHEN o.method_used = 'ocr' THEN o.details END) AS ocr_text
+        FROM occurrences o
+        LEFT JOIN persons p ON o.person_id = p.person_id
+    """
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    
+    query += " GROUP BY o.person_id ORDER BY o.person_id LIMIT ?"
+    params.append(limit + 1)
+    
+    conn = get_db_connection()
+    rows = conn.execute(query, tuple(params)).fetchall()
+    conn.close()
+    
+    # Structure: { "hosts": [person...], "guests": [person...], "next_cursor": str|None }
+    grouped_data = {"hosts": [], "guests": [], "next_cursor": None}
+    
+    for row in rows[:limit]:
+        # Occurrences whose person row is gone (e.g. after a merge) are shown as unlinked guests
+        is_unlinked = row['linked_person_id'] is None
+        person_obj = {
+            "person_id": row['person_id'],
+            "name": row['name'] or row['ocr_text'] or "Unknown",
+            "title": row['title'],
+            "organization": row['organization'],
+            "role": row['role'] if (not is_unlinked and row['role']) else 'guest',
+            "video_path": row['video_path'],
+            "first_appearance": row['first_appearance'],
+            "thumb": None, # Placeholder for headshot path
+            "occurrence_count": row['occurrence_count']
+        }
+        if person_obj['role'] == 'host':
+            grouped_data['hosts'].append(person_obj)
         else:
-            is_unlinked = False
-        
-        if pid not in seen_persons:
-            # Initialize Person Object
-            person_obj = {
-                "person_id": pid,
-                "name": row['name'] or (row['details'] if row['method_used'] == 'ocr' else "Unknown"),
-                "title": row['title'] if not is_unlinked else None,
-                "organization": row['organization'] if not is_unlinked else None,
-                "role": row['role'] if (not is_unlinked and row['role']) else 'guest',
-                "video_path": row['video_path'],
-                "first_appearance": row['timestamp_seconds'],
-                "thumb": None, # Placeholder for headshot path
-                "occurrences": []
-            }
-            seen_persons[pid] = person_obj
-            
-            # Add to appropriate list
-            if person_obj['role'] == 'host':
-                grouped_data['hosts'].append(person_obj)
-            else:
-                grouped_data['guests'].append(person_obj)
-        
-        # Add occurrence to person
-        seen_persons[pid]['occurrences'].append({
-            "id": row['occurrence_id'],
-            "ts": row['timestamp_seconds'],
-            "conf": row['confidence']
-        })
-        
+            grouped_data['guests'].append(person_obj)
+    
+    if len(rows) > limit:
+        grouped_data['next_cursor'] = _encode_cursor([rows[limit - 1]['person_id']])
+    
     return grouped_data
 
-async def _run_modular_analysis(file: UploadFile, task_type: str):
-    """Helper for modular analysis endpoints."""
+@app.get("/v1/review/queue/persons/{person_id}/occurrences")
+async def get_review_person_occurrences(
+    person_id: int,
+    job_id: Optional[str] = None,
+    status: Optional[str] = 'pending',
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
+    """Lazily loads one person's queued occurrences, ordered by timestamp."""
+    conditions, params = _review_filters(status, job_id)
+    conditions.insert(0, "o.person_id = ?")
+    params.insert(0, person_id)
+    if cursor:
+        conditions.append("(o.timestamp_seconds, o.occurrence_id) > (?, ?)")
+        params.extend(_decode_cursor(cursor, 2))
+    
+    query = f"""
+        SELECT o.occurrence_id, o.video_path, o.timestamp_seconds, o.method_used, o.confidence
+        FROM occurrences o
+        WHERE {" AND ".join(conditions)}
+        ORDER BY o.timestamp_seconds, o.occurrence_id
+        LIMIT ?
+    """
+    params.append(limit + 1)
+    
+    conn = get_db_connection()
+    rows = conn.execute(query, tuple(params)).fetchall()
+    conn.close()
+    
+    occurrences = [{
+        "id": row['occurrence_id'],
+        "ts": row['timestamp_seconds'],
+        "conf": row['confidence'],
+        "method": row['method_used'],
+        "video_path": row['video_path']
+    } for row in rows[:limit]]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_cursor([occurrences[-1]['ts'], occurrences[-1]['id']])
+    
+    return {"person_id": person_id, "occurrences": occurrences, "next_cursor": next_cursor}
+
+async def _run_modular_analysis(file: UploadFile, task_type: str, quick: bool = False):
+    """
+    Helper for modular analysis endpoints. quick=true answers in seconds from the
+    start of the video (see ephemeral.py); "complete" is false if it ran out of time.
+    """
     temp_id = str(uuid.uuid4())
     temp_path = os.path.join(UPLOAD_FOLDER, f"temp_{task_type}_{temp_id}_{file.filename}")
     
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        upload = await save_upload(file, temp_path, accept=("video", "audio"))
             
         print(f"Running modular {task_type} for {temp_path}")
-        results = None
-        
-        if task_type == "ocr":
-            results = _run_ocr(temp_path)
-        elif task_type == "face":
-            # For modular API, we probably want to return serializable data, not numpy arrays
-            # This requires converting the internal _run_facial_recognition output
-            raw_results = _run_facial_recognition(temp_path)
-            # Serialize for API response
-            results = {k: [
-                {"location": item["location"], "encoding_preview": item["encoding"][:5].tolist()} 
-                for item in v
-            ] for k, v in raw_results.items()} 
-        elif task_type == "audio":
-            # Extract audio first? _run_speaker_diarization expects audio path
-            # For simplicity in this artifact, we assume _run_speaker handles wav extraction or we do it here
-            audio_path = temp_path + ".wav"
-            subprocess.run(['ffmpeg', '-i', temp_path, '-vn', '-ar', '16000', '-ac', '1', '-y', audio_path], capture_output=True)
-            results = _run_speaker_diarization(audio_path)
-            if os.path.exists(audio_path): os.remove(audio_path)
-            
-        return {"task": task_type, "results": results}
+        analysis = await run_analysis(task_type, temp_path, upload['sha256'], quick)
+        return {"task": task_type, "quick": quick, **analysis}
 
+    except HTTPException:
+        raise
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
-@app.post("/v1/process/batch")
-async def process_video_batch(
-    videos: List[UploadFile] = File(...),
-    config: Optional[str] = Form(None)
-):
+@app.post("/v1/process/batch", openapi_extra=_multipart_body("videos", multiple=True))
+async def process_video_batch(request: Request):
     """
-    [NEW] Ingest multiple videos at once.
-    Returns a list of job IDs.
+    Ingest multiple videos at once as one batch (multipart form: 'videos' files, optional 'config').
+    Either every video is queued or none is; follow progress at /v1/batches/{batch_id}.
     """
-    responses = []
-    
-    for video in videos:
+    job_ids = {} # video_path -> job_id
+    def dest_for(filename: str) -> str:
         job_id = str(uuid.uuid4())
-        video_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{video.filename}")
-        
-        with open(video_path, "wb") as buffer:
-            shutil.copyfileobj(video.file, buffer)
-            
+        video_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{filename}")
+        job_ids[video_path] = job_id
+        return video_path
+
+    with tracing.span("receive upload") as attributes:
+        fields, files = await receive_multipart(request, "videos", dest_for)
+        attributes["viml.files"] = len(files)
+        attributes["viml.bytes"] = sum(f['size'] for f in files)
+    if not files:
+        raise HTTPException(status_code=422, detail="Missing 'videos' files")
+    config = fields.get("config")
+    await _admit_received(config, files)
+
+    entries = [(job_ids[upload['path']], upload['path'], upload['filename'], upload) for upload in files]
+    return JSONResponse(status_code=202, content=_create_batch(entries, config))
+
+class RegisterBatchRequest(BaseModel):
+    paths: List[str]
+    config: Optional[str] = None
+
+@app.post("/v1/process/register/batch")
+async def register_video_batch(request: RegisterBatchRequest):
+    """
+    Batch form of /v1/process/register, for archive backfills: thousands of files
+    on shared storage become one batch without a byte being uploaded.
+    """
+    await _admit(request.config, len(request.paths))
+    # Validate everything before touching uploads/, so a bad path rejects the whole batch
+    sources = [resolve_ingest_path(path) for path in request.paths]
+    if not sources:
+        raise HTTPException(status_code=422, detail="paths must not be empty")
+
+    def link_all():
+        entries = []
+        try:
+            for source in sources:
+                job_id = str(uuid.uuid4())
+                filename = os.path.basename(source)
+                video_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{filename}")
+                link_into(source, video_path)
+                entries.append((job_id, video_path, filename, {"size": os.path.getsize(source), "sha256": None}))
+        except BaseException:
+            for _, video_path, _, _ in entries:
+                os.remove(video_path)
+            raise
+        return entries
+
+    entries = await run_in_threadpool(link_all)
+    return JSONResponse(status_code=202, content=_create_batch(entries, request.config))
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch_status(batch_id: str, include_jobs: bool = True, status: Optional[str] = None):
+    """
+    Aggregated batch progress plus per-job status and timing.
+    wait_seconds is queue time (created -> started), run_seconds is processing time.
+    """
+    conn = get_db_connection()
+    try:
+        response = batch_summary(conn, batch_id)
+        if not response:
+            raise HTTPException(status_code=404, detail="Batch not found")
+
+        if include_jobs:
+            query = """
+                SELECT job_id, filename, status, result, created_at, started_at, finished_at,
+                       stage, progress, eta_seconds,
+                       (julianday(started_at) - julianday(created_at)) * 86400 AS wait_seconds,
+                       (julianday(finished_at) - julianday(started_at)) * 86400 AS run_seconds
+                FROM jobs WHERE batch_id = ?
+            """
+            params = [batch_id]
+            if status:
+                query += " AND status = ?"
+                params.append(status)
+            response["jobs"] = [dict(row) for row in conn.execute(query + " ORDER BY rowid", params)]
+    finally:
+        conn.close()
+    return response
+
+@app.get("/v1/batches/{batch_id}/events")
+async def stream_batch_events(batch_id: str):
+    """Server-Sent Events: the batch summary, pushed on change until every job has finished."""
+    if not await run_in_threadpool(current_state, "batch", batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return _event_stream_response("batch", batch_id)
+
+# --- Live streams ---
+# A live stream runs as one long Celery task on the "live" queue (see live.py);
+# its cues are pushed to subscribers as they are detected.
+
+class LiveStreamRequest(BaseModel):
+    url: str # HLS playlist, udp://, srt://, rtmp://, ...
+    config: Optional[str] = None # same JSON string as /v1/process (auto_approve, priority)
+
+@app.post("/v1/live", status_code=202)
+async def start_live_stream(request: LiveStreamRequest):
+    """Starts ingesting a live stream; follow its VIML cues at events_url."""
+    try:
+        stream_id = await run_in_threadpool(create_stream, request.url, request.config)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # Live news defaults to the high lane, so VIML_WORKER_LANES=high workers serve it
+    priority = normalize_priority(_config_value(request.config, "priority", "high"))
+    live_stream_task.apply_async(args=[stream_id], queue=lane_queue(LIVE_QUEUE, priority))
+    return {
+        "stream_id": stream_id,
+        "status": "starting",
+        "status_url": f"/v1/live/{stream_id}",
+        "events_url": f"/v1/live/{stream_id}/events",
+        # Everything detected so far, as a regular VIML file
+        "viml_url": f"/v1/videos/{live_video_path(stream_id)}/viml"
+    }
+
+@app.get("/v1/live/{stream_id}")
+async def get_live_stream(stream_id: str):
+    """Stream status, position, processing latency, skipped frames and the latest cues."""
+    state = await run_in_threadpool(current_state, "live", stream_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Live stream not found")
+    return state
+
+@app.delete("/v1/live/{stream_id}", status_code=202)
+async def stop_live_stream(stream_id: str):
+    """Stops a live stream; its open face spans are closed and it ends as 'stopped'."""
+    if not await run_in_threadpool(stop_stream, stream_id):
+        state = await run_in_threadpool(current_state, "live", stream_id)
+        if not state:
+            raise HTTPException(status_code=404, detail="Live stream not found")
+        raise HTTPException(status_code=409, detail=f"Live stream is already {state['status']}")
+    return {"stream_id": stream_id, "status": "stopping"}
+
+@app.get("/v1/live/{stream_id}/events")
+async def stream_live_events(stream_id: str):
+    """Server-Sent Events: "live" status updates and a "cue" event for each new or extended VIML cue."""
+    if not await run_in_threadpool(current_state, "live", stream_id):
+        raise HTTPException(status_code=404, detail="Live stream not found")
+    return _event_stream_response("live", stream_id)
+
+# --- Resumable uploads ---
+# POST /v1/uploads                      -> open a session for a file of known size
+# PUT  /v1/uploads/{id}?offset=N        -> write one chunk (raw body) at byte offset N
+# GET  /v1/uploads/{id}                 -> received / missing byte ranges, for resuming
+# POST /v1/uploads/{id}/finalize        -> verify size + SHA-256 and queue the job
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None # hex digest of the whole file, checked on finalize
+    config: Optional[str] = None # same JSON string as /v1/process
+
+def _partial_upload_path(upload_id: str) -> str:
+    return os.path.join(PARTIAL_UPLOAD_FOLDER, upload_id)
+
+def _get_upload_session(conn, upload_id: str) -> dict:
+    row = conn.execute("SELECT * FROM upload_sessions WHERE upload_id = ?", (upload_id,)).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return dict(row)
+
+def _upload_session_status(conn, session: dict) -> dict:
+    chunks = conn.execute(
+        "SELECT chunk_offset, length FROM upload_chunks WHERE upload_id = ? ORDER BY chunk_offset",
+        (session['upload_id'],)
+    ).fetchall()
+    received = merge_ranges((row['chunk_offset'], row['length']) for row in chunks)
+    return {
+        "upload_id": session['upload_id'],
+        "filename": session['filename'],
+        "size": session['size'],
+        "status": session['status'],
+        "job_id": session['job_id'],
+        "chunk_size": SESSION_CHUNK_SIZE,
+        "received_bytes": sum(end - start for start, end in received),
+        "received": received,
+        "missing": missing_ranges(received, session['size']),
+        "upload_url": f"/v1/uploads/{session['upload_id']}"
+    }
+
+def _prune_upload_sessions(conn):
+    """Drops unfinished sessions nobody has written to or finalized within SESSION_TTL_SECONDS."""
+    stale = [row['upload_id'] for row in conn.execute(
+        "SELECT upload_id FROM upload_sessions WHERE status != 'finalized' AND updated_at < datetime('now', ?)",
+        (f"-{SESSION_TTL_SECONDS} seconds",)
+    )]
+    for upload_id in stale:
+        conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+        conn.execute("DELETE FROM upload_sessions WHERE upload_id = ?", (upload_id,))
+        if os.path.exists(_partial_upload_path(upload_id)):
+            os.remove(_partial_upload_path(upload_id))
+
+@app.post("/v1/uploads")
+async def create_upload_session(request: UploadSessionRequest):
+    """
+    Opens a resumable upload. The response carries the upload URL and a suggested
+    chunk size; chunks may be sent in any order and re-sent after a failure.
+    """
+    if request.size <= 0:
+        raise HTTPException(status_code=422, detail="size must be positive")
+    if MAX_UPLOAD_BYTES and request.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    # Admitted once here, with its full size; chunks and finalize are not refused later
+    await _admit(request.config, 1, request.size)
+
+    upload_id = str(uuid.uuid4())
+    filename = os.path.basename(request.filename)
+    await run_in_threadpool(preallocate, _partial_upload_path(upload_id), request.size)
+
+    conn = get_db_connection()
+    _prune_upload_sessions(conn)
+    conn.execute(
+        "INSERT INTO upload_sessions (upload_id, filename, size, sha256, config) VALUES (?, ?, ?, ?, ?)",
+        (upload_id, filename, request.size, request.sha256.lower() if request.sha256 else None, request.config)
+    )
+    conn.commit()
+    status = _upload_session_status(conn, _get_upload_session(conn, upload_id))
+    conn.close()
+    return JSONResponse(status_code=201, content=status)
+
+@app.get("/v1/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    conn = get_db_connection()
+    try:
+        return _upload_session_status(conn, _get_upload_session(conn, upload_id))
+    finally:
+        conn.close()
+
+@app.put("/v1/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """
+    Writes the raw request body at the given byte offset.
+    An optional X-Chunk-SHA256 header is checked before the chunk is written or
+    recorded, so a corrupted chunk is simply reported missing and re-sent, and
+    never overwrites a good copy received earlier.
+    """
+    conn = get_db_connection()
+    session = _get_upload_session(conn, upload_id)
+    conn.close()
+    if session['status'] != 'open':
+        raise HTTPException(status_code=409, detail=f"Upload session is {session['status']}")
+    if offset >= session['size']:
+        raise HTTPException(status_code=416, detail="Offset is past the end of the upload")
+
+    chunk = await write_chunk(request.stream(), _partial_upload_path(upload_id), offset, session['size'] - offset,
+                              request.headers.get("x-chunk-sha256"))
+
+    conn = get_db_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO upload_chunks (upload_id, chunk_offset, length) VALUES (?, ?, ?)",
+        (upload_id, offset, chunk['length'])
+    )
+    conn.execute("UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE upload_id = ?", (upload_id,))
+    conn.commit()
+    conn.close()
+    return {"upload_id": upload_id, "offset": offset, "length": chunk['length'], "sha256": chunk['sha256']}
+
+@app.post("/v1/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """
+    Verifies the assembled file and queues it exactly like /v1/process.
+    Safe to retry: a finalized session returns its existing job.
+    """
+    conn = get_db_connection()
+    try:
+        session = _get_upload_session(conn, upload_id)
+        if session['status'] == 'finalized':
+            return JSONResponse(status_code=202, content={
+                "job_id": session['job_id'], "status": "queued", "status_url": f"/v1/jobs/{session['job_id']}",
+                "sha256": session['sha256'], "size": session['size']
+            })
+
+        status = _upload_session_status(conn, session)
+        if status['missing']:
+            raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "missing": status['missing']})
+
+        # Claim the session so concurrent finalize calls don't queue it twice. A claim
+        # whose finalize never finished (the API was restarted mid-way) expires.
+        claimed = conn.execute(
+            "UPDATE upload_sessions SET status = 'finalizing', updated_at = CURRENT_TIMESTAMP "
+            "WHERE upload_id = ? AND (status = 'open' OR (status = 'finalizing' AND updated_at < datetime('now', ?)))",
+            (upload_id, f"-{SESSION_FINALIZE_TIMEOUT_SECONDS} seconds")
+        ).rowcount
+        conn.commit()
+        if not claimed:
+            raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    finally:
+        conn.close()
+
+    partial_path = _partial_upload_path(upload_id)
+    try:
+        digest = await run_in_threadpool(hash_file, partial_path)
+        if session['sha256'] and digest != session['sha256']:
+            # Some chunk arrived corrupted and we can't tell which: start the byte ranges over
+            conn = get_db_connection()
+            conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+            conn.commit()
+            conn.close()
+            raise HTTPException(status_code=422, detail="SHA-256 mismatch; upload must be re-sent")
+        if VALIDATE_MEDIA and sniff_media_kind(await run_in_threadpool(read_head, partial_path)) != "video":
+            raise HTTPException(status_code=415, detail="Unsupported media type; expected video")
+
+        job_id = str(uuid.uuid4())
+        video_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{session['filename']}")
+        os.replace(partial_path, video_path)
+    except BaseException:
         conn = get_db_connection()
-        conn.execute("INSERT INTO jobs (job_id, status) VALUES (?, ?)", (job_id, "queued"))
+        conn.execute("UPDATE upload_sessions SET status = 'open' WHERE upload_id = ?", (upload_id,))
         conn.commit()
         conn.close()
-        
-        process_video_task.apply_async(args=[video_path, job_id])
-        
-        responses.append({
-            "filename": video.filename,
-            "job_id": job_id,
-            "status": "queued",
-            "status_url": f"/v1/jobs/{job_id}"
-        })
-        
-    return JSONResponse(status_code=202, content={"batch_results": responses})
+        raise
+
+    try:
+        content = _create_job(job_id, video_path, session['config'], {"size": session['size'], "sha256": digest})
+    except BaseException:
+        # e.g. the broker is down: put everything back so finalize can simply be retried
+        os.replace(video_path, partial_path)
+        conn = get_db_connection()
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        conn.execute("UPDATE upload_sessions SET status = 'open' WHERE upload_id = ?", (upload_id,))
+        conn.commit()
+        conn.close()
+        raise
+    conn = get_db_connection()
+    conn.execute("UPDATE upload_sessions SET status = 'finalized', job_id = ?, sha256 = ? WHERE upload_id = ?",
+                 (job_id, digest, upload_id))
+    conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+    conn.commit()
+    conn.close()
+    return JSONResponse(status_code=202, content=content)
 
 @app.post("/v1/extract/{media_type}")
 async def extract_ephemeral(
     media_type: str,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    quick: bool = True
 ):
     """
     [NEW] Ephemeral extraction. Does NOT save to DB.
     Useful for "Wait, what's in this?" checks.
     Supports: 'video', 'audio', 'image' (logic placeholder for now)
+    Quick by default: the start of the file, sampled, faces counted but not encoded;
+    pass quick=false to analyze the whole file.
     """
     temp_id = str(uuid.uuid4())
     temp_path = os.path.join(UPLOAD_FOLDER, f"temp_{temp_id}_{file.filename}")
     
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Run extraction synchronously for the API response (blocking, but okay for this specialized endpoint)
-        # In production this might still offload to a worker and use a websocket or polling
+        upload = await save_upload(file, temp_path, accept=("video", "audio"))
         results = {}
+        complete = True
         
         if media_type == "video":
             print(f"Ephemeral processing for {temp_path}")
-            # Mocking the pipeline for the ephemeral response to ensure speed
-            # Real implementation would call _run_ocr(temp_path), etc.
-            results["ocr"] = _run_ocr(temp_path)
-            # Optimization: Face recognition is slow, maybe skip or sample heavily for ephemeral
-            results["faces_detected_count"] = len(_run_facial_recognition(temp_path)) 
+            # Both must finish before the file is removed, even if one of them fails
+            ocr, faces = await asyncio.gather(
+                run_analysis("ocr", temp_path, upload['sha256'], quick),
+                run_analysis("face_count", temp_path, upload['sha256'], quick),
+                return_exceptions=True
+            )
+            for outcome in (ocr, faces):
+                if isinstance(outcome, BaseException):
+                    raise outcome
+            results["ocr"] = ocr["results"]
+            results.update(faces["results"])
+            complete = ocr["complete"] and faces["complete"]
             
         elif media_type == "audio":
-            # Just extract text/diarization?
-            pass
+            audio = await run_analysis("audio", temp_path, upload['sha256'], quick)
+            results["speakers"] = sorted({label for _, _, label in audio["results"]})
+            complete = audio["complete"]
             
-        return {"media_type": media_type, "raw_metadata": results}
+        return {"media_type": media_type, "quick": quick, "complete": complete, "raw_metadata": results}
 
+    except HTTPException:
+        raise
+    except AnalysisTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics of the API process (and, with PROMETHEUS_MULTIPROC_DIR, of its analysis pool)."""
+    return Response(content=await run_in_threadpool(metrics.render), media_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.get("/v1/jobs/backlog")
+async def get_job_backlog():
+    """
+    Jobs waiting for or held by a worker; ingest clients use it to pace themselves.
+    "lanes" breaks this down per priority, with queue-wait times (created -> started).
+    """
+    conn = get_db_connection()
+    lanes = lane_summary(conn, PRIORITIES)
+    conn.close()
+    return {
+        "queued": sum(lane["queued"] for lane in lanes.values()),
+        "processing": sum(lane["processing"] for lane in lanes.values()),
+        "lanes": lanes
+    }
+
+def _event_stream_response(kind: str, key: str) -> StreamingResponse:
+    return StreamingResponse(
+        event_stream(kind, key),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: stop nginx from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/v1/jobs/events")
+async def stream_active_jobs():
+    """
+    Server-Sent Events: the queued/processing jobs, then every job that changes
+    (including those that finish) as it changes.
+    """
+    return _event_stream_response("jobs", ACTIVE_JOBS)
+
+@app.get("/v1/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events: job status and stage progress, pushed on change until the job finishes."""
+    if not await run_in_threadpool(current_state, "job", job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _event_stream_response("job", job_id)
+
 @app.get("/v1/jobs/{job_id}", response_model=JobStatus)
 async def get_job_status(job_id: str):
+    """
+    Job status with per-stage detail, its trace ID (when tracing is on) and the
+    stages profiled with {"profiling": true}, each with a URL to its collapsed stacks.
+    """
     conn = get_db_connection()
-    job = conn.execute(
-        "SELECT job_id, status, result, created_at FROM jobs WHERE job_id = ?",
-        (job_id,)
-    ).fetchone()
+    job = job_snapshot(conn, job_id)
+    if job:
+        job["stages"] = job_stages(conn, job_id)
+        row = conn.execute("SELECT traceparent FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        job["trace_id"] = tracing.trace_id(row['traceparent'])
     conn.close()
     
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-        
-    return dict(job)
+
+    job["profiles"] = [{"stage": stage, "url": f"/v1/jobs/{job_id}/profiles/{stage}"}
+                       for stage in tracing.list_profiles(job_id)]
+    return job
+
+@app.get("/v1/jobs/{job_id}/profiles/{stage}")
+async def get_job_profile(job_id: str, stage: str):
+    """A stage's sampled stacks in collapsed format (flamegraph.pl, speedscope)."""
+    if stage not in tracing.list_profiles(job_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(tracing.profile_path(job_id, stage), media_type="text/plain",
+                        filename=f"{job_id}.{stage}.folded")
+
+@app.post("/v1/jobs/{job_id}/retry", status_code=202)
+async def retry_job(job_id: str):
+    """
+    Re-runs a failed job. Stages that completed before the failure are not repeated:
+    their checkpointed output is reused and processing resumes at the failed stage.
+    """
+    conn = get_db_connection()
+    try:
+        job = conn.execute("SELECT status, video_path, priority FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job['status'] != 'failed':
+            raise HTTPException(status_code=409, detail=f"Only failed jobs can be retried (job is {job['status']})")
+        if not job['video_path'] or not os.path.exists(job['video_path']):
+            raise HTTPException(status_code=410, detail="Source video is no longer available")
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', result = NULL, finished_at = NULL, "
+            "updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE job_id = ?",
+            (job_id,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    process_video_task.apply_async(args=[job['video_path'], job_id, job['priority']],
+                                   queue=lane_queue("celery", job['priority']))
+    return {"job_id": job_id, "status": "queued", "status_url": f"/v1/jobs/{job_id}"}
 
 @app.get("/v1/jobs", response_model=List[JobStatus])
 async def list_jobs(limit: int = 20):
     conn = get_db_connection()
     jobs = conn.execute(
-        "SELECT job_id, status, result, created_at FROM jobs ORDER BY created_at DESC LIMIT ?",
+        f"SELECT {JOB_FIELDS} FROM jobs ORDER BY created_at DESC LIMIT ?",
         (limit,)
     ).fetchall()
     conn.close()
@@ -513,32 +1366,195 @@ async def search_metadata(
         "results": [dict(row) for row in results]
     }
 
-@app.get("/v1/analytics/stats")
-async def get_stats():
+def _find_video_path(conn, video_filename: str) -> Optional[str]:
+    """
+    Returns the video_path occurrences are stored under.
+    Depending on the entry point that is the bare filename or the upload path.
+    """
+    for candidate in (video_filename, os.path.join(UPLOAD_FOLDER, video_filename)):
+        if conn.execute("SELECT 1 FROM occurrences WHERE video_path = ? LIMIT 1", (candidate,)).fetchone():
+            return candidate
+    return None
+
+@app.get("/v1/videos/{video_filename}/presence")
+async def get_presence(
+    video_filename: str,
+    t0: float = Query(..., ge=0),
+    t1: Optional[float] = None,
+    status: Optional[str] = None
+):
+    """
+    Who is present between t0 and t1 (omit t1 for a single instant).
+    Returns each person with the segments that overlap the window.
+    """
+    t1 = t0 if t1 is None else t1
+    if t1 < t0:
+        raise HTTPException(400, "t1 must not be before t0")
+    
     conn = get_db_connection()
     try:
-        total_videos = conn.execute("SELECT COUNT(DISTINCT video_path) as c FROM occurrences").fetchone()['c']
-        total_people = conn.execute("SELECT COUNT(*) as c FROM persons").fetchone()['c']
-        hosts = conn.execute("SELECT COUNT(*) as c FROM persons WHERE role='host'").fetchone()['c']
-        guests = conn.execute("SELECT count(*) as c FROM persons WHERE role='guest' OR role='Unknown'").fetchone()['c']
-        top_people = conn.execute("""
-            SELECT name, COUNT(*) as appearances 
-            FROM persons p 
-            JOIN occurrences o ON p.person_id = o.person_id 
-            GROUP BY p.person_id 
-            ORDER BY appearances DESC 
-            LIMIT 5
-        """).fetchall()
+        video_path = _find_video_path(conn, video_filename)
+        if not video_path:
+            raise HTTPException(404, "No occurrences for this video")
         
-        return {
-            "total_videos": total_videos,
-            "total_people": total_people,
-            "hosts": hosts,
-            "guests": guests,
-            "top_people": [dict(row) for row in top_people]
-        }
+        # Both paths re-check the exact overlap: R*Tree coordinates are float32
+        conditions = ["o.timestamp_seconds <= ?", "o.end_seconds >= ?"]
+        params = [t1, t0]
+        if status:
+            conditions.append("o.review_status = ?")
+            params.append(status)
+        
+        if has_span_index(conn):
+            video = conn.execute("SELECT video_id FROM videos WHERE video_path = ?", (video_path,)).fetchone()
+            source = """
+                FROM occurrence_spans s
+                JOIN occurrences o ON o.occurrence_id = s.id
+                LEFT JOIN persons p ON o.person_id = p.person_id
+                WHERE s.video_min = ? AND s.start_seconds <= ? AND s.end_seconds >= ?
+            """
+            params = [video['video_id'] if video else -1, t1, t0] + params
+        else:
+            source = """
+                FROM occurrences o
+                LEFT JOIN persons p ON o.person_id = p.person_id
+                WHERE o.video_path = ?
+            """
+            params = [video_path] + params
+        
+        rows = conn.execute(f"""
+            SELECT o.occurrence_id, o.person_id, p.name, p.role, o.method_used, o.confidence,
+                   o.timestamp_seconds, o.end_seconds
+            {source} AND {" AND ".join(conditions)}
+            ORDER BY o.timestamp_seconds
+        """, tuple(params)).fetchall()
+    finally:
+        conn.close()
+    
+    persons = {}
+    for row in rows:
+        person = persons.setdefault(row['person_id'], {
+            "person_id": row['person_id'],
+            "name": row['name'],
+            "role": row['role'],
+            "segments": []
+        })
+        person['segments'].append({
+            "occurrence_id": row['occurrence_id'],
+            "start": row['timestamp_seconds'],
+            "end": row['end_seconds'],
+            "method": row['method_used'],
+            "confidence": row['confidence']
+        })
+    
+    return {"video_path": video_path, "t0": t0, "t1": t1, "persons": list(persons.values())}
+
+@app.get("/v1/persons/{person_id}/segments")
+async def get_person_segments(
+    person_id: int,
+    video_filename: Optional[str] = None,
+    status: Optional[str] = None
+):
+    """All segments for a person, ordered by video and start time."""
+    conn = get_db_connection()
+    try:
+        conditions = ["person_id = ?", "end_seconds IS NOT NULL"]
+        params = [person_id]
+        if video_filename:
+            video_path = _find_video_path(conn, video_filename)
+            if not video_path:
+                raise HTTPException(404, "No occurrences for this video")
+            conditions.append("video_path = ?")
+            params.append(video_path)
+        if status:
+            conditions.append("review_status = ?")
+            params.append(status)
+        
+        rows = conn.execute(f"""
+            SELECT occurrence_id, video_path, timestamp_seconds, end_seconds, method_used, confidence
+            FROM occurrences
+            WHERE {" AND ".join(conditions)}
+            ORDER BY video_path, timestamp_seconds
+        """, tuple(params)).fetchall()
+    finally:
+        conn.close()
+    
+    return {
+        "person_id": person_id,
+        "segments": [{
+            "occurrence_id": row['occurrence_id'],
+            "video_path": row['video_path'],
+            "start": row['timestamp_seconds'],
+            "end": row['end_seconds'],
+            "method": row['method_used'],
+            "confidence": row['confidence']
+        } for row in rows]
+    }
+
+# Aggregates are cached in-process, keyed on the DB data_version. Ingest and
+# review writes bump the version; the TTL covers writes made outside the API.
+STATS_CACHE_TTL = int(os.getenv("VIML_STATS_CACHE_TTL", "300"))
+_stats_cache = {"version": None, "expires_at": 0.0, "payload": None, "etag": None}
+
+def _compute_stats(conn) -> dict:
+    total_videos = conn.execute("SELECT COUNT(DISTINCT video_path) as c FROM occurrences").fetchone()['c']
+    total_people = conn.execute("SELECT COUNT(*) as c FROM persons").fetchone()['c']
+    hosts = conn.execute("SELECT COUNT(*) as c FROM persons WHERE role='host'").fetchone()['c']
+    guests = conn.execute("SELECT count(*) as c FROM persons WHERE role='guest' OR role='Unknown'").fetchone()['c']
+    top_people = conn.execute("""
+        SELECT name, COUNT(*) as appearances 
+        FROM persons p 
+        JOIN occurrences o ON p.person_id = o.person_id 
+        GROUP BY p.person_id 
+        ORDER BY appearances DESC 
+        LIMIT 5
+    """).fetchall()
+    
+    return {
+        "total_videos": total_videos,
+        "total_people": total_people,
+        "hosts": hosts,
+        "guests": guests,
+        "top_people": [dict(row) for row in top_people]
+    }
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header lists the given ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    candidates = [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+    return "*" in candidates or etag in candidates
+
+@app.get("/v1/analytics/stats")
+async def get_stats(request: Request):
+    """
+    Dashboard aggregates.
+    Recomputed only when the data version changes or the TTL expires.
+    Send If-None-Match with the last ETag to get a 304 when nothing changed.
+    """
+    conn = get_db_connection()
+    try:
+        version = get_data_version(conn)
+        cache = _stats_cache
+        if cache["version"] != version or time.monotonic() >= cache["expires_at"]:
+            payload = _compute_stats(conn)
+            digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+            cache.update(
+                version=version,
+                expires_at=time.monotonic() + STATS_CACHE_TTL,
+                payload=payload,
+                etag=f'"{digest[:16]}"'
+            )
+        payload, etag = cache["payload"], cache["etag"]
     finally:
         conn.close()
+    
+    # no-cache: browsers revalidate with If-None-Match on every poll
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
 
 @app.get("/v1/analytics/network")
 async def get_network_graph():
@@ -570,43 +1586,138 @@ async def get_network_graph():
     finally:
         conn.close()
 
+def _viml_source_path(video_filename: str) -> str:
+    """The video_path to generate VIML for; falls back to the filename itself."""
+    conn = get_db_connection()
+    try:
+        return _find_video_path(conn, video_filename) or video_filename
+    finally:
+        conn.close()
+
+def _check_review_status(review_status: Optional[str]):
+    if review_status is not None and review_status not in muxing.REVIEW_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid review_status: {review_status}")
+
+@app.get("/v1/videos/{video_filename}/viml")
+async def get_viml_sidecar(video_filename: str, review_status: Optional[str] = None, compact: bool = False):
+    """
+    Streams the VIML WebVTT sidecar on its own, without muxing.
+    Optional review_status (e.g. 'approved') filters the cues; compact=true merges
+    each person's evidence into spans with multi-person cues.
+    """
+    _check_review_status(review_status)
+    cues = iter_vtt_from_db(_viml_source_path(video_filename), review_status, compact)
+    return StreamingResponse(
+        iter_chunks(cues),
+        media_type="text/vtt",
+        headers={"Content-Disposition": f'inline; filename="{video_filename}.vtt"'}
+    )
+
+@app.get("/v1/videos/{video_filename}/viml/index")
+def get_viml_index(video_filename: str, review_status: Optional[str] = None, compact: bool = True):
+    """
+    Binary timeline index (.vimlidx) for the VIML track, for players that want
+    to seek by person without parsing WebVTT. See viml_index.py for the format.
+    Sync handler: FastAPI runs it in the threadpool, off the event loop.
+    """
+    _check_review_status(review_status)
+    # One pair of sidecar files per review_status / cue mode variant
+    variant = muxing.variant_name(review_status, compact)
+    vtt_path = os.path.join(GENERATED_FOLDER, f"{video_filename}.{variant}.vtt")
+    index_path = write_viml_sidecars(_viml_source_path(video_filename), vtt_path, review_status, compact)
+    return FileResponse(index_path, media_type="application/octet-stream", filename=f"{video_filename}.vimlidx")
+
+def _parse_byte_range(header: str, size: int):
+    """
+    Parses a single 'bytes=' range into inclusive (start, end).
+    Returns None when the header should be ignored (multi-range, other units)
+    and raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+def _iter_file_range(f, start: int, end: int, block_size: int = 64 * 1024):
+    """Yields bytes start..end of an open file, closing it when done."""
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+def _ranged_file_response(request: Request, f, etag: str, media_type: str, filename: str):
+    """
+    Response for an open file, with ETag revalidation and single-range (206) support.
+    Takes ownership of the file, which stays readable even if its cache entry is removed.
+    """
+    size = os.fstat(f.fileno()).st_size
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+    if _etag_matches(request, etag):
+        f.close()
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    range_header = request.headers.get("range")
+    # If-Range: only send a partial body if the client's copy is still current
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = _parse_byte_range(range_header, size)
+        except ValueError:
+            f.close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+    
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    # The background task closes the file if the client goes away before the body is read
+    return StreamingResponse(_iter_file_range(f, start, end), status_code=status_code, media_type=media_type,
+                             headers=headers, background=BackgroundTask(f.close))
+
 @app.get("/v1/videos/{video_filename}/download")
-async def download_video_with_viml(video_filename: str, background_tasks: BackgroundTasks):
+async def download_video_with_viml(video_filename: str, request: Request, review_status: Optional[str] = None,
+                                   compact: bool = False):
+    """
+    Video with the VIML track embedded.
+    Muxed outputs are cached by the video's VIML version; a review edit of this
+    video changes it, so the next download re-muxes. Supports Range and If-None-Match.
+    """
+    _check_review_status(review_status)
     # Security note: In prod, validate video_filename prevents directory traversal
     original_path = os.path.join(UPLOAD_FOLDER, video_filename)
     if not os.path.exists(original_path):
         raise HTTPException(status_code=404, detail="Video file not found")
 
-    # 1. Generate VTT
     try:
-        vtt_content = generate_vtt_from_db(video_filename)
-    except Exception as e:
-        # DB lookup failed or empty?
-        print(f"VIML gen error: {e}")
-        vtt_content = "WEBVTT\n" # Return empty VTT on fail
-        
-    vtt_path = os.path.join(GENERATED_FOLDER, f"{video_filename}.vtt")
-    with open(vtt_path, 'w') as f:
-        f.write(vtt_content)
-
-    # 2. Embed
-    output_path = os.path.join(GENERATED_FOLDER, f"viml_{video_filename}")
-    command = [
-        'ffmpeg', '-i', original_path, '-i', vtt_path,
-        '-c', 'copy', '-c:s', 'mov_text',
-        '-metadata:s:s:0', 'language=eng',
-        '-y', output_path
-    ]
-    subprocess.run(command, capture_output=True)
-
-    # 3. Cleanup after response
-    def cleanup():
-        if os.path.exists(vtt_path): os.remove(vtt_path)
-        if os.path.exists(output_path): os.remove(output_path)
-    
-    background_tasks.add_task(cleanup)
-    
-    return FileResponse(output_path, media_type="video/mp4", filename=f"viml_{video_filename}")
+        output, digest = await muxing.get_muxed_video(
+            video_filename, original_path, _viml_source_path(video_filename), review_status, compact)
+    except (RuntimeError, OSError) as e:
+        raise HTTPException(status_code=500, detail=f"Muxing failed: {e}")
+    
+    return _ranged_file_response(request, output, f'"{digest}"', "video/mp4", f"viml_{video_filename}")
 
 if __name__ == "__main__":
     import uvicorn
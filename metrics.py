@@ -0,0 +1,102 @@
+# metrics.py
+# Prometheus metrics for the pipeline and the API hot paths. The API serves them
+# at /metrics and workers on VIML_METRICS_PORT (see worker.py).
+#
+# Celery's prefork workers and the analysis pool (ephemeral.py) record from several
+# processes: point PROMETHEUS_MULTIPROC_DIR at an empty directory, shared by the
+# processes of one host and cleared on restart, and every process's samples are
+# served together. Without prometheus_client installed every metric is a no-op.
+import os
+import re
+from functools import lru_cache
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, start_http_server
+    from prometheus_client import CONTENT_TYPE_LATEST, multiprocess
+    METRICS_ENABLED = True
+except ImportError:
+    METRICS_ENABLED = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+def _counter(name: str, documentation: str, labels=()):
+    return Counter(name, documentation, labels) if METRICS_ENABLED else _NoopMetric()
+
+def _histogram(name: str, documentation: str, labels=(), buckets=None):
+    if not METRICS_ENABLED:
+        return _NoopMetric()
+    return Histogram(name, documentation, labels, buckets=buckets) if buckets else Histogram(name, documentation, labels)
+
+# --- Pipeline ---
+STAGE_SECONDS = _histogram(
+    "viml_stage_duration_seconds", "Run time of a pipeline stage for one job", ["stage"],
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400))
+FRAMES_DECODED = _counter("viml_frames_decoded_total", "Video frames decoded", ["stage"])
+FRAMES_ANALYSED = _counter("viml_frames_analysed_total", "Decoded frames that were run through detection", ["stage"])
+FACE_ENCODINGS = _counter("viml_face_encodings_total", "Face encodings computed", ["stage"])
+OCR_READINGS = _counter("viml_ocr_readings_total", "Text readings returned by OCR", ["stage"])
+JOB_ROWS_WRITTEN = _histogram(
+    "viml_job_rows_written", "Rows stored by one job's correlate step", ["table"],
+    buckets=(0, 10, 100, 1000, 10000, 100000, 1000000))
+QUEUE_WAIT_SECONDS = _histogram(
+    "viml_queue_wait_seconds", "Time from submission until a job's first stage starts", ["priority"],
+    buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600, 4 * 3600, 12 * 3600, 24 * 3600))
+MODEL_LOAD_SECONDS = _histogram(
+    "viml_model_load_seconds", "Time to import or load a detection model", ["model"],
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120))
+
+# --- Database and API ---
+SQL_SECONDS = _histogram(
+    "viml_sqlite_query_seconds", "Time to execute an SQLite statement (to the first row for SELECTs)",
+    ["statement"], buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+HTTP_SECONDS = _histogram(
+    "viml_http_request_seconds", "API request handling time, to the start of the response",
+    ["method", "route", "status"])
+
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+_DATA_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str) -> str:
+    """
+    A low-cardinality label for an SQL statement: its verb and first table for
+    queries and writes (e.g. "SELECT occurrences"), the verb alone otherwise.
+    """
+    words = sql.split(None, 1)
+    if not words:
+        return "EMPTY"
+    verb = words[0].upper()
+    match = _STATEMENT_TABLE.search(sql) if verb in _DATA_STATEMENTS else None
+    return f"{verb} {match.group(1)}" if match else verb
+
+def observe_query(sql: str, seconds: float):
+    SQL_SECONDS.labels(statement_label(sql)).observe(seconds)
+
+def _registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def render() -> bytes:
+    """The current metrics in the Prometheus text format."""
+    if not METRICS_ENABLED:
+        return b"# prometheus_client is not installed; no metrics are recorded\n"
+    return generate_latest(_registry())
+
+def serve(port: int):
+    """Serves /metrics on the given port from a background thread (for workers)."""
+    if not METRICS_ENABLED:
+        print("prometheus_client is not installed; worker metrics are disabled")
+        return
+    start_http_server(port, registry=_registry())
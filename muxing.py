@@ -0,0 +1,148 @@
+# muxing.py
+# Cached, single-flight muxing of VIML subtitle tracks into videos.
+import asyncio
+import hashlib
+import os
+import subprocess
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional, Tuple
+from database import get_db_connection, get_video_version
+from viml_generator import iter_vtt_from_db
+
+MUX_CACHE_FOLDER = os.path.join("generated", "mux_cache")
+# ffmpeg does the work in a subprocess, so threads are enough to keep it off the event loop
+MUX_WORKERS = int(os.getenv("VIML_MUX_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=MUX_WORKERS, thread_name_prefix="viml-mux")
+_inflight = {} # {cache_path: asyncio.Future} so concurrent requests share one mux
+
+REVIEW_STATUSES = ("pending", "approved", "rejected")
+
+def variant_name(review_status: Optional[str] = None, compact: bool = False) -> str:
+    """Cache variant for a review_status filter / cue mode; raises ValueError for unknown statuses."""
+    if review_status is not None and review_status not in REVIEW_STATUSES:
+        raise ValueError(f"Invalid review_status: {review_status}")
+    return f"{review_status or 'all'}{'-compact' if compact else ''}"
+
+def cache_digest(original_path: str, source_path: str, review_status: Optional[str] = None,
+                 compact: bool = False) -> str:
+    """
+    The cache key of a download: the VIML version of the video (bumped only by
+    writes to its own occurrences and persons), the variant and the original
+    file's size and mtime. Costs one row lookup; the VIML track is only generated
+    on a miss.
+    """
+    conn = get_db_connection()
+    try:
+        version = get_video_version(conn, source_path)
+    finally:
+        conn.close()
+    stat = os.stat(original_path)
+    key = f"{version}:{stat.st_size}:{stat.st_mtime_ns}:{variant_name(review_status, compact)}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def write_vtt(source_path: str, vtt_path: str, review_status: Optional[str] = None, compact: bool = False):
+    """Streams the VIML track to vtt_path."""
+    try:
+        with open(vtt_path, 'w') as f:
+            for cue in iter_vtt_from_db(source_path, review_status, compact):
+                f.write(cue)
+    except Exception as e:
+        # DB lookup failed or empty?
+        print(f"VIML gen error: {e}")
+        with open(vtt_path, 'w') as f:
+            f.write("WEBVTT\n") # Embed an empty track on fail
+
+def cache_path_for(video_filename: str, digest: str, review_status: Optional[str] = None,
+                   compact: bool = False) -> str:
+    # Each review_status filter / cue mode is its own variant, so they don't evict each other
+    return os.path.join(MUX_CACHE_FOLDER, f"{digest}_{variant_name(review_status, compact)}_{video_filename}")
+
+def _parse_cache_entry(entry: str):
+    """Returns (variant, video_filename) for a cache file name, or None for temp files."""
+    parts = entry.split("_", 2)
+    if entry.startswith(".tmp_") or len(parts) != 3:
+        return None
+    return parts[1], parts[2]
+
+def _mux(original_path: str, source_path: str, review_status: Optional[str], compact: bool, output_path: str):
+    """
+    Generates the VIML track and runs ffmpeg into a temp file, then renames it into
+    place, so readers never see partial output.
+    """
+    vtt_path = os.path.join(MUX_CACHE_FOLDER, f".tmp_{uuid.uuid4().hex}.vtt")
+    # Keep the extension so ffmpeg can pick the container
+    temp_path = os.path.join(MUX_CACHE_FOLDER, f".tmp_{uuid.uuid4().hex}_{os.path.basename(output_path)}")
+    command = [
+        'ffmpeg', '-i', original_path, '-i', vtt_path,
+        '-c', 'copy', '-c:s', 'mov_text',
+        '-metadata:s:s:0', 'language=eng',
+        '-y', temp_path
+    ]
+    try:
+        write_vtt(source_path, vtt_path, review_status, compact)
+        proc = subprocess.run(command, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg mux failed: {proc.stderr[-500:]}")
+        os.replace(temp_path, output_path)
+    finally:
+        for path in (temp_path, vtt_path):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    # Entries for older VIML versions of this variant can no longer be hit
+    variant, video_filename = _parse_cache_entry(os.path.basename(output_path))
+    invalidate(video_filename, variant=variant, keep=output_path)
+
+def invalidate(video_filename: str, variant: Optional[str] = None, keep: Optional[str] = None):
+    """
+    Drops cached muxes of a video (optionally one variant only), except the entry at `keep`.
+    Responses already being served are unaffected: they hold the file open.
+    """
+    if not os.path.isdir(MUX_CACHE_FOLDER):
+        return
+    for entry in os.listdir(MUX_CACHE_FOLDER):
+        path = os.path.join(MUX_CACHE_FOLDER, entry)
+        parsed = _parse_cache_entry(entry)
+        if not parsed or path == keep or parsed[1] != video_filename or (variant and parsed[0] != variant):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass # Already gone
+
+async def get_muxed_video(video_filename: str, original_path: str, source_path: str,
+                          review_status: Optional[str] = None, compact: bool = False) -> Tuple[BinaryIO, str]:
+    """
+    Returns (open file, digest) of the video with its VIML track embedded; the
+    caller closes the file. Served from cache while the video's VIML is unchanged; otherwise
+    muxed once in the worker pool, with concurrent requests for the same key
+    awaiting the same mux. Raises ValueError for an unknown review_status.
+    """
+    os.makedirs(MUX_CACHE_FOLDER, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    
+    for attempt in range(2):
+        # Default executor: a cache hit must not wait behind running muxes
+        digest = await loop.run_in_executor(None, cache_digest, original_path, source_path, review_status, compact)
+        output_path = cache_path_for(video_filename, digest, review_status, compact)
+        # Opened rather than checked, so a concurrent invalidate can't remove it before it is served
+        try:
+            return open(output_path, 'rb'), digest
+        except FileNotFoundError:
+            pass
+        
+        future = _inflight.get(output_path)
+        if future is None:
+            future = loop.run_in_executor(_executor, _mux, original_path, source_path, review_status, compact, output_path)
+            _inflight[output_path] = future
+            future.add_done_callback(lambda _: _inflight.pop(output_path, None))
+        # shield: a disconnecting client must not cancel a mux others are waiting on
+        await asyncio.shield(future)
+        try:
+            return open(output_path, 'rb'), digest
+        except FileNotFoundError:
+            # Superseded by a newer version's mux in the meantime; serve that one
+            continue
+    raise RuntimeError("VIML changed while muxing; retry the download")
@@ -5,16 +5,24 @@ import re
 import json
 import pickle
 import shutil
+import time
 import numpy as np
-from database import get_db_connection
+from typing import Optional
+from database import get_db_connection, bump_data_version, POINT_EVENT_SECONDS
+from progress import ProgressReporter
+import metrics
+import proxy
+import tracing
 
 # --- MOCK IMPORTS FOR LITE ENVIRONMENT ---
 try:
+    _import_started = time.monotonic()
     import cv2
     import face_recognition
     import easyocr
     from pyannote.audio import Pipeline
     LITE_MODE = False
+    metrics.MODEL_LOAD_SECONDS.labels("ml_libraries").observe(time.monotonic() - _import_started)
 except ImportError:
     print("⚠️  Running in LITE MODE: Heavy ML libraries not found. Using mocks.")
     LITE_MODE = True
@@ -25,14 +33,25 @@ except ImportError:
 
 # --- CONFIGURATION ---
 OCR_CROP_AREA = "1920:200:0:880" 
+# The frame size OCR_CROP_AREA is given for; it is scaled to the proxy's picture
+OCR_CROP_REFERENCE = (1920, 1080)
+# One recognised line in the ffmpeg ocr filter's log output
+OCR_LINE_PATTERN = re.compile(r"t:\s*([\d.]+)\s*s\s*->\s*text:\s*'(.*?)'")
+# Face samples of the same person closer than this (seconds) are stored as one interval
+FACE_SPAN_MAX_GAP = 2.0
+# Frames per second run through face detection unless the job sets step_options.face.sample_rate
+FACE_SAMPLE_RATE = 1.0
+DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
 
 # Initialize speaker diarization pipeline
 diarization_pipeline = None
 if not LITE_MODE:
     try:
+        _load_started = time.monotonic()
         diarization_pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1",
+            DIARIZATION_MODEL,
             use_auth_token=os.getenv("HUGGING_FACE_TOKEN"))
+        metrics.MODEL_LOAD_SECONDS.labels("pyannote").observe(time.monotonic() - _load_started)
     except Exception as e:
         print(f"Could not load pyannote pipeline: {e}")
 
@@ -75,9 +94,11 @@ def process_video(video_path: str):
         os.remove(audio_path)
     print(f"Processing for {video_path} completed.")
 
-def _run_ocr(video_path: str, crop: dict = None) -> list:
+def _run_ocr(video_path: str, crop: dict = None, sample_rate: float = None) -> list:
     """
-    Run OCR on the video to extract text from the lower third.
+    Run OCR on the video to extract text from the lower third, or from crop
+    ({'x', 'y', 'w', 'h'} in pixels) when given. sample_rate limits OCR to that
+    many frames per second; by default every frame is read.
     Returns: list of (timestamp, text) tuples.
     """
     # Check if ffmpeg exists or in LITE_MODE
@@ -90,17 +111,27 @@ def _run_ocr(video_path: str, crop: dict = None) -> list:
             (45.0, "Guest Speaker")
         ]
 
-    command = ['ffmpeg', '-i', video_path, '-vf', f'crop={OCR_CROP_AREA},ocr', '-f', 'null', '-']
+    crop_area = f"{crop['w']}:{crop['h']}:{crop.get('x', 0)}:{crop.get('y', 0)}" if crop else OCR_CROP_AREA
+    filters = f'crop={crop_area},ocr'
+    if sample_rate:
+        filters = f'fps={sample_rate},{filters}'
+    command = ['ffmpeg', '-i', video_path, '-vf', filters, '-f', 'null', '-']
     try:
         proc = subprocess.run(command, capture_output=True, text=True, check=True)
-        ocr_pattern = re.compile(r"t:\s*([\d.]+)\s*s\s*->\s*text:\s*'(.*?)'")
-        matches = ocr_pattern.findall(proc.stderr)
-        return [(float(ts), text) for ts, text in matches if text.strip()]
+        matches = OCR_LINE_PATTERN.findall(proc.stderr)
+        readings = [(float(ts), text) for ts, text in matches if text.strip()]
+        metrics.OCR_READINGS.labels("ocr").inc(len(readings))
+        return readings
     except Exception as e:
         print(f"Error running ffmpeg: {e}")
         return []
 
-def _run_facial_recognition(video_path: str, crop: dict = None) -> dict:
+def _run_facial_recognition(video_path: str, crop: dict = None, progress: ProgressReporter = None,
+                            sample_rate: float = FACE_SAMPLE_RATE, model: str = "hog") -> dict:
+    """
+    Face locations and encodings of sample_rate frames per second, keyed by timestamp.
+    model is face_recognition's detector: "hog" (CPU) or "cnn" (more accurate, wants a GPU).
+    """
     results = {}
     
     if LITE_MODE or not cv2:
@@ -112,15 +143,20 @@ def _run_facial_recognition(video_path: str, crop: dict = None) -> dict:
 
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_step = max(1, round(fps / sample_rate))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
     frame_count = 0
+    analysed = 0
+    encodings_computed = 0
     
     while cap.isOpened():
         ret, frame = cap.read()
         if not ret:
             break
         
-        if frame_count % int(fps) == 0:
+        if frame_count % frame_step == 0:
             timestamp = frame_count / fps
+            analysed += 1
             
             # Apply Crop if enabled
             img_to_process = frame
@@ -131,8 +167,9 @@ def _run_facial_recognition(video_path: str, crop: dict = None) -> dict:
             rgb_frame = cv2.cvtColor(img_to_process, cv2.COLOR_BGR2RGB)
             
             if face_recognition:
-                face_locations = face_recognition.face_locations(rgb_frame)
+                face_locations = face_recognition.face_locations(rgb_frame, model=model)
                 face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                encodings_computed += len(face_encodings)
                 
                 if face_encodings:
                     results[timestamp] = [{
@@ -141,129 +178,375 @@ def _run_facial_recognition(video_path: str, crop: dict = None) -> dict:
                     } for loc, enc in zip(face_locations, face_encodings)]
         
         frame_count += 1
+        if progress:
+            progress.update(frame_count, total_frames)
         
     cap.release()
+    # Counted once per video; per-frame increments would dominate in multiprocess mode
+    metrics.FRAMES_DECODED.labels("face").inc(frame_count)
+    metrics.FRAMES_ANALYSED.labels("face").inc(analysed)
+    metrics.FACE_ENCODINGS.labels("face").inc(encodings_computed)
     return results
 
-def _run_speaker_diarization(audio_path: str) -> list:
-    if not diarization_pipeline:
+_diarization_pipelines = {DIARIZATION_MODEL: diarization_pipeline}
+
+def _diarization_pipeline(model: str = None):
+    """The pyannote pipeline for model (default DIARIZATION_MODEL), loaded on first use."""
+    model = model or DIARIZATION_MODEL
+    if model not in _diarization_pipelines:
+        pipeline = None
+        if not LITE_MODE:
+            try:
+                load_started = time.monotonic()
+                pipeline = Pipeline.from_pretrained(model, use_auth_token=os.getenv("HUGGING_FACE_TOKEN"))
+                metrics.MODEL_LOAD_SECONDS.labels("pyannote").observe(time.monotonic() - load_started)
+            except Exception as e:
+                print(f"Could not load pyannote pipeline {model}: {e}")
+        _diarization_pipelines[model] = pipeline
+    return _diarization_pipelines[model]
+
+def _run_speaker_diarization(audio_path: str, model: str = None) -> list:
+    pipeline = _diarization_pipeline(model)
+    if not pipeline:
         return []
-    diarization = diarization_pipeline(audio_path)
+    diarization = pipeline(audio_path)
     return [(segment.start, segment.end, label) for segment, _, label in diarization.itertracks(yield_label=True)]
 
-def process_video(video_path: str, job_id: str = None):
+# --- Pipeline stages ---
+# The "proxy" stage first makes the job's analysis proxy (see proxy.py). Detection
+# stages are independent of each other, so the Celery pipeline (tasks.py) then runs
+# them in parallel on their own queues and joins on "correlate". Each stage's
+# output is checkpointed, so a retry or re-run only repeats the stages that failed.
+DETECTION_STAGES = ("ocr", "face", "audio")
+PIPELINE_STAGES = ("proxy",) + DETECTION_STAGES + ("correlate",)
+# Stages of one job may run on different hosts (e.g. face on a GPU host), so in a
+# split deployment this must be on storage every worker shares, like uploads/ and the DB
+CHECKPOINT_FOLDER = os.environ.get("VIML_CHECKPOINT_FOLDER", os.path.join("generated", "checkpoints"))
+
+# config["steps"] may say "diarization" for the audio stage
+STEP_ALIASES = {"diarization": "audio"}
+
+def job_steps(cfg: dict) -> tuple:
     """
-    Main processing pipeline.
-    Run OCR (EasyOCR), Face, Audio analysis and correlate results.
+    The detection stages a job runs, in pipeline order: those named in config["steps"],
+    or all of them when it names none (unknown names are ignored).
     """
-    print(f"Processing {video_path}...")
-    
-    # 1. Fetch Job Config (Auto-Approve status & Crops)
+    steps = cfg.get('steps')
+    if not isinstance(steps, list):
+        return DETECTION_STAGES
+    selected = {STEP_ALIASES.get(step, step) for step in steps if isinstance(step, str)}
+    return tuple(stage for stage in DETECTION_STAGES if stage in selected) or DETECTION_STAGES
+
+def job_pipeline(cfg: dict) -> tuple:
+    """Every stage the job runs, for its progress: the proxy, its steps and correlate."""
+    return ("proxy",) + job_steps(cfg) + ("correlate",)
+
+def step_options(cfg: dict, stage: str) -> dict:
+    """
+    The job's parameters for one stage, from config["step_options"][stage]:
+    "crop" ({'x', 'y', 'w', 'h'} in source pixels; config["crops"][stage] is still read),
+    "sample_rate" (frames per second for ocr and face) and "model" (face: "hog" or
+    "cnn"; audio: a pyannote pipeline name).
+    """
+    options = cfg.get('step_options')
+    options = dict(options.get(stage) or {}) if isinstance(options, dict) else {}
+    options.setdefault('crop', (cfg.get('crops') or {}).get(stage))
+    return options
+
+def load_job_options(job_id: str = None):
+    """(review status for new occurrences, config dict, traceparent) of the job."""
     status_to_set = 'pending'
-    crops = {}
+    cfg = {}
+    parent = None
     
     if job_id:
         try:
             conn = get_db_connection()
-            row = conn.execute("SELECT config, auto_approve FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            row = conn.execute("SELECT config, auto_approve, traceparent FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
             if row:
                 if row['auto_approve']:
                     status_to_set = 'approved'
+                parent = row['traceparent']
                 if row['config']:
                     try:
                         cfg = json.loads(row['config'])
-                        crops = cfg.get('crops', {})
                     except:
                         pass
             conn.close()
         except Exception as e:
             print(f"Failed to fetch job config: {e}")
+    return status_to_set, cfg, parent
 
-    # 2. OCR (EasyOCR with Configurable Crop)
-    ocr_crop = crops.get('ocr') # Expected format: {'x': int, 'y': int, 'w': int, 'h': int}
-    ocr_data = _run_ocr(video_path, crop=ocr_crop)
-    
-    # 3. Facial Recognition (Mock or Real, with Crop)
-    face_crop = crops.get('face')
-    face_data = _run_facial_recognition(video_path, crop=face_crop)
-    
-    # 4. Audio / Speaker Diarization (Mock)
-    speaker_data = _run_speaker_diarization(video_path)
-    
-    # 5. Correlate and Store
-    _correlate_and_store(video_path, ocr_data, face_data, speaker_data, status_to_set, job_id)
-    
+def _checkpoint_path(job_id: str, stage: str) -> str:
+    return os.path.join(CHECKPOINT_FOLDER, job_id, f"{stage}.pkl")
+
+def _save_checkpoint(job_id: str, stage: str, data):
+    path = _checkpoint_path(job_id, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write beside the target and rename, so a crash never leaves a truncated checkpoint
+    with open(f"{path}.tmp", 'wb') as f:
+        pickle.dump(data, f)
+    os.replace(f"{path}.tmp", path)
+
+def _load_checkpoint(job_id: str, stage: str):
+    with open(_checkpoint_path(job_id, stage), 'rb') as f:
+        return pickle.load(f)
+
+def _proxy_folder(job_id: str) -> str:
+    """
+    Proxies are kept per source file (by its SHA-256, else per job), so a job that
+    re-submits or re-registers the same file reuses the proxy made for an earlier one.
+    """
+    key = job_id
+    try:
+        conn = get_db_connection()
+        row = conn.execute("SELECT source_sha256 FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        conn.close()
+        if row and row['source_sha256']:
+            key = row['source_sha256']
+    except Exception as e:
+        print(f"Failed to fetch the source hash: {e}")
+    return os.path.join(proxy.PROXY_FOLDER, key)
+
+def _analysis_proxy(job_id: str = None) -> dict:
+    """
+    The parts of the job's proxy (see proxy.make_proxy) the stages can read: its
+    description, without parts that were never made or have since been pruned.
+    """
+    if not (job_id and os.path.exists(_checkpoint_path(job_id, "proxy"))):
+        return {}
+    description = dict(_load_checkpoint(job_id, "proxy") or {})
+    for part in ("video", "audio"):
+        if description.get(part) and not os.path.exists(description[part]):
+            del description[part]
+    return description
+
+def _proxy_crops(options: dict, stage: str, geometry: Optional[dict]) -> Optional[dict]:
+    """The stage's crop in the coordinates of the video it reads."""
+    crop = options.get('crop')
+    if not geometry:
+        return crop
+    if crop:
+        return proxy.scale_crop(crop, geometry)
+    if stage == "ocr":
+        w, h, x, y = (int(v) for v in OCR_CROP_AREA.split(":"))
+        return proxy.scale_crop({'x': x, 'y': y, 'w': w, 'h': h}, geometry, OCR_CROP_REFERENCE)
+    return None
+
+def clear_checkpoints(job_id: str):
+    shutil.rmtree(os.path.join(CHECKPOINT_FOLDER, job_id), ignore_errors=True)
+
+def run_stage(stage: str, video_path: str, job_id: str = None):
+    """
+    Runs one pipeline stage and checkpoints its output under the job.
+    A stage that already has a checkpoint is not run again; its output is returned.
+    Detection stages read the job's analysis proxy when the proxy stage made one.
+    """
+    if job_id and os.path.exists(_checkpoint_path(job_id, stage)):
+        print(f"[{job_id}] {stage}: using checkpoint")
+        return _load_checkpoint(job_id, stage)
+
+    _, cfg, parent = load_job_options(job_id)
+    options = step_options(cfg, stage)
+    description = _analysis_proxy(job_id) if stage in DETECTION_STAGES else {}
+    # Without a video part (no ffmpeg, or a source without pictures) the original is read as is
+    geometry = description if description.get('video') else None
+    source = geometry['video'] if geometry else video_path
+    crop = _proxy_crops(options, stage, geometry)
+    progress = ProgressReporter(job_id, job_pipeline(cfg))
+    started = time.monotonic()
+    with tracing.span(f"stage {stage}", parent, {"viml.job_id": job_id, "viml.stage": stage}), \
+            tracing.profile(job_id, stage, enabled=bool(cfg.get('profiling'))):
+        try:
+            progress.stage(stage)
+            if stage == "proxy":
+                # Only the parts the job's steps read; kept beyond the job for later re-runs
+                data = proxy.make_proxy(video_path, _proxy_folder(job_id), job_steps(cfg)) if job_id else None
+            elif stage == "ocr":
+                data = _run_ocr(source, crop=crop, sample_rate=options.get('sample_rate'))
+            elif stage == "face":
+                data = _run_facial_recognition(source, crop=crop, progress=progress,
+                                               sample_rate=options.get('sample_rate') or FACE_SAMPLE_RATE,
+                                               model=options.get('model') or "hog")
+            elif stage == "audio":
+                # A proxy whose audio is None means the source is silent
+                audio = description['audio'] if 'audio' in description else video_path
+                data = _run_speaker_diarization(audio, model=options.get('model')) if audio else []
+            else:
+                raise ValueError(f"Unknown stage: {stage}")
+            if job_id:
+                with tracing.span("checkpoint save"):
+                    _save_checkpoint(job_id, stage, data)
+            progress.finish_stage()
+            metrics.STAGE_SECONDS.labels(stage).observe(time.monotonic() - started)
+            return data
+        except Exception:
+            progress.fail_stage()
+            raise
+        finally:
+            progress.close()
+
+def correlate(video_path: str, job_id: str = None, stage_data: dict = None):
+    """
+    Final stage: links the detection stages' output and stores occurrences.
+    Reads the checkpoints of the job's steps unless stage_data ({stage: output}) is
+    given; stages the job skipped count as having found nothing.
+    Re-running it for a job replaces that job's occurrences and identifiers rather
+    than duplicating them.
+    """
+    status_to_set, cfg, parent = load_job_options(job_id)
+    steps = job_steps(cfg) if stage_data is None else tuple(stage for stage in stage_data if stage in DETECTION_STAGES)
+
+    progress = ProgressReporter(job_id, ("proxy",) + steps + ("correlate",))
+    started = time.monotonic()
+    with tracing.span("stage correlate", parent, {"viml.job_id": job_id, "viml.stage": "correlate"}), \
+            tracing.profile(job_id, "correlate", enabled=bool(cfg.get('profiling'))):
+        try:
+            progress.stage("correlate")
+            if stage_data is None:
+                with tracing.span("checkpoint load"):
+                    stage_data = {stage: _load_checkpoint(job_id, stage) for stage in steps}
+            _correlate_and_store(video_path, stage_data.get("ocr", []), stage_data.get("face", {}),
+                                 stage_data.get("audio", []), status_to_set, job_id, progress,
+                                 face_matching="face" in steps)
+            progress.finish_stage()
+            metrics.STAGE_SECONDS.labels("correlate").observe(time.monotonic() - started)
+        except Exception:
+            progress.fail_stage()
+            raise
+        finally:
+            progress.close()
+    if job_id:
+        clear_checkpoints(job_id)
+
+def process_video(video_path: str, job_id: str = None):
+    """
+    Main processing pipeline, run in-process (the Celery pipeline runs the same stages as separate tasks).
+    Run the job's steps (OCR, Face, Audio analysis by default) and correlate results.
+    """
+    print(f"Processing {video_path}...")
+    _, cfg, _ = load_job_options(job_id)
+    stage_data = {stage: run_stage(stage, video_path, job_id) for stage in job_pipeline(cfg)[:-1]}
+    correlate(video_path, job_id, stage_data)
     print(f"Processing complete for {video_path}")
 
-def _correlate_and_store(video_filename, ocr_data, face_data, speaker_data, review_status='pending', job_id=None):
-    """The core logic to link names to faces and voices."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _correlate_and_store(video_filename, ocr_data, face_data, speaker_data, review_status='pending', job_id=None,
+                         progress: ProgressReporter = None, face_matching: bool = True):
+    """
+    The core logic to link names to faces and voices.
+    Names come from OCR. With face_matching a name only counts when a face is on
+    screen with it, and that face is then tracked; without it (a job that skipped
+    the face step) every reading is stored. Without OCR nothing can be named.
+    Matching runs first and only reports progress; the results are then stored in
+    one short write transaction. Progress is written on its own connection, so it
+    must never wait on a write lock held by this one.
+    """
+    # Progress unit: one OCR reading, face sample timestamp or speaker segment
+    total_items = len(ocr_data) + len(face_data) + len(speaker_data)
+    items_done = 0
     
-    known_faces = {} # {person_id: [encodings]}
-    speaker_to_person = {} # {speaker_label: person_id}
+    # Keyed by name until the results are stored and person_ids are known
+    occurrences = [] # (name, start, end, method, confidence, details)
+    identifiers = [] # (name, face encoding)
+    known_faces = {} # {name: [encodings]}
+    speaker_to_person = {} # {speaker_label: name}
 
     # First pass: Use OCR to establish initial identities
     for timestamp, text in ocr_data:
+        items_done += 1
+        if progress:
+            progress.update(items_done, total_items)
         name = text.strip().title() 
         
-        # Find face appearing at the same time
-        closest_face_ts = min(face_data.keys(), key=lambda t: abs(t - timestamp)) if face_data else 0
-        if abs(closest_face_ts - timestamp) < 1.0 and face_data: 
-            faces_at_time = face_data.get(closest_face_ts)
-            if faces_at_time:
-                face_encoding = faces_at_time[0]['encoding']
-                
-                cursor.execute("SELECT person_id FROM persons WHERE video_path = ? AND name = ?", (video_filename, name))
-                person = cursor.fetchone()
-                if not person:
-                    cursor.execute("INSERT INTO persons (video_path, name) VALUES (?, ?)", (video_filename, name))
-                    person_id = cursor.lastrowid
-                else:
-                    person_id = person['person_id']
-
-                cursor.execute(
-                    "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, method_used, confidence, details, review_status, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (video_filename, person_id, timestamp, 'ocr', 95.0, text, review_status, job_id)
-                )
-                
-                cursor.execute(
-                    "INSERT INTO identifiers (person_id, method, biometric_data) VALUES (?, ?, ?)",
-                    (person_id, 'face', pickle.dumps(face_encoding))
-                )
-                
-                if person_id not in known_faces:
-                    known_faces[person_id] = []
-                known_faces[person_id].append(face_encoding)
-                
-                for start, end, label in speaker_data:
-                    if start <= timestamp <= end and label not in speaker_to_person:
-                        speaker_to_person[label] = person_id
-                        break
-    conn.commit()
+        if face_matching:
+            # Find face appearing at the same time
+            closest_face_ts = min(face_data.keys(), key=lambda t: abs(t - timestamp)) if face_data else 0
+            faces_at_time = face_data.get(closest_face_ts) if abs(closest_face_ts - timestamp) < 1.0 else None
+            if not faces_at_time:
+                continue
+            face_encoding = faces_at_time[0]['encoding']
+            identifiers.append((name, face_encoding))
+            known_faces.setdefault(name, []).append(face_encoding)
+        occurrences.append((name, timestamp, timestamp + POINT_EVENT_SECONDS, 'ocr', 95.0, text))
+        
+        for start, end, label in speaker_data:
+            if start <= timestamp <= end and label not in speaker_to_person:
+                speaker_to_person[label] = name
+                break
     
     # Skip second pass in lite mode if face_recognition is missing
     if not LITE_MODE and face_recognition:
-        for timestamp, faces in face_data.items():
-            for face_info in faces:
+        # Consecutive samples of the same person are stored as one interval
+        open_spans = {} # {name: [start, last_seen, location]}
+        
+        def store_face_span(name, span):
+            start, last_seen, location = span
+            occurrences.append((name, start, last_seen + POINT_EVENT_SECONDS, 'face', 90.0, str(location)))
+        
+        for timestamp in sorted(face_data):
+            items_done += 1
+            if progress:
+                progress.update(items_done, total_items)
+            for face_info in face_data[timestamp]:
                 encoding = face_info['encoding']
                 
-                for person_id, encodings in known_faces.items():
+                for name, encodings in known_faces.items():
                     matches = face_recognition.compare_faces(encodings, encoding)
                     if True in matches:
-                        cursor.execute(
-                            "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, method_used, confidence, details, review_status, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                            (video_filename, person_id, timestamp, 'face', 90.0, str(face_info['location']), review_status, job_id)
-                        )
+                        span = open_spans.get(name)
+                        if span and timestamp - span[1] <= FACE_SPAN_MAX_GAP:
+                            span[1] = timestamp
+                        else:
+                            if span:
+                                store_face_span(name, span)
+                            open_spans[name] = [timestamp, timestamp, face_info['location']]
                         break 
-        conn.commit()
+        
+        for name, span in open_spans.items():
+            store_face_span(name, span)
     
     for start, end, label in speaker_data:
         if label in speaker_to_person:
-            person_id = speaker_to_person[label]
-            cursor.execute(
-                "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, method_used, confidence, details, review_status, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (video_filename, person_id, start, 'voice', 85.0, f"Speaks until {end:.2f}s", review_status, job_id)
+            occurrences.append((speaker_to_person[label], start, end, 'voice', 85.0, f"Speaks until {end:.2f}s"))
+
+    with tracing.span("db flush", attributes={"viml.job_id": job_id, "viml.occurrences": len(occurrences),
+                                              "viml.identifiers": len(identifiers)}):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            if job_id:
+                # Replaces whatever an earlier attempt of this job stored, in the same transaction
+                cursor.execute("DELETE FROM occurrences WHERE job_id = ?", (job_id,))
+                cursor.execute("DELETE FROM identifiers WHERE job_id = ?", (job_id,))
+                cursor.execute("""
+                    DELETE FROM persons WHERE video_path = ?
+                      AND NOT EXISTS (SELECT 1 FROM occurrences o WHERE o.person_id = persons.person_id)
+                      AND NOT EXISTS (SELECT 1 FROM identifiers i WHERE i.person_id = persons.person_id)
+                """, (video_filename,))
+            person_ids = {}
+            for name in dict.fromkeys(name for name, *_ in occurrences):
+                cursor.execute("SELECT person_id FROM persons WHERE video_path = ? AND name = ?", (video_filename, name))
+                person = cursor.fetchone()
+                if not person:
+                    cursor.execute("INSERT INTO persons (video_path, name) VALUES (?, ?)", (video_filename, name))
+                    person_ids[name] = cursor.lastrowid
+                else:
+                    person_ids[name] = person['person_id']
+            cursor.executemany(
+                "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, end_seconds, method_used, confidence, details, review_status, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(video_filename, person_ids[name], start, end, method, confidence, details, review_status, job_id)
+                 for name, start, end, method, confidence, details in occurrences]
             )
-    conn.commit()
-    conn.close()
+            cursor.executemany(
+                "INSERT INTO identifiers (person_id, method, biometric_data, job_id) VALUES (?, ?, ?, ?)",
+                [(person_ids[name], 'face', pickle.dumps(encoding), job_id) for name, encoding in identifiers]
+            )
+            bump_data_version(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    metrics.JOB_ROWS_WRITTEN.labels("occurrences").observe(len(occurrences))
+    metrics.JOB_ROWS_WRITTEN.labels("identifiers").observe(len(identifiers))
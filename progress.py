@@ -0,0 +1,200 @@
+# progress.py
+# Per-stage job progress, written from inside the processing stages and read by
+# the API (job status, batch summaries, event streams).
+import time
+from typing import List, Optional
+from database import get_db_connection
+
+# Minimum seconds between progress writes for one job
+PROGRESS_INTERVAL_SECONDS = 1.0
+# Queue-wait statistics cover jobs started within this window
+QUEUE_WAIT_WINDOW_SECONDS = 3600
+
+JOB_FIELDS = "job_id, status, result, priority, created_at, stage, stage_done, stage_total, progress, eta_seconds"
+
+class ProgressReporter:
+    """
+    Records a job's progress per stage in job_stages and rolls it up onto the jobs row:
+    overall progress (stages count equally), the running stage(s) and an ETA
+    extrapolated from the time since the job started. Stages may report from
+    different worker processes at once. Updates inside a stage are throttled to one
+    write per PROGRESS_INTERVAL_SECONDS, so calling update() once per frame costs a
+    clock read. A reporter without a job_id does nothing.
+    """
+
+    def __init__(self, job_id: Optional[str], stages: List[str]):
+        self.job_id = job_id
+        self.stages = stages
+        self.stage_name = None
+        self.done = 0
+        self.total = None
+        self._last_write = 0.0
+        self._conn = get_db_connection() if job_id else None
+
+    def stage(self, name: str, total: Optional[int] = None):
+        """Enters the named stage (completing the previous one); total is its unit count if known."""
+        if self.stage_name and self.stage_name != name:
+            self._write("done")
+        self.stage_name = name
+        self.done = 0
+        self.total = total
+        self._write("running")
+
+    def update(self, done: int, total: Optional[int] = None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if time.monotonic() - self._last_write >= PROGRESS_INTERVAL_SECONDS:
+            self._write("running")
+
+    def finish_stage(self):
+        if self.stage_name:
+            self._write("done")
+
+    def fail_stage(self):
+        if self.stage_name:
+            self._write("failed")
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _write(self, status: str):
+        self._last_write = time.monotonic()
+        if not self._conn:
+            return
+        try:
+            self._conn.execute(
+                """
+                INSERT INTO job_stages (job_id, stage, status, done, total, attempts, started_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, 1, strftime('%Y-%m-%d %H:%M:%f', 'now'), strftime('%Y-%m-%d %H:%M:%f', 'now'))
+                ON CONFLICT(job_id, stage) DO UPDATE SET
+                    attempts = attempts + (excluded.status = 'running' AND status != 'running'),
+                    status = excluded.status, done = excluded.done, total = excluded.total,
+                    updated_at = excluded.updated_at,
+                    finished_at = CASE WHEN excluded.status = 'done' THEN excluded.updated_at END
+                """,
+                (self.job_id, self.stage_name, status, self.done, self.total)
+            )
+            self._conn.execute(
+                """
+                UPDATE jobs SET
+                    stage = COALESCE((SELECT group_concat(stage, ',') FROM job_stages
+                                      WHERE job_id = :job_id AND status = 'running'), :stage),
+                    stage_done = :done, stage_total = :total,
+                    progress = (SELECT SUM(CASE WHEN status = 'done' THEN 1.0
+                                                WHEN total > 0 THEN MIN(done * 1.0 / total, 1.0)
+                                                ELSE 0.0 END)
+                                FROM job_stages WHERE job_id = :job_id) / :stage_count,
+                    progress_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                    updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+                WHERE job_id = :job_id
+                """,
+                {"job_id": self.job_id, "stage": self.stage_name, "done": self.done, "total": self.total,
+                 "stage_count": len(self.stages)}
+            )
+            # Second statement: SET expressions only see the old progress value
+            self._conn.execute(
+                """
+                UPDATE jobs SET eta_seconds = CASE WHEN progress > 0 AND started_at IS NOT NULL
+                    THEN (julianday('now') - julianday(started_at)) * 86400 * (1 - progress) / progress END
+                WHERE job_id = ?
+                """,
+                (self.job_id,)
+            )
+            self._conn.commit()
+        except Exception as e:
+            # Progress is advisory; never fail a job over it. Roll back so a failed
+            # statement doesn't leave this connection holding the write lock.
+            self._conn.rollback()
+            print(f"Failed to record progress for {self.job_id}: {e}")
+
+def job_stages(conn, job_id: str) -> List[dict]:
+    return [dict(row) for row in conn.execute(
+        "SELECT stage, status, done, total, attempts, started_at, finished_at FROM job_stages WHERE job_id = ? ORDER BY started_at",
+        (job_id,)
+    )]
+
+def job_snapshot(conn, job_id: str) -> Optional[dict]:
+    row = conn.execute(f"SELECT {JOB_FIELDS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def batch_summary(conn, batch_id: str) -> Optional[dict]:
+    """
+    Aggregated state of a batch. progress counts finished jobs as whole and
+    running jobs by their own stage progress.
+    """
+    batch = conn.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+    if not batch:
+        return None
+
+    counts = {}
+    running_progress = 0.0
+    for row in conn.execute(
+        "SELECT status, COUNT(*) AS n, SUM(progress) AS progress FROM jobs WHERE batch_id = ? GROUP BY status",
+        (batch_id,)
+    ):
+        counts[row['status']] = row['n']
+        if row['status'] == 'processing':
+            running_progress = row['progress'] or 0.0
+    timing = conn.execute("""
+        SELECT MIN(started_at) AS first_started_at, MAX(finished_at) AS last_finished_at,
+               AVG((julianday(started_at) - julianday(created_at)) * 86400) AS avg_wait_seconds,
+               AVG((julianday(finished_at) - julianday(started_at)) * 86400) AS avg_run_seconds
+        FROM jobs WHERE batch_id = ?
+    """, (batch_id,)).fetchone()
+
+    total = batch['job_count']
+    done = counts.get('completed', 0) + counts.get('failed', 0)
+    if done < total:
+        status = "processing" if done or counts.get('processing') else "queued"
+    else:
+        status = "completed_with_errors" if counts.get('failed') else "completed"
+
+    return {
+        "batch_id": batch_id,
+        "status": status,
+        "created_at": batch['created_at'],
+        "job_count": total,
+        "counts": counts,
+        "progress": (done + running_progress) / total if total else 1.0,
+        "first_started_at": timing['first_started_at'],
+        "finished_at": timing['last_finished_at'] if done == total else None,
+        "avg_wait_seconds": timing['avg_wait_seconds'],
+        "avg_run_seconds": timing['avg_run_seconds']
+    }
+
+def lane_summary(conn, priorities, window_seconds: int = QUEUE_WAIT_WINDOW_SECONDS) -> dict:
+    """
+    Per priority lane: queued and processing counts, the age of the oldest queued
+    job, and queue-wait times of jobs started in the window. A job starts when its
+    first stage runs on a worker, so the wait covers the stage queues too.
+    """
+    def empty_lane():
+        return {"queued": 0, "processing": 0, "oldest_queued_seconds": None,
+                "started_in_window": 0, "avg_wait_seconds": None, "p95_wait_seconds": None}
+    lanes = {priority: empty_lane() for priority in priorities}
+    for row in conn.execute("""
+        SELECT priority, status, COUNT(*) AS n,
+               MAX((julianday('now') - julianday(created_at)) * 86400) AS oldest
+        FROM jobs WHERE status IN ('queued', 'processing') GROUP BY priority, status
+    """):
+        lane = lanes.setdefault(row['priority'], empty_lane())
+        lane[row['status']] = row['n']
+        if row['status'] == 'queued':
+            lane["oldest_queued_seconds"] = row['oldest']
+
+    waits = {}
+    for row in conn.execute("""
+        SELECT priority, (julianday(started_at) - julianday(created_at)) * 86400 AS wait
+        FROM jobs WHERE started_at >= strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+        ORDER BY priority, wait
+    """, (f"-{window_seconds} seconds",)):
+        waits.setdefault(row['priority'], []).append(max(row['wait'], 0.0))
+    for priority, values in waits.items():
+        lane = lanes.setdefault(priority, empty_lane())
+        lane["started_in_window"] = len(values)
+        lane["avg_wait_seconds"] = sum(values) / len(values)
+        lane["p95_wait_seconds"] = values[min(int(len(values) * 0.95), len(values) - 1)]
+    return lanes
@@ -0,0 +1,164 @@
+# proxy.py
+# The analysis proxy: one normalised copy of a source video, made once by the
+# pipeline's first stage. Every detection stage (and every retry or later re-run)
+# decodes the proxy instead of the high-bitrate upload: a fixed frame size, a
+# reduced frame rate and a one-second GOP without B-frames, so seeking and
+# decoding are cheap, plus a 16 kHz mono wav for diarization. The original is
+# only read again by the mux (muxing.py).
+#
+# Proxies are kept in PROXY_FOLDER, one folder per source (see processing.py for
+# the key), independently of a job's checkpoints; a proxy not used for
+# PROXY_RETENTION_DAYS is removed. Each part is made when a job first needs it,
+# so an OCR-only job never extracts audio and an audio-only job never transcodes.
+#
+# The picture is scaled to fit PROXY_SIZE and padded, so crops are mapped into the
+# proxy with its geometry (scale_crop) rather than used as source pixels.
+import json
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from typing import Optional
+
+# Like checkpoints, proxies must be on storage shared by all workers in a split deployment
+PROXY_FOLDER = os.environ.get("VIML_PROXY_FOLDER", os.path.join("generated", "proxies"))
+PROXY_RETENTION_DAYS = float(os.environ.get("VIML_PROXY_RETENTION_DAYS", "7"))
+PROXY_WIDTH, PROXY_HEIGHT = (int(v) for v in os.environ.get("VIML_PROXY_SIZE", "1280x720").split("x"))
+PROXY_FPS = float(os.environ.get("VIML_PROXY_FPS", "10"))
+AUDIO_SAMPLE_RATE = 16000
+
+VIDEO_FILE = "proxy.mp4"
+AUDIO_FILE = "proxy.wav"
+DESCRIPTION_FILE = "proxy.json"
+# Steps that decode pictures; the others only need the audio
+VIDEO_STEPS = ("ocr", "face")
+
+def available() -> bool:
+    return bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))
+
+def source_size(video_path: str) -> Optional[tuple]:
+    """(width, height) of the video's first video stream, or None if it has none."""
+    proc = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                           'stream=width,height', '-of', 'csv=p=0:s=x', video_path],
+                          capture_output=True, text=True, check=True)
+    lines = proc.stdout.strip().splitlines()
+    if not lines:
+        return None
+    width, height = lines[0].split("x")[:2]
+    return int(width), int(height)
+
+def _fit(width: int, height: int) -> dict:
+    # Even dimensions, as yuv420p requires
+    scale = min(PROXY_WIDTH / width, PROXY_HEIGHT / height)
+    picture_width = min(PROXY_WIDTH, round(width * scale / 2) * 2)
+    picture_height = min(PROXY_HEIGHT, round(height * scale / 2) * 2)
+    return {
+        "width": PROXY_WIDTH, "height": PROXY_HEIGHT, "fps": PROXY_FPS,
+        "source_width": width, "source_height": height,
+        "picture_width": picture_width, "picture_height": picture_height,
+        "pad_x": (PROXY_WIDTH - picture_width) // 2, "pad_y": (PROXY_HEIGHT - picture_height) // 2,
+    }
+
+def _write_atomically(path: str, command: list) -> bool:
+    # Written beside the target and renamed, like checkpoints; a unique temp name
+    # lets two jobs of the same source make it at once
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    proc = subprocess.run(command + [temp_path], capture_output=True)
+    if proc.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    os.replace(temp_path, path)
+    return True
+
+def _transcode(video_path: str, folder: str, geometry: dict) -> str:
+    path = os.path.join(folder, VIDEO_FILE)
+    gop = max(1, round(PROXY_FPS))
+    filters = (f"fps={PROXY_FPS},scale={geometry['picture_width']}:{geometry['picture_height']},"
+               f"pad={PROXY_WIDTH}:{PROXY_HEIGHT}:{geometry['pad_x']}:{geometry['pad_y']},format=yuv420p")
+    if not _write_atomically(path, ['ffmpeg', '-v', 'error', '-y', '-i', video_path, '-map', '0:v:0', '-an',
+                                    '-vf', filters, '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+                                    '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0', '-bf', '0',
+                                    '-f', 'mp4']):
+        raise RuntimeError(f"Could not transcode the analysis proxy of {video_path}")
+    return path
+
+def _extract_audio(video_path: str, folder: str) -> Optional[str]:
+    path = os.path.join(folder, AUDIO_FILE)
+    if _write_atomically(path, ['ffmpeg', '-v', 'error', '-y', '-i', video_path, '-map', '0:a:0', '-vn',
+                                '-ac', '1', '-ar', str(AUDIO_SAMPLE_RATE), '-f', 'wav']):
+        return path
+    return None # no audio stream
+
+def load_proxy(folder: str) -> dict:
+    """The proxy's description: the parts made so far ("video", "audio") and the video's geometry."""
+    try:
+        with open(os.path.join(folder, DESCRIPTION_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def make_proxy(video_path: str, folder: str, steps=VIDEO_STEPS + ("audio",)) -> Optional[dict]:
+    """
+    Makes the parts of the proxy in folder that the given steps need and returns
+    its description: the geometry of the video part, "video" and "audio" set to
+    their paths, or to None for a source without video or audio. Parts made for an
+    earlier job are reused. Returns None without ffmpeg, so the stages read the original.
+    """
+    if not available():
+        print("WARNING: ffmpeg not found. Stages will read the original video.")
+        return None
+    prune_proxies()
+    os.makedirs(folder, exist_ok=True)
+    description = load_proxy(folder)
+    changed = False
+    # A key that is present records the part as done, even when the source had nothing for it
+    if set(steps) & set(VIDEO_STEPS) and 'video' not in description:
+        size = source_size(video_path)
+        description['video'] = None
+        if size:
+            description.update(_fit(*size))
+            description['video'] = _transcode(video_path, folder, description)
+        changed = True
+    if "audio" in steps and 'audio' not in description:
+        description['audio'] = _extract_audio(video_path, folder)
+        changed = True
+    if changed:
+        temp_path = os.path.join(folder, f"{DESCRIPTION_FILE}.{uuid.uuid4().hex}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(description, f)
+        os.replace(temp_path, os.path.join(folder, DESCRIPTION_FILE))
+    # Marks the proxy as used, for prune_proxies
+    os.utime(folder)
+    return description
+
+def prune_proxies(max_age_days: float = None):
+    """Removes proxies that no job has used for max_age_days (default PROXY_RETENTION_DAYS)."""
+    if not os.path.isdir(PROXY_FOLDER):
+        return
+    cutoff = time.time() - 86400 * (PROXY_RETENTION_DAYS if max_age_days is None else max_age_days)
+    for entry in os.listdir(PROXY_FOLDER):
+        path = os.path.join(PROXY_FOLDER, entry)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass # Removed concurrently
+
+def scale_crop(crop: dict, geometry: dict, reference: tuple = None) -> dict:
+    """
+    Maps a crop ({'x', 'y', 'w', 'h'}) given for frames of the reference size
+    (default: the source's) onto the proxy's picture.
+    """
+    ref_width, ref_height = reference or (geometry['source_width'], geometry['source_height'])
+    sx = geometry['picture_width'] / ref_width
+    sy = geometry['picture_height'] / ref_height
+    x = min(geometry['pad_x'] + round(crop.get('x', 0) * sx), geometry['width'] - 2)
+    y = min(geometry['pad_y'] + round(crop.get('y', 0) * sy), geometry['height'] - 2)
+    w = round(crop.get('w', ref_width) * sx)
+    h = round(crop.get('h', ref_height) * sy)
+    # Clamped to the frame, so a crop meant for a larger source still yields a valid filter
+    w = max(2, min(w, geometry['width'] - x))
+    h = max(2, min(h, geometry['height'] - y))
+    return {'x': x, 'y': y, 'w': w, 'h': h}
@@ -1,10 +1,12 @@
 # tasks.py
 import os
 import sqlite3
-import traceback
-from celery import Celery
+from celery import Celery, chain, chord
 from database import get_db_connection
-from processing import process_video as core_process_video
+from processing import run_stage, correlate, load_job_options, job_steps
+from live import LiveSession
+import metrics
+import tracing
 
 # --- Celery Configuration ---
 celery_app = Celery(
@@ -13,35 +15,169 @@ celery_app = Celery(
     backend='redis://localhost:6379/0'
 )
 
+# Each stage has its own queue so workers can be sized per stage, e.g. GPU hosts
+# consuming "face" and CPU hosts consuming "proxy,ocr,audio,correlate" (see worker.py).
+celery_app.conf.task_routes = {
+    'tasks.proxy_stage_task': {'queue': 'proxy'},
+    'tasks.ocr_stage_task': {'queue': 'ocr'},
+    'tasks.face_stage_task': {'queue': 'face'},
+    'tasks.audio_stage_task': {'queue': 'audio'},
+    'tasks.correlate_task': {'queue': 'correlate'},
+    # Live streams hold a worker for as long as they run; not in PIPELINE_QUEUES
+    'tasks.live_stream_task': {'queue': 'live'},
+}
+
+# Priority lanes: live news must not wait behind an archive backfill. Each lane has
+# its own copy of every queue ("ocr" for normal, "ocr.high", "ocr.low", ...), so a
+# worker reserved for the high lane is never occupied by backfill work (see worker.py).
+# That reservation is the only priority guarantee: a worker on all lanes takes them in turn.
+PRIORITIES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+PIPELINE_QUEUES = ("celery", "proxy", "ocr", "face", "audio", "correlate")
+LIVE_QUEUE = "live"
+
+# Workers take one task at a time, so a backlog of low-priority work is not
+# prefetched ahead of high-priority work arriving later.
+celery_app.conf.worker_prefetch_multiplier = 1
+
+def normalize_priority(priority) -> str:
+    return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+def lane_queue(queue: str, priority: str) -> str:
+    """The queue name for a pipeline queue in the given priority lane."""
+    priority = normalize_priority(priority)
+    return queue if priority == DEFAULT_PRIORITY else f"{queue}.{priority}"
+
+def lane_queues(queues, lanes) -> list:
+    """
+    All lane queue names for the given queues. Celery consumes a worker's queues in
+    rotation, not in this order, so only workers reserved for a lane favour it.
+    """
+    lanes = [lane for lane in PRIORITIES if lane in lanes]
+    return [lane_queue(queue, lane) for lane in lanes for queue in queues]
+
+STAGE_MAX_RETRIES = int(os.environ.get("VIML_STAGE_MAX_RETRIES", "3"))
+
+# Stages are acknowledged only once they finish, so a worker dying mid-stage hands
+# it to another worker; completed stages are checkpointed and are not re-run.
+STAGE_TASK_OPTIONS = dict(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=STAGE_MAX_RETRIES,
+)
+
 @celery_app.task(bind=True)
-def process_video_task(self, video_path: str, job_id: str):
+def process_video_task(self, video_path: str, job_id: str, priority: str = DEFAULT_PRIORITY):
     """
-    Celery task wrapper for the processing.py logic.
-    Updates the SQLite 'jobs' table with status.
+    Starts the processing pipeline for a job: the proxy stage makes its analysis
+    proxy, then its steps (OCR, face and audio unless config["steps"] picks fewer)
+    run in parallel on their own queues, and a chord runs the correlate stage once
+    all of them have finished. Re-sending this task for a failed job resumes it:
+    stages with a checkpoint return their stored output immediately. Every stage
+    runs in the job's priority lane.
+    The job stays 'queued' until its first stage starts (see _run_stage), so time
+    spent waiting in the stage queues counts as queue wait, not as processing.
     """
-    _update_job_status(job_id, "processing")
-    
+    _, cfg, parent = load_job_options(job_id)
+    steps = job_steps(cfg)
+    with tracing.span("dispatch", parent, {"viml.job_id": job_id, "viml.priority": priority,
+                                           "viml.steps": ",".join(steps)}):
+        pipeline = chain(
+            proxy_stage_task.si(video_path, job_id).set(queue=lane_queue("proxy", priority))
+                .on_error(mark_job_failed.s(job_id=job_id)),
+            chord(
+                [STAGE_TASKS[stage].si(video_path, job_id).set(queue=lane_queue(stage, priority)) for stage in steps],
+                correlate_task.si(video_path, job_id).set(queue=lane_queue("correlate", priority))
+                    .on_error(mark_job_failed.s(job_id=job_id))
+            )
+        )
+        pipeline.apply_async()
+    return "dispatched"
+
+def _run_stage(stage: str, video_path: str, job_id: str):
+    _mark_job_started(job_id)
+    # Outputs go to checkpoints rather than the result backend; the chord only needs completion
+    run_stage(stage, video_path, job_id)
+    return stage
+
+@celery_app.task(**STAGE_TASK_OPTIONS)
+def proxy_stage_task(self, video_path: str, job_id: str):
+    return _run_stage("proxy", video_path, job_id)
+
+@celery_app.task(**STAGE_TASK_OPTIONS)
+def ocr_stage_task(self, video_path: str, job_id: str):
+    return _run_stage("ocr", video_path, job_id)
+
+@celery_app.task(**STAGE_TASK_OPTIONS)
+def face_stage_task(self, video_path: str, job_id: str):
+    return _run_stage("face", video_path, job_id)
+
+@celery_app.task(**STAGE_TASK_OPTIONS)
+def audio_stage_task(self, video_path: str, job_id: str):
+    return _run_stage("audio", video_path, job_id)
+
+STAGE_TASKS = {"ocr": ocr_stage_task, "face": face_stage_task, "audio": audio_stage_task}
+
+@celery_app.task(**STAGE_TASK_OPTIONS)
+def correlate_task(self, video_path: str, job_id: str):
+    correlate(video_path, job_id)
+    _update_job_status(job_id, "completed")
+    return "success"
+
+@celery_app.task
+def mark_job_failed(request, exc, traceback, job_id: str):
+    """Error callback: a stage (or correlate) failed after its retries."""
+    print(f"Task failed for job {job_id}: {exc}")
+    _update_job_status(job_id, "failed", result=str(exc))
+
+@celery_app.task
+def live_stream_task(stream_id: str):
+    """Runs a live stream until it ends, fails or is stopped (DELETE /v1/live/{stream_id})."""
+    LiveSession(stream_id).run()
+
+def _mark_job_started(job_id: str):
+    """Moves a queued job to 'processing' when the first of its stages starts."""
+    conn = None
     try:
-        # Run the core logic
-        core_process_video(video_path, job_id)
-        
-        _update_job_status(job_id, "completed")
-        return "success"
-        
-    except Exception as e:
-        error_msg = f"{str(e)}\n{traceback.format_exc()}"
-        print(f"Task failed for job {job_id}: {error_msg}")
-        _update_job_status(job_id, "failed", result=str(e))
-        # Re-raise so Celery knows it failed
-        raise e
+        conn = get_db_connection()
+        started = conn.execute(
+            """
+            UPDATE jobs SET status = 'processing', updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                started_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE job_id = ? AND status = 'queued'
+            """,
+            (job_id,)
+        ).rowcount
+        conn.commit()
+        if started:
+            row = conn.execute(
+                "SELECT priority, (julianday(started_at) - julianday(created_at)) * 86400 AS wait FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+            metrics.QUEUE_WAIT_SECONDS.labels(row['priority']).observe(max(row['wait'], 0.0))
+    except sqlite3.Error as e:
+        print(f"Failed to mark job {job_id} started: {e}")
+    finally:
+        if conn:
+            conn.close()
 
 def _update_job_status(job_id, status, result=None):
     """Helper to update the job status in SQLite."""
+    conn = None
     try:
         conn = get_db_connection()
+        # started_at / finished_at carry milliseconds for batch timing
         conn.execute(
-            "UPDATE jobs SET status = ?, result = ?, updated_at = CURRENT_TIMESTAMP WHERE job_id = ?",
-            (status, result, job_id)
+            """
+            UPDATE jobs SET status = ?, result = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                started_at = CASE WHEN ? = 'processing' THEN strftime('%Y-%m-%d %H:%M:%f', 'now') ELSE started_at END,
+                finished_at = CASE WHEN ? IN ('completed', 'failed') THEN strftime('%Y-%m-%d %H:%M:%f', 'now') ELSE finished_at END
+            WHERE job_id = ?
+            """,
+            (status, result, status, status, job_id)
         )
         conn.commit()
     except sqlite3.Error as e:
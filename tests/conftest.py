@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database in a temporary directory; yields an open connection to it."""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "video_metadata.db"))
+    database.init_db()
+    conn = database.get_db_connection()
+    yield conn
+    conn.close()
+
+
+def add_person(conn, video_path, name):
+    cursor = conn.execute("INSERT INTO persons (video_path, name) VALUES (?, ?)", (video_path, name))
+    return cursor.lastrowid
+
+
+def add_occurrence(conn, video_path, person_id, start, end=None, status='pending'):
+    cursor = conn.execute(
+        "INSERT INTO occurrences (video_path, person_id, timestamp_seconds, end_seconds, method_used, review_status) "
+        "VALUES (?, ?, ?, ?, 'ocr', ?)",
+        (video_path, person_id, start, end if end is not None else start + 1, status))
+    return cursor.lastrowid
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    """main, imported from a scratch directory: the app mounts viml_ui/static and uploads/ relative to the cwd."""
+    workdir = tmp_path_factory.mktemp("app")
+    os.makedirs(workdir / "viml_ui" / "static")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    return main
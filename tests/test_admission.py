@@ -0,0 +1,55 @@
+import pytest
+
+import admission
+
+
+@pytest.fixture
+def jobs(db, monkeypatch):
+    monkeypatch.setattr(admission, "WORKER_CAPACITY", 2)
+    monkeypatch.setattr(admission, "_load_cache", {"checked_at": None, "state": None})
+
+    def add(status, run_seconds=None):
+        db.execute(
+            "INSERT INTO jobs (job_id, status, started_at, finished_at) VALUES "
+            "(lower(hex(randomblob(8))), ?, datetime('now', ?), datetime('now'))",
+            (status, f"-{run_seconds or 0} seconds"))
+        db.commit()
+    return add
+
+
+def test_load_state_estimates_drain(db, jobs):
+    jobs('completed', 60)
+    jobs('completed', 120)
+    for _ in range(4):
+        jobs('queued')
+    state = admission.load_state(db)
+    assert state['queued'] == 4
+    assert state['avg_run_seconds'] == pytest.approx(90, abs=1)
+    assert state['drain_seconds'] == pytest.approx(4 * 90 / 2, abs=2)
+
+
+def test_run_time_query_uses_index(db):
+    plan = " ".join(row[-1] for row in db.execute(
+        "EXPLAIN QUERY PLAN SELECT finished_at FROM jobs WHERE status = 'completed' "
+        "AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT 100"))
+    assert "idx_jobs_finished" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_current_load_is_cached(db, jobs, monkeypatch):
+    jobs('queued')
+    assert admission.current_load()['queued'] == 1
+    jobs('queued')
+    assert admission.current_load()['queued'] == 1
+    monkeypatch.setattr(admission, "LOAD_CACHE_SECONDS", 0)
+    assert admission.current_load()['queued'] == 2
+
+
+def test_queue_limit_denies(db, jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(admission, "MIN_FREE_DISK_BYTES", 0)
+    monkeypatch.setattr(admission, "MAX_QUEUED_JOBS", 2)
+    jobs('queued')
+    admission.check_admission(str(tmp_path))
+    with pytest.raises(admission.AdmissionDenied) as denied:
+        admission.check_admission(str(tmp_path), new_jobs=2)
+    assert denied.value.reason == "queue"
@@ -0,0 +1,26 @@
+import pytest
+from fastapi import HTTPException
+
+
+def test_cursor_round_trip(main_module):
+    key = ["videos/a clip.mp4", 12.5, 42]
+    cursor = main_module._encode_cursor(key)
+    assert "/" not in cursor and "+" not in cursor
+    assert main_module._decode_cursor(cursor, 3) == key
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24=", "eyJhIjogMX0="])
+def test_invalid_cursor_is_a_bad_request(main_module, cursor):
+    with pytest.raises(HTTPException) as error:
+        main_module._decode_cursor(cursor, 3)
+    assert error.value.status_code == 400
+
+
+def test_cursor_of_another_view_is_rejected(main_module):
+    with pytest.raises(HTTPException):
+        main_module._decode_cursor(main_module._encode_cursor(["a", 1]), 3)
+
+
+def test_next_cursor_header_is_exposed_to_browsers(main_module):
+    cors = next(m for m in main_module.app.user_middleware if m.cls.__name__ == "CORSMiddleware")
+    assert "X-Next-Cursor" in cors.kwargs["expose_headers"]
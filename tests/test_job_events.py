@@ -0,0 +1,52 @@
+from job_events import JobEventHub, merge_jobs
+
+
+def _add_job(conn, job_id, status='queued'):
+    conn.execute("INSERT INTO jobs (job_id, status, created_at, updated_at) VALUES "
+                 "(?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'), strftime('%Y-%m-%d %H:%M:%f', 'now'))",
+                 (job_id, status))
+    conn.commit()
+
+
+def _set_status(conn, job_id, status):
+    conn.execute("UPDATE jobs SET status = ?, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now', '+1 second') "
+                 "WHERE job_id = ?", (status, job_id))
+    conn.commit()
+
+
+def _poll(hub):
+    return hub._poll([("jobs", "*")]).get(("jobs", "*"))
+
+
+def test_jobs_feed_sends_active_jobs_then_changes(db):
+    _add_job(db, "done-before", 'completed')
+    _add_job(db, "a")
+    _add_job(db, "b")
+    hub = JobEventHub()
+    assert {job['job_id'] for job in _poll(hub)} == {"a", "b"}
+
+    _set_status(db, "a", 'completed')
+    assert [(job['job_id'], job['status']) for job in _poll(hub)] == [("a", 'completed')]
+
+    # A commit that changes no job sends nothing
+    db.execute("INSERT INTO persons (video_path, name) VALUES ('v.mp4', 'x')")
+    db.commit()
+    assert _poll(hub) is None
+    hub._conn.close()
+
+
+def test_new_subscriber_gets_the_active_list_again(db):
+    _add_job(db, "a")
+    hub = JobEventHub()
+    assert [job['job_id'] for job in _poll(hub)] == ["a"]
+    hub._jobs_full = True
+    hub._data_version = None
+    assert [job['job_id'] for job in _poll(hub)] == ["a"]
+    hub._conn.close()
+
+
+def test_merge_jobs_keeps_latest_state():
+    earlier = [{"job_id": "a", "status": "queued"}, {"job_id": "b", "status": "processing"}]
+    later = [{"job_id": "a", "status": "processing"}]
+    assert merge_jobs(earlier, later) == [{"job_id": "a", "status": "processing"},
+                                          {"job_id": "b", "status": "processing"}]
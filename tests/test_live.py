@@ -0,0 +1,34 @@
+from database import get_data_version, get_video_version
+from live import LiveSession, create_stream
+
+
+def _open_span(session, person_id, start):
+    session.open_spans[person_id] = {"person_id": person_id, "start": start, "last": start,
+                                     "location": (0, 0, 10, 10), "occurrence_id": None, "dirty": True}
+
+
+def test_extending_open_spans_keeps_the_aggregate_version(db):
+    session = LiveSession(create_stream("rtmp://example/live"))
+    person_id = session._person("Jane Doe")
+    _open_span(session, person_id, 1.0)
+    before = get_data_version(db)
+    session.flush(status='live')
+    opened = get_data_version(db)
+    assert opened > before
+
+    # The span stays open: the batch only moves its end
+    viml = get_video_version(db, session.video_path)
+    span = session.open_spans[person_id]
+    span['last'], span['dirty'] = 4.0, True
+    session.flush()
+    assert get_data_version(db) == opened
+    assert get_video_version(db, session.video_path) > viml
+
+
+def test_new_rows_bump_the_aggregate_version(db):
+    session = LiveSession(create_stream("rtmp://example/live"))
+    person_id = session._person("Jane Doe")
+    session.pending.append((person_id, 2.0, 3.0, 'ocr', 95.0, "Jane Doe"))
+    before = get_data_version(db)
+    session.flush()
+    assert get_data_version(db) > before
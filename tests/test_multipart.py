@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import ingest
+
+BOUNDARY = "----vimltest"
+VIDEO = b"\x00\x00\x00\x18ftypisom" + os.urandom(10000)
+
+
+class FakeRequest:
+    """The parts of a Starlette request receive_multipart uses; the body arrives in small pieces."""
+
+    def __init__(self, body: bytes, piece: int = 333):
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        self._body = body
+        self._piece = piece
+
+    async def stream(self):
+        for i in range(0, len(self._body), self._piece):
+            yield self._body[i:i + self._piece]
+
+
+def _body(*parts, close=True) -> bytes:
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+    return body + (f"--{BOUNDARY}--\r\n".encode() if close else b"")
+
+
+def _receive(tmp_path, body, **kwargs):
+    return asyncio.run(ingest.receive_multipart(FakeRequest(body), "file", lambda name: str(tmp_path / name),
+                                                **kwargs))
+
+
+def test_files_and_fields_are_parsed_from_the_stream(tmp_path):
+    fields, files = _receive(tmp_path, _body(("config", b'{"profile": "news"}', None),
+                                             ("file", VIDEO, "a.mp4"),
+                                             ("other", b"ignored", "b.mp4"),
+                                             ("file", VIDEO[:5000] + VIDEO, "c.mp4")))
+    assert fields == {"config": '{"profile": "news"}'}
+    assert [f["filename"] for f in files] == ["a.mp4", "c.mp4"]
+    assert files[0]["size"] == len(VIDEO)
+    assert files[0]["sha256"] == hashlib.sha256(VIDEO).hexdigest()
+    assert (tmp_path / "a.mp4").read_bytes() == VIDEO
+    assert not (tmp_path / "b.mp4").exists()
+
+
+def test_rejected_type_leaves_nothing_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "VALIDATE_MEDIA", True)
+    with pytest.raises(HTTPException) as error:
+        _receive(tmp_path, _body(("file", VIDEO, "a.mp4"), ("file", b"not a video" * 1000, "b.mp4")))
+    assert error.value.status_code == 415
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("kwargs, status", [({"max_bytes": 1000}, 413), ({"max_files": 1}, 400)])
+def test_limits(tmp_path, kwargs, status):
+    with pytest.raises(HTTPException) as error:
+        _receive(tmp_path, _body(("file", VIDEO, "a.mp4"), ("file", VIDEO, "b.mp4")), **kwargs)
+    assert error.value.status_code == status
+    assert os.listdir(tmp_path) == []
+
+
+def test_truncated_body_is_rejected(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        _receive(tmp_path, _body(("file", VIDEO, "a.mp4"), close=False)[:-100])
+    assert error.value.status_code == 400
+    assert os.listdir(tmp_path) == []
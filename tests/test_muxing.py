@@ -0,0 +1,52 @@
+import muxing
+from database import get_video_version
+from conftest import add_occurrence, add_person
+
+
+def test_video_version_changes_only_for_written_video(db):
+    jane = add_person(db, "a.mp4", "Jane Doe")
+    john = add_person(db, "b.mp4", "John Smith")
+    first = add_occurrence(db, "a.mp4", jane, 5.0)
+    add_occurrence(db, "b.mp4", john, 7.0)
+    db.commit()
+    a, b = get_video_version(db, "a.mp4"), get_video_version(db, "b.mp4")
+
+    db.execute("UPDATE occurrences SET review_status = 'approved' WHERE occurrence_id = ?", (first,))
+    db.commit()
+    assert get_video_version(db, "a.mp4") > a
+    assert get_video_version(db, "b.mp4") == b
+
+
+def test_rename_and_delete_bump_the_video(db):
+    jane = add_person(db, "a.mp4", "Jane Doe")
+    occurrence = add_occurrence(db, "a.mp4", jane, 5.0)
+    db.commit()
+    version = get_video_version(db, "a.mp4")
+
+    db.execute("UPDATE persons SET name = 'Jane Roe' WHERE person_id = ?", (jane,))
+    db.commit()
+    renamed = get_video_version(db, "a.mp4")
+    assert renamed > version
+
+    db.execute("DELETE FROM occurrences WHERE occurrence_id = ?", (occurrence,))
+    db.commit()
+    assert get_video_version(db, "a.mp4") > renamed
+
+
+def test_cache_digest_ignores_writes_to_other_videos(db, tmp_path):
+    original = tmp_path / "a.mp4"
+    original.write_bytes(b"video")
+    jane = add_person(db, "a.mp4", "Jane Doe")
+    john = add_person(db, "b.mp4", "John Smith")
+    add_occurrence(db, "a.mp4", jane, 5.0)
+    db.commit()
+    digest = muxing.cache_digest(str(original), "a.mp4")
+
+    add_occurrence(db, "b.mp4", john, 9.0)
+    db.commit()
+    assert muxing.cache_digest(str(original), "a.mp4") == digest
+
+    add_occurrence(db, "a.mp4", jane, 9.0)
+    db.commit()
+    assert muxing.cache_digest(str(original), "a.mp4") != digest
+    assert muxing.cache_digest(str(original), "a.mp4", compact=True) != muxing.cache_digest(str(original), "a.mp4")
@@ -0,0 +1,103 @@
+import os
+import subprocess
+
+import pytest
+
+import proxy
+
+
+def test_scale_crop_maps_1080p_crop_onto_letterboxed_proxy():
+    geometry = proxy._fit(1440, 1080) # 4:3 source, pillarboxed into 1280x720
+    assert (geometry['picture_width'], geometry['pad_x']) == (960, 160)
+    crop = proxy.scale_crop({'x': 0, 'y': 880, 'w': 1920, 'h': 200}, geometry, (1920, 1080))
+    assert crop == {'x': 160, 'y': 587, 'w': 960, 'h': 133}
+
+
+def test_scale_crop_uses_source_pixels_by_default():
+    geometry = proxy._fit(3840, 2160)
+    assert proxy.scale_crop({'x': 300, 'y': 150, 'w': 600, 'h': 300}, geometry) == \
+        {'x': 100, 'y': 50, 'w': 200, 'h': 100}
+
+
+def test_scale_crop_clamps_to_the_frame():
+    geometry = proxy._fit(1920, 1080)
+    crop = proxy.scale_crop({'x': 5000, 'y': 5000, 'w': 400, 'h': 300}, geometry)
+    assert crop['x'] + crop['w'] <= geometry['width'] and crop['y'] + crop['h'] <= geometry['height']
+
+
+def test_source_size_is_none_without_a_video_stream(monkeypatch):
+    monkeypatch.setattr(subprocess, "run", lambda *a, **kw: subprocess.CompletedProcess(a, 0, stdout="\n"))
+    assert proxy.source_size("audio_only.m4a") is None
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch, tmp_path):
+    """Records which proxy parts are made, without running ffmpeg."""
+    made = []
+    monkeypatch.setattr(proxy, "PROXY_FOLDER", str(tmp_path / "proxies"))
+    monkeypatch.setattr(proxy, "available", lambda: True)
+    monkeypatch.setattr(proxy, "source_size", lambda path: None if "audio_only" in path else (1920, 1080))
+
+    def transcode(video_path, folder, geometry):
+        made.append("video")
+        path = os.path.join(folder, proxy.VIDEO_FILE)
+        open(path, 'wb').close()
+        return path
+
+    def extract_audio(video_path, folder):
+        made.append("audio")
+        path = os.path.join(folder, proxy.AUDIO_FILE)
+        open(path, 'wb').close()
+        return path
+
+    monkeypatch.setattr(proxy, "_transcode", transcode)
+    monkeypatch.setattr(proxy, "_extract_audio", extract_audio)
+    return made
+
+
+def test_make_proxy_only_makes_what_the_steps_read(fake_ffmpeg, tmp_path):
+    folder = str(tmp_path / "proxies" / "abc")
+    proxy.make_proxy("clip.mp4", folder, ("ocr",))
+    description = proxy.load_proxy(folder)
+    assert fake_ffmpeg == ["video"] and 'audio' not in description
+
+    # A later audio job of the same source adds the wav and reuses the video
+    description = proxy.make_proxy("clip.mp4", folder, ("audio",))
+    assert fake_ffmpeg == ["video", "audio"]
+    assert description['video'].endswith(proxy.VIDEO_FILE) and description['picture_height'] == 720
+    proxy.make_proxy("clip.mp4", folder, ("ocr", "face", "audio"))
+    assert fake_ffmpeg == ["video", "audio"]
+
+
+def test_make_proxy_skips_the_video_of_an_audio_only_source(fake_ffmpeg, tmp_path):
+    description = proxy.make_proxy("audio_only.m4a", str(tmp_path / "proxies" / "abc"))
+    assert description['video'] is None
+    assert fake_ffmpeg == ["audio"]
+
+
+def test_prune_removes_unused_proxies(fake_ffmpeg, tmp_path):
+    old, recent = tmp_path / "proxies" / "old", tmp_path / "proxies" / "recent"
+    proxy.make_proxy("clip.mp4", str(old), ("ocr",))
+    proxy.make_proxy("clip.mp4", str(recent), ("ocr",))
+    os.utime(old, (0, 0))
+    proxy.prune_proxies()
+    assert not old.exists() and recent.exists()
+
+
+def test_stages_read_the_proxy_and_it_outlives_the_checkpoints(db, fake_ffmpeg, tmp_path, monkeypatch):
+    import processing
+    monkeypatch.setattr(processing, "CHECKPOINT_FOLDER", str(tmp_path / "checkpoints"))
+    db.execute("INSERT INTO jobs (job_id, status, config, source_sha256) VALUES ('j1', 'queued', ?, 'abc')",
+               ('{"steps": ["ocr"]}',))
+    db.commit()
+    read = []
+    monkeypatch.setattr(processing, "_run_ocr", lambda source, crop=None, sample_rate=None: read.append((source, crop)) or [])
+
+    processing.run_stage("proxy", "clip.mp4", "j1")
+    processing.run_stage("ocr", "clip.mp4", "j1")
+    folder = tmp_path / "proxies" / "abc"
+    assert read == [(str(folder / proxy.VIDEO_FILE), {'x': 0, 'y': 587, 'w': 1280, 'h': 133})]
+    assert fake_ffmpeg == ["video"]
+
+    processing.clear_checkpoints("j1")
+    assert (folder / proxy.VIDEO_FILE).exists()
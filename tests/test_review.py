@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import add_occurrence, add_person
+
+
+def _person_of(db, occurrence_id):
+    return db.execute("SELECT person_id FROM occurrences WHERE occurrence_id = ?", (occurrence_id,)).fetchone()[0]
+
+
+def test_bulk_merge_moves_everything_in_one_go(db, main_module):
+    source = add_person(db, "a.mp4", "J. Doe")
+    target = add_person(db, "a.mp4", "Jane Doe")
+    occurrences = [add_occurrence(db, "a.mp4", source, float(t)) for t in range(1200)]
+    db.commit()
+
+    summary = main_module._apply_bulk_review(
+        main_module.BulkReviewRequest(action="merge", person_ids=[source], target_person_id=target))
+    assert summary["persons_merged"] == 1
+    assert summary["occurrences_moved"] == len(occurrences)
+    assert {_person_of(db, o) for o in occurrences} == {target}
+
+
+def test_failed_merge_leaves_nothing_half_merged(db, main_module):
+    source = add_person(db, "a.mp4", "J. Doe")
+    target = add_person(db, "a.mp4", "Jane Doe")
+    occurrences = [add_occurrence(db, "a.mp4", source, float(t)) for t in range(1200)]
+    # The last statement of the merge fails
+    db.execute("CREATE TRIGGER fail_delete BEFORE DELETE ON persons BEGIN SELECT RAISE(ABORT, 'boom'); END")
+    db.commit()
+
+    with pytest.raises(Exception, match="boom"):
+        main_module._apply_bulk_review(
+            main_module.BulkReviewRequest(action="merge", person_ids=[source], target_person_id=target))
+    assert {_person_of(db, o) for o in occurrences} == {source}
+
+
+def test_bulk_approve_by_person_keeps_reviewed_decisions(db, main_module):
+    person = add_person(db, "a.mp4", "Jane Doe")
+    pending = add_occurrence(db, "a.mp4", person, 1.0)
+    rejected = add_occurrence(db, "a.mp4", person, 2.0, status='rejected')
+    db.commit()
+
+    request = main_module.BulkReviewRequest(action="approve", person_ids=[person])
+    assert main_module._apply_bulk_review(request) == {"occurrences_updated": 1}
+    assert main_module._apply_bulk_review(request) == {"occurrences_updated": 0}
+    statuses = dict(db.execute("SELECT occurrence_id, review_status FROM occurrences").fetchall())
+    assert statuses == {pending: 'approved', rejected: 'rejected'}
+
+
+def test_rename_to_existing_name_merges_with_the_status_change(db, main_module):
+    source = add_person(db, "a.mp4", "J. Doe")
+    target = add_person(db, "a.mp4", "Jane Doe")
+    occurrence = add_occurrence(db, "a.mp4", source, 1.0)
+    db.commit()
+
+    update = main_module.MetadataUpdate(review_status="approved", details="Jane Doe")
+    result = main_module._apply_metadata_update(occurrence, update)
+    assert result["person_updated"] == target
+    row = db.execute("SELECT person_id, review_status FROM occurrences WHERE occurrence_id = ?", (occurrence,)).fetchone()
+    assert tuple(row) == (target, 'approved')
+    assert db.execute("SELECT 1 FROM persons WHERE person_id = ?", (source,)).fetchone() is None
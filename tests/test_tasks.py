@@ -0,0 +1,15 @@
+from tasks import lane_queue, lane_queues
+
+
+def test_lane_queue():
+    assert lane_queue("ocr", "normal") == "ocr"
+    assert lane_queue("ocr", "high") == "ocr.high"
+    assert lane_queue("face", "low") == "face.low"
+    # Unknown priorities run in the default lane
+    assert lane_queue("ocr", "urgent") == "ocr"
+    assert lane_queue("ocr", None) == "ocr"
+
+
+def test_lane_queues():
+    assert lane_queues(["ocr", "face"], ["low", "high"]) == ["ocr.high", "face.high", "ocr.low", "face.low"]
+    assert lane_queues(["ocr"], ["normal", "bogus"]) == ["ocr"]
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(path))
+    monkeypatch.setattr(tracing, "OTLP_ENDPOINT", "")
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing, "_pending", [])
+    # Pretend the flusher is running, so only the explicit _flush below writes
+    monkeypatch.setattr(tracing, "_flusher_pid", tracing.os.getpid())
+    return path
+
+
+def test_spans_are_written_by_the_flusher_in_one_batch(trace_file):
+    with tracing.span("request") as attributes:
+        attributes["http.status_code"] = 202
+        with tracing.span("create job"):
+            child = tracing.traceparent()
+    assert not trace_file.exists()
+
+    tracing._flush()
+    lines = trace_file.read_text().splitlines()
+    assert len(lines) == 1
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["name"] for s in spans] == ["create job", "request"]
+    assert spans[0]["traceId"] == spans[1]["traceId"] == tracing.trace_id(child)
+    assert spans[0]["parentSpanId"] == spans[1]["spanId"]
+
+
+def test_span_continues_a_stored_traceparent(trace_file):
+    parent = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+    with tracing.span("stage", parent=parent):
+        assert tracing.trace_id(tracing.traceparent()) == "a" * 32
+    tracing._flush()
+    span = json.loads(trace_file.read_text())["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert span["parentSpanId"] == "b" * 16
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from ingest import merge_ranges, missing_ranges
+
+
+def test_merge_ranges_joins_overlapping_and_adjacent_chunks():
+    assert merge_ranges([(0, 10), (5, 10), (15, 5), (30, 0), (40, 10)]) == [[0, 20], [40, 50]]
+
+
+def test_missing_ranges():
+    assert missing_ranges([[0, 20], [40, 50]], 60) == [[20, 40], [50, 60]]
+    assert missing_ranges([], 10) == [[0, 10]]
+    assert missing_ranges([[0, 10]], 10) == []
+
+
+@pytest.fixture
+def finalizing_session(db, main_module, tmp_path, monkeypatch):
+    """A complete upload left 'finalizing', whose declared digest does not match."""
+    monkeypatch.setattr(main_module, "PARTIAL_UPLOAD_FOLDER", str(tmp_path))
+    (tmp_path / "u1").write_bytes(b"x" * 10)
+    db.execute("INSERT INTO upload_sessions (upload_id, filename, size, sha256, status) "
+               "VALUES ('u1', 'clip.mp4', 10, 'not-the-digest', 'finalizing')")
+    db.execute("INSERT INTO upload_chunks (upload_id, chunk_offset, length) VALUES ('u1', 0, 10)")
+    db.commit()
+    return db
+
+
+def _status(conn):
+    return conn.execute("SELECT status FROM upload_sessions WHERE upload_id = 'u1'").fetchone()[0]
+
+
+def test_finalize_in_progress_is_not_claimed_twice(finalizing_session, main_module):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main_module.finalize_upload("u1"))
+    assert error.value.status_code == 409
+    assert _status(finalizing_session) == 'finalizing'
+
+
+def test_stale_finalize_is_taken_over(finalizing_session, main_module):
+    finalizing_session.execute("UPDATE upload_sessions SET updated_at = datetime('now', '-2 days')")
+    finalizing_session.commit()
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main_module.finalize_upload("u1"))
+    # Claimed and hashed; the mismatch then reopens the session for a re-send
+    assert error.value.status_code == 422
+    assert _status(finalizing_session) == 'open'
@@ -0,0 +1,41 @@
+from viml_generator import _compact_cues
+
+
+def _row(start, end, person_id, confidence=0.5):
+    return {"timestamp_seconds": start, "end_seconds": end, "person_id": person_id, "confidence": confidence,
+            "name": f"Person {person_id}", "method_used": "ocr"}
+
+
+def _summary(cues):
+    return [(start, end, [(ident['person_id'], ident['confidence']) for ident in identities])
+            for start, end, identities in cues]
+
+
+def test_compact_cues_merge_spans_and_share_overlaps():
+    rows = [_row(0, 1, 1, 0.5), _row(1.5, 3, 1, 0.9), _row(2, 4, 2), _row(10, 11, 1)]
+    assert _summary(_compact_cues(rows)) == [
+        # The gap under COMPACT_MAX_GAP is bridged and the span keeps its best evidence
+        (0, 2, [(1, 0.9)]),
+        (2, 3, [(1, 0.9), (2, 0.5)]),
+        (3, 4, [(2, 0.5)]),
+        (10, 11, [(1, 0.5)]),
+    ]
+
+
+def test_compact_cues_stream_once_spans_close():
+    rows = [_row(0, 1, 1), _row(1.5, 3, 1), _row(2, 4, 2), _row(10, 11, 1), _row(20, 21, 2)]
+    consumed = []
+
+    def records():
+        for row in rows:
+            consumed.append(row)
+            yield row
+
+    cues = _compact_cues(records())
+    assert next(cues)[:2] == (0, 2)
+    assert len(consumed) < len(rows)
+    assert [cue[:2] for cue in cues] == [(2, 3), (3, 4), (10, 11), (20, 21)]
+
+
+def test_compact_cues_empty():
+    assert list(_compact_cues([])) == []
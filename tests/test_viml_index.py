@@ -0,0 +1,45 @@
+import pytest
+
+from viml_index import VimlIndex, write_index
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "clip.mp4.vimlidx")
+    write_index(path, [
+        (30.0, 40.0, 1, "Ana"),
+        (0.0, 100.0, 2, "Bo"),  # long span: still found by spans starting much earlier
+        (5.0, 10.0, 1, "Ana"),
+        (50.0, 55.0, 3, "Çelik"),
+    ])
+    with VimlIndex(path) as idx:
+        yield idx
+
+
+def test_present_at(index):
+    assert sorted(index.present_at(7.0)) == [(1, "Ana"), (2, "Bo")]
+    assert sorted(index.present_at(52.0)) == [(2, "Bo"), (3, "Çelik")]
+    # Spans are [start, end): a person is gone at their end time
+    assert index.present_at(10.0) == [(2, "Bo")]
+    assert index.present_at(150.0) == []
+
+
+def test_next_appearance(index):
+    assert index.next_appearance(1, -1.0) == (5.0, 10.0)
+    assert index.next_appearance(1, 5.0) == (30.0, 40.0)
+    assert index.next_appearance(1, 30.0) is None
+    assert index.next_appearance(99, 0.0) is None
+
+
+def test_appearances_and_persons(index):
+    assert index.appearances(1) == [(5.0, 10.0), (30.0, 40.0)]
+    assert sorted(index.persons()) == [(1, "Ana"), (2, "Bo"), (3, "Çelik")]
+    assert len(index) == 4
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / "empty.vimlidx")
+    write_index(path, [])
+    with VimlIndex(path) as idx:
+        assert idx.present_at(0.0) == []
+        assert idx.next_appearance(1, 0.0) is None
@@ -0,0 +1,214 @@
+# tracing.py
+# Per-job tracing and opt-in profiling.
+#
+# Spans follow a job from its upload (/v1/process) through the Celery tasks into
+# each processing stage and its database writes. The trace context travels with
+# the job as a W3C traceparent in jobs.traceparent, so stages on other hosts join
+# the same trace. Spans are appended as OTLP/JSON lines to VIML_TRACE_FILE (the
+# format the OpenTelemetry Collector's otlpjsonfile receiver reads) and, with
+# VIML_OTLP_ENDPOINT set (e.g. http://localhost:4318/v1/traces), posted to an
+# OTLP/HTTP collector. Tracing is off unless one of them is set.
+#
+# A job submitted with {"profiling": true} in its config is also sampled by a
+# stack profiler while its stages run. Each stage writes collapsed stacks
+# ("frame;frame;frame count" lines, ready for flamegraph.pl or speedscope) to
+# PROFILE_FOLDER/<job_id>/<stage>.folded; /v1/jobs/{job_id} lists them.
+import atexit
+import collections
+import contextvars
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Optional
+
+TRACE_FILE = os.environ.get("VIML_TRACE_FILE", "")
+OTLP_ENDPOINT = os.environ.get("VIML_OTLP_ENDPOINT", "")
+TRACING_ENABLED = bool(TRACE_FILE or OTLP_ENDPOINT)
+SERVICE_NAME = os.environ.get("VIML_SERVICE_NAME", "viml")
+# Spans are written to the file and sent to the collector in batches, at most this often
+FLUSH_SECONDS = 2.0
+
+# Like checkpoints, profiles must be on storage shared by all workers in a split deployment
+PROFILE_FOLDER = os.environ.get("VIML_PROFILE_FOLDER", os.path.join("generated", "profiles"))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("VIML_PROFILE_INTERVAL_SECONDS", "0.01"))
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_current = contextvars.ContextVar("viml_span", default=None) # (trace_id, span_id)
+
+# --- Tracing ---
+
+def traceparent() -> Optional[str]:
+    """The current span as a W3C traceparent, or None outside a span."""
+    current = _current.get()
+    return f"00-{current[0]}-{current[1]}-01" if current else None
+
+def trace_id(value: Optional[str]) -> Optional[str]:
+    """The trace ID in a traceparent."""
+    match = _TRACEPARENT.match(value or "")
+    return match.group(1) if match else None
+
+@contextmanager
+def span(name: str, parent: Optional[str] = None, attributes: Optional[dict] = None):
+    """
+    Records a span around the block. Its parent is the given traceparent, else the
+    current span; without either it starts a new trace. Yields the span's
+    attributes, which the block may add to.
+    """
+    attributes = dict(attributes or {})
+    if not TRACING_ENABLED:
+        yield attributes
+        return
+    match = _TRACEPARENT.match(parent or "")
+    parent_ids = (match.group(1), match.group(2)) if match else _current.get()
+    ids = (parent_ids[0] if parent_ids else secrets.token_hex(16), secrets.token_hex(8))
+    token = _current.set(ids)
+    start = time.time_ns()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        _export({
+            "traceId": ids[0],
+            "spanId": ids[1],
+            "parentSpanId": parent_ids[1] if parent_ids else "",
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(time.time_ns()),
+            "attributes": [_attribute(key, value) for key, value in attributes.items() if value is not None],
+            "status": {"code": 2, "message": error} if error else {"code": 1}
+        })
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+def _otlp_request(spans: list) -> dict:
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME), _attribute("process.pid", os.getpid())]},
+        "scopeSpans": [{"scope": {"name": "viml"}, "spans": spans}]
+    }]}
+
+_export_lock = threading.Lock()
+_pending = []
+_flusher_pid = None
+
+def _reset_after_fork():
+    # Celery's prefork pool forks workers; the parent's lock, queue and flusher thread do not carry over
+    global _export_lock, _pending, _flusher_pid
+    _export_lock = threading.Lock()
+    _pending = []
+    _flusher_pid = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _export(span_data: dict):
+    # Only queued here: spans end on the request path, so the file and the
+    # collector are written by a background thread
+    global _flusher_pid
+    with _export_lock:
+        _pending.append(span_data)
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_periodically, daemon=True).start()
+
+def _flush():
+    global _pending
+    with _export_lock:
+        spans, _pending = _pending, []
+    if not spans:
+        return
+    # One OTLP request per line, as the otlpjsonfile receiver reads them
+    body = json.dumps(_otlp_request(spans))
+    if TRACE_FILE:
+        try:
+            with open(TRACE_FILE, 'a') as f:
+                f.write(body + "\n")
+        except OSError as e:
+            print(f"Could not write {len(spans)} spans to {TRACE_FILE}: {e}")
+    if OTLP_ENDPOINT:
+        request = urllib.request.Request(OTLP_ENDPOINT, data=body.encode(), headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except Exception as e:
+            print(f"Could not export {len(spans)} spans to {OTLP_ENDPOINT}: {e}")
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        _flush()
+
+if TRACING_ENABLED:
+    atexit.register(_flush)
+
+# --- Profiling ---
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval and counts each distinct stack."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def profile_path(job_id: str, stage: str) -> str:
+    return os.path.join(PROFILE_FOLDER, job_id, f"{stage}.folded")
+
+def list_profiles(job_id: str) -> list:
+    """Stages of the job that have a profile."""
+    folder = os.path.join(PROFILE_FOLDER, job_id)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name[:-len(".folded")] for name in os.listdir(folder) if name.endswith(".folded"))
+
+@contextmanager
+def profile(job_id: Optional[str], stage: str, enabled: bool = True):
+    """Samples the calling thread during the block and stores the stacks as the stage's profile."""
+    if not (enabled and job_id):
+        yield
+        return
+    sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_SECONDS)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        path = profile_path(job_id, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A retried stage replaces its earlier profile
+        with open(f"{path}.tmp", 'w') as f:
+            for stack, count in sampler.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(f"{path}.tmp", path)
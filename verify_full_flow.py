@@ -1,6 +1,7 @@
 import requests
 import time
 import os
+import json
 
 BASE_URL = "http://localhost:5000"
 
@@ -29,20 +30,21 @@ def run_test():
             print(f"❌ Connection Error: {e}")
             return
 
-    # 3. Poll Status
-    print("[2] Polling Job Status...")
-    for i in range(20):
-        res = requests.get(f"{BASE_URL}/v1/jobs/{job_id}")
-        status = res.json()
-        s = status['status']
-        print(f"   Status: {s}")
-        if s == 'completed':
-            print("✅ Job Completed")
-            break
-        if s == 'failed':
-            print(f"❌ Job Failed: {status.get('result')}")
-            return
-        time.sleep(2)
+    # 3. Follow Status (Server-Sent Events: pushed on change, no polling)
+    print("[2] Following Job Status...")
+    with requests.get(f"{BASE_URL}/v1/jobs/{job_id}/events", stream=True, timeout=60) as res:
+        for line in res.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            status = json.loads(line[len("data: "):])
+            s = status['status']
+            print(f"   Status: {s} {status.get('stage') or ''} {round((status.get('progress') or 0) * 100)}%")
+            if s == 'completed':
+                print("✅ Job Completed")
+                break
+            if s == 'failed':
+                print(f"❌ Job Failed: {status.get('result')}")
+                return
     
     # 4. Check Queue (Pending)
     print("[3] Checking Review Queue (Pending)...")
@@ -1,51 +1,202 @@
 # viml_generator.py
-from database import get_db_connection
+import os
+import uuid
+from typing import Iterable, Iterator, List, Optional, Tuple
+from database import get_db_connection, POINT_EVENT_SECONDS
+from viml_index import index_path_for, write_index
 
-def generate_vtt_from_db(video_filename: str) -> str:
-    """Creates a VIML-enhanced WebVTT file content from database occurrences."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT o.timestamp_seconds, o.method_used, o.confidence, p.name, p.person_id
+# The last cue has no following event to end it
+LAST_CUE_SECONDS = 2.0
+# Compact mode: evidence of the same person closer than this (seconds) is one span
+COMPACT_MAX_GAP = 2.0
+
+# (start, end, [identity, ...]) where an identity has person_id, name, confidence, method_used
+Cue = Tuple[float, float, List[dict]]
+
+def iter_cues_from_db(video_filename: str, review_status: Optional[str] = None, compact: bool = False) -> Iterator[Cue]:
+    """
+    Yields VIML cues in time order.
+    Rows are read from the cursor one at a time, so memory stays flat for any video length.
+    Pass review_status (e.g. 'approved') to include only occurrences with that status.
+    With compact=True, each person's evidence is merged into spans and overlapping
+    people share a cue (see _compact_cues); otherwise there is one cue per occurrence.
+    """
+    query = """
+        SELECT o.timestamp_seconds, COALESCE(o.end_seconds, o.timestamp_seconds + ?) AS end_seconds,
+               o.method_used, o.confidence, p.name, p.person_id
         FROM occurrences o
         JOIN persons p ON o.person_id = p.person_id
         WHERE o.video_path = ?
-        ORDER BY o.timestamp_seconds
-    """, (video_filename,))
-    
-    records = cursor.fetchall()
-    conn.close()
+    """
+    params = [POINT_EVENT_SECONDS, video_filename]
+    if review_status:
+        query += " AND o.review_status = ?"
+        params.append(review_status)
+    query += " ORDER BY o.timestamp_seconds"
     
-    if not records:
-        return "WEBVTT\n\n"
+    # Streaming responses may resume the generator on different threads
+    conn = get_db_connection(check_same_thread=False)
+    try:
+        records = conn.execute(query, tuple(params))
+        if compact:
+            yield from _compact_cues(records)
+            return
+        
+        # End time is the start of the next event, so keep one row of lookahead
+        previous = None
+        for record in records:
+            if previous is not None:
+                yield previous['timestamp_seconds'], record['timestamp_seconds'], [dict(previous)]
+            previous = record
+        
+        if previous is not None:
+            yield previous['timestamp_seconds'], previous['timestamp_seconds'] + LAST_CUE_SECONDS, [dict(previous)]
+    finally:
+        conn.close()
 
-    vtt_content = "WEBVTT\n\n"
-    for i, record in enumerate(records):
-        start_time = record['timestamp_seconds']
-        # End time is the start of the next event, or 2s after for the last one
-        end_time = records[i+1]['timestamp_seconds'] if i + 1 < len(records) else start_time + 2.0
+def _compact_cues(records: Iterable) -> Iterator[Cue]:
+    """
+    Merges time-ordered occurrence rows into per-person spans and yields one cue
+    per interval with a constant set of people on screen.
+    Each span carries its best-confidence evidence. Rows are consumed as they
+    arrive: cues are emitted up to a horizon no later row can change. A span that
+    is still open may yet get better evidence, so nothing from its start on is
+    emitted until it closes; only spans overlapping an open span are held in memory.
+    """
+    open_spans = {} # {person_id: span}
+    closed = []     # spans that ended but may still overlap unemitted time
+    emitted_until = float('-inf')
+    pending = None  # last cue, held back so it can absorb an identical neighbour
+    
+    def emit(horizon):
+        nonlocal emitted_until, pending, closed
+        spans = closed + list(open_spans.values())
+        points = sorted({emitted_until, horizon} | {
+            t for span in spans for t in (span['start'], span['end']) if emitted_until < t < horizon
+        } - {float('-inf'), float('inf')})
+        
+        for seg_start, seg_end in zip(points, points[1:]):
+            active = sorted(
+                (span for span in spans if span['start'] <= seg_start and span['end'] >= seg_end),
+                key=lambda span: (span['start'], span['person_id'])
+            )
+            if not active:
+                continue
+            identities = [span['identity'] for span in active]
+            keys = [ident['person_id'] for ident in identities]
+            if pending and pending[1] == seg_start and [i['person_id'] for i in pending[2]] == keys:
+                pending = (pending[0], seg_end, identities)
+            else:
+                if pending:
+                    yield pending
+                pending = (seg_start, seg_end, identities)
+        
+        if horizon != float('inf'):
+            emitted_until = max(emitted_until, horizon)
+        closed = [span for span in closed if span['end'] > horizon]
+    
+    for record in records:
+        start, end = record['timestamp_seconds'], record['end_seconds']
+        
+        # Spans that can no longer be extended are closed
+        for person_id in [pid for pid, span in open_spans.items() if span['end'] + COMPACT_MAX_GAP < start]:
+            closed.append(open_spans.pop(person_id))
         
-        start_vtt = _format_vtt_time(start_time)
-        end_vtt = _format_vtt_time(end_time)
+        # Nothing before this row's start, or before the start of a span that is still open, can change
+        horizon = min([start] + [span['start'] for span in open_spans.values()])
+        if horizon > emitted_until:
+            yield from emit(horizon)
         
+        span = open_spans.get(record['person_id'])
+        if span:
+            span['end'] = max(span['end'], end)
+            if (record['confidence'] or 0) > (span['identity']['confidence'] or 0):
+                span['identity'] = dict(record)
+        else:
+            open_spans[record['person_id']] = {
+                "person_id": record['person_id'],
+                "start": start,
+                "end": end,
+                "identity": dict(record)
+            }
+    
+    closed.extend(open_spans.values())
+    open_spans.clear()
+    yield from emit(float('inf'))
+    if pending:
+        yield pending
+
+def iter_vtt_from_db(video_filename: str, review_status: Optional[str] = None, compact: bool = False) -> Iterator[str]:
+    """Yields a VIML-enhanced WebVTT document cue by cue (see iter_cues_from_db)."""
+    yield "WEBVTT\n\n"
+    for index, cue in enumerate(iter_cues_from_db(video_filename, review_status, compact), 1):
+        yield _format_cue(index, cue)
+
+def generate_vtt_from_db(video_filename: str, review_status: Optional[str] = None, compact: bool = False) -> str:
+    """Creates a VIML-enhanced WebVTT file content from database occurrences."""
+    return "".join(iter_vtt_from_db(video_filename, review_status, compact))
+
+def write_viml_sidecars(video_filename: str, vtt_path: str, review_status: Optional[str] = None,
+                        compact: bool = False) -> str:
+    """
+    Writes the VIML .vtt file and its binary timeline index next to it.
+    Returns the index path (see viml_index for the format and reader).
+    Both files are written to unique temp names and renamed into place, so
+    concurrent writers never interleave and readers never see a partial file.
+    """
+    spans = []
+    temp_path = f"{vtt_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'w') as f:
+            f.write("WEBVTT\n\n")
+            for index, cue in enumerate(iter_cues_from_db(video_filename, review_status, compact), 1):
+                f.write(_format_cue(index, cue))
+                start, end, identities = cue
+                spans.extend((start, end, ident['person_id'], ident['name']) for ident in identities)
+        os.replace(temp_path, vtt_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    index_path = index_path_for(vtt_path)
+    write_index(index_path, spans)
+    return index_path
+
+def iter_chunks(parts: Iterable[str], chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Groups small string parts (e.g. cues) into chunks of roughly chunk_size characters."""
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+def _format_cue(index: int, cue: Cue) -> str:
+    """One cue; overlapping people each get a caption phrase and an <id> tag."""
+    start_time, end_time, identities = cue
+    captions = []
+    viml_tags = []
+    for record in identities:
         person_id = record['person_id']
         name = record['name']
         conf = record['confidence']
         method = record['method_used']
         
-        viml_tag = f'<id person_id="{person_id}" name="{name}" conf="{conf:.0f}" method="{method}">'
-        caption_text = f"[{method.upper()}] {name} detected."
-        
-        vtt_content += f"{i+1}\n"
-        vtt_content += f"{start_vtt} --> {end_vtt}\n"
-        vtt_content += f"{caption_text} {viml_tag}\n\n"
-        
-    return vtt_content
+        viml_tags.append(f'<id person_id="{person_id}" name="{name}" conf="{conf:.0f}" method="{method}">')
+        captions.append(f"[{method.upper()}] {name} detected.")
+    
+    start_vtt = _format_vtt_time(start_time)
+    end_vtt = _format_vtt_time(end_time)
+    return f"{index}\n{start_vtt} --> {end_vtt}\n{' '.join(captions)} {' '.join(viml_tags)}\n\n"
 
 def _format_vtt_time(seconds: float) -> str:
     """Converts seconds to WebVTT timestamp format HH:MM:SS.sss"""
     millis = int((seconds - int(seconds)) * 1000)
     mins, secs = divmod(int(seconds), 60)
     hours, mins = divmod(mins, 60)
-    return f"{hours:02}:{mins:02}:{secs:02}.{millis:03}"
\ No newline at end of file
+    return f"{hours:02}:{mins:02}:{secs:02}.{millis:03}"
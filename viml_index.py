@@ -0,0 +1,272 @@
+# viml_index.py
+# Compact, memory-mappable timeline index written next to each VIML .vtt file.
+#
+# Layout (little-endian, every section 8-byte aligned):
+#   header      magic "VIMLIDX\0", version, span_count N, person_count M, strings_size S
+#   starts      float64[N]  span start times, ascending
+#   ends        float64[N]  span end times
+#   max_ends    float64[N]  running max of ends; lets "present at t" binary-search its lower bound
+#   span_person uint32[N]   index into the person table
+#   by_person   uint32[N]   span indices grouped by person, ascending start within a person
+#   persons     M x (person_id int64, first uint32, count uint32, name_offset uint32, name_length uint32)
+#   strings     S bytes of UTF-8 names
+import bisect
+import mmap
+import os
+import re
+import struct
+import sys
+import uuid
+from array import array
+from typing import Iterable, List, Optional, Tuple
+
+MAGIC = b"VIMLIDX\0"
+VERSION = 1
+INDEX_EXTENSION = ".vimlidx"
+
+_HEADER = struct.Struct("<8sIIII")
+_PERSON = struct.Struct("<qIIII")
+
+# (start, end, person_id, name)
+Span = Tuple[float, float, int, str]
+
+def index_path_for(vtt_path: str) -> str:
+    """The sidecar path for a .vtt file: 'video.mp4.vtt' -> 'video.mp4.vimlidx'."""
+    return os.path.splitext(vtt_path)[0] + INDEX_EXTENSION
+
+def write_index(index_path: str, spans: Iterable[Span]):
+    """Writes the binary index for the given spans (any order)."""
+    spans = sorted(spans, key=lambda s: (s[0], s[1]))
+
+    starts = array('d', (s[0] for s in spans))
+    ends = array('d', (s[1] for s in spans))
+    max_ends = array('d')
+    running = float('-inf')
+    for end in ends:
+        running = max(running, end)
+        max_ends.append(running)
+
+    person_index = {} # {person_id: index in person table}
+    names = {}
+    span_person = array('I')
+    for _, _, person_id, name in spans:
+        if person_id not in person_index:
+            person_index[person_id] = len(person_index)
+            names[person_id] = name or ""
+        span_person.append(person_index[person_id])
+
+    # Spans are already in start order, so a stable sort by person keeps starts ascending
+    by_person = array('I', sorted(range(len(spans)), key=lambda i: span_person[i]))
+
+    strings = bytearray()
+    person_records = bytearray()
+    first = 0
+    counts = [0] * len(person_index)
+    for idx in span_person:
+        counts[idx] += 1
+    for person_id, idx in person_index.items():
+        encoded = names[person_id].encode("utf-8")
+        person_records += _PERSON.pack(person_id, first, counts[idx], len(strings), len(encoded))
+        strings += encoded
+        first += counts[idx]
+
+    header = _HEADER.pack(MAGIC, VERSION, len(spans), len(person_index), len(strings))
+    if sys.byteorder != "little":
+        for arr in (starts, ends, max_ends, span_person, by_person):
+            arr.byteswap()
+
+    # Write beside the target and rename, so readers never map a partial file;
+    # the temp name is unique so concurrent writers don't share it
+    temp_path = f"{index_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            for arr in (starts, ends, max_ends, span_person, by_person):
+                arr.tofile(f)
+            if len(span_person) % 2:
+                f.write(b"\0" * 4) # pad the uint32 arrays back to 8-byte alignment
+            f.write(person_records)
+            f.write(strings)
+        os.replace(temp_path, index_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+class VimlIndex:
+    """
+    Read-only view of a .vimlidx file.
+    The file is memory-mapped and the arrays are read in place, so opening an
+    index costs the same for a 10-second clip and a 10-hour archive.
+    """
+
+    def __init__(self, index_path: str):
+        self._file = open(index_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.span_count, self.person_count, strings_size = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{index_path} is not a VIML index (version {VERSION})")
+
+        n = self.span_count
+        offset = _HEADER.size
+        self.starts, offset = self._array('d', offset, n)
+        self.ends, offset = self._array('d', offset, n)
+        self._max_ends, offset = self._array('d', offset, n)
+        self._span_person, offset = self._array('I', offset, n)
+        self._by_person, offset = self._array('I', offset, n)
+        offset += 4 * (n % 2)
+
+        self._persons_offset = offset
+        self._strings_offset = offset + self.person_count * _PERSON.size
+        self._person_index = None
+
+    def _array(self, typecode: str, offset: int, count: int):
+        size = array(typecode).itemsize * count
+        if sys.byteorder == "little":
+            view = memoryview(self._map)[offset:offset + size].cast(typecode)
+        else:
+            view = array(typecode, self._map[offset:offset + size])
+            view.byteswap()
+        return view, offset + size
+
+    def close(self):
+        # Views into the map must be released before it can be closed
+        for name in ("starts", "ends", "_max_ends", "_span_person", "_by_person"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.span_count
+
+    # --- Person table ---
+
+    def _person(self, idx: int) -> Tuple[int, int, int, str]:
+        person_id, first, count, name_offset, name_length = _PERSON.unpack_from(
+            self._map, self._persons_offset + idx * _PERSON.size)
+        start = self._strings_offset + name_offset
+        name = self._map[start:start + name_length].decode("utf-8")
+        return person_id, first, count, name
+
+    def persons(self) -> List[Tuple[int, str]]:
+        """All (person_id, name) pairs in the index."""
+        persons = []
+        for i in range(self.person_count):
+            person_id, _, _, name = self._person(i)
+            persons.append((person_id, name))
+        return persons
+
+    def _lookup_person(self, person_id: int) -> Optional[int]:
+        if self._person_index is None:
+            self._person_index = {
+                _PERSON.unpack_from(self._map, self._persons_offset + i * _PERSON.size)[0]: i
+                for i in range(self.person_count)
+            }
+        return self._person_index.get(person_id)
+
+    # --- Queries ---
+
+    def span(self, i: int) -> Span:
+        person_id, _, _, name = self._person(self._span_person[i])
+        return self.starts[i], self.ends[i], person_id, name
+
+    def spans_between(self, t0: float, t1: float) -> List[Span]:
+        """Spans overlapping [t0, t1]; a span [start, end) counts if start <= t1 and end > t0."""
+        hi = bisect.bisect_right(self.starts, t1)
+        lo = bisect.bisect_right(self._max_ends, t0)
+        return [self.span(i) for i in range(lo, hi) if self.ends[i] > t0]
+
+    def present_at(self, t: float) -> List[Tuple[int, str]]:
+        """Distinct (person_id, name) present at time t."""
+        return self.present_between(t, t)
+
+    def present_between(self, t0: float, t1: float) -> List[Tuple[int, str]]:
+        """Distinct (person_id, name) present at any point in [t0, t1]."""
+        seen = {}
+        for _, _, person_id, name in self.spans_between(t0, t1):
+            seen.setdefault(person_id, name)
+        return list(seen.items())
+
+    def next_appearance(self, person_id: int, t: float) -> Optional[Tuple[float, float]]:
+        """(start, end) of the person's first span starting after t, or None."""
+        idx = self._lookup_person(person_id)
+        if idx is None:
+            return None
+        _, first, count, _ = self._person(idx)
+
+        # Binary search over this person's slice of by_person (starts ascending)
+        lo, hi = first, first + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.starts[self._by_person[mid]] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == first + count:
+            return None
+        span_idx = self._by_person[lo]
+        return self.starts[span_idx], self.ends[span_idx]
+
+    def appearances(self, person_id: int) -> List[Tuple[float, float]]:
+        """All (start, end) spans of a person, in time order."""
+        idx = self._lookup_person(person_id)
+        if idx is None:
+            return []
+        _, first, count, _ = self._person(idx)
+        return [(self.starts[i], self.ends[i]) for i in self._by_person[first:first + count]]
+
+# --- VIML (WebVTT) -> index conversion ---
+
+_CUE_TIMING = re.compile(r"((?:\d+:)?\d{2}:\d{2}\.\d{3})[ \t]+-->[ \t]+((?:\d+:)?\d{2}:\d{2}\.\d{3})")
+_ID_TAG = re.compile(r"<id\s([^>]*)>")
+_ATTRIBUTE = re.compile(r'(\w+)="([^"]*)"')
+
+def _parse_vtt_time(value: str) -> float:
+    """'HH:MM:SS.mmm' or 'MM:SS.mmm' -> seconds."""
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def iter_vtt_spans(vtt_text: str) -> Iterable[Span]:
+    """Yields one span per <id> tag in each cue of a VIML WebVTT document."""
+    timings = list(_CUE_TIMING.finditer(vtt_text))
+    for i, timing in enumerate(timings):
+        payload_end = timings[i + 1].start() if i + 1 < len(timings) else len(vtt_text)
+        start = _parse_vtt_time(timing.group(1))
+        end = _parse_vtt_time(timing.group(2))
+        for tag in _ID_TAG.finditer(vtt_text, timing.end(), payload_end):
+            attributes = dict(_ATTRIBUTE.findall(tag.group(1)))
+            if "person_id" in attributes:
+                yield start, end, int(attributes["person_id"]), attributes.get("name", "")
+
+def convert_vtt(vtt_path: str, index_path: Optional[str] = None) -> str:
+    """Builds the index for an existing VIML .vtt file; returns the index path."""
+    index_path = index_path or index_path_for(vtt_path)
+    with open(vtt_path, encoding="utf-8") as f:
+        write_index(index_path, iter_vtt_spans(f.read()))
+    return index_path
+
+if __name__ == "__main__":
+    # Usage:
+    #   python viml_index.py convert video.mp4.vtt [video.mp4.vimlidx]
+    #   python viml_index.py at video.mp4.vimlidx 754.2
+    #   python viml_index.py next video.mp4.vimlidx <person_id> 754.2
+    command, path, *args = sys.argv[1:]
+    if command == "convert":
+        print(convert_vtt(path, *args))
+    elif command == "at":
+        with VimlIndex(path) as index:
+            for person_id, name in index.present_at(float(args[0])):
+                print(f"{person_id}\t{name}")
+    elif command == "next":
+        with VimlIndex(path) as index:
+            print(index.next_appearance(int(args[0]), float(args[1])))
@@ -1,13 +1,29 @@
 # worker.py
 import os
-from tasks import celery_app
+from tasks import celery_app, lane_queues, PRIORITIES, PIPELINE_QUEUES
+import metrics
 
 if __name__ == '__main__':
     # Start the worker
     # Note: In production, you would run this via the 'celery' command line tool.
     # This script is a convenience wrapper or for debugging.
+    # VIML_WORKER_QUEUES picks the pipeline stages this worker runs (default: all),
+    # e.g. "face" on GPU hosts and "celery,proxy,ocr,audio,correlate" elsewhere.
+    # VIML_WORKER_LANES picks the priority lanes (default: all); run some workers
+    # with VIML_WORKER_LANES=high to keep capacity free for live news.
+    # Live streams are not in the default: each one holds a worker process for as
+    # long as it runs, so they get their own workers (VIML_WORKER_QUEUES=live).
+    queues = os.environ.get("VIML_WORKER_QUEUES", ",".join(PIPELINE_QUEUES)).split(",")
+    lanes = os.environ.get("VIML_WORKER_LANES", ",".join(PRIORITIES)).split(",")
     argv = [
         'worker',
         '--loglevel=INFO',
+        '-Q', ",".join(lane_queues(queues, lanes)),
     ]
+    if os.environ.get("VIML_WORKER_CONCURRENCY"):
+        argv += ['--concurrency', os.environ["VIML_WORKER_CONCURRENCY"]]
+    # Tasks run in the pool's child processes; set PROMETHEUS_MULTIPROC_DIR so
+    # their metrics reach this endpoint (see metrics.py)
+    if os.environ.get("VIML_METRICS_PORT"):
+        metrics.serve(int(os.environ["VIML_METRICS_PORT"]))
     celery_app.worker_main(argv)